@@ -18,37 +18,84 @@
 #
 debug = False
 
-from resources.lib.utils.debugger import startdebugger
-
 if debug:
+    from resources.lib.utils.debugger import startdebugger
     startdebugger()
 
 import sys
 import os
 import threading
+import time
 import Queue
 from timeit import default_timer as timer
 import xbmc
 import xbmcgui
+import xbmcaddon
 import json
-from resources.lib.utils.kodilogging import KodiLogger
+from resources.lib.utils.kodilogging import KodiLogger, logging_from_settings
+from resources.lib.dupdetect import DETECTORS, get_detector
+from resources.lib.options import options_from_settings
+from resources.lib.resultlog import BinaryResultWriter, CSVHEADER, format_csv_row
+from resources.lib.sweep import SweepCell, SweepPlan, plan_from_settings
+from resources.lib.calibration import OverheadCalibrator, format_record
+from resources.lib.pipeline import FramePipeline, QUEUESIZE
+from resources.lib.framepool import EMPTY, FramePool, format_stats
+from resources.lib.utils.lrucache import LRUCache
+from resources.lib.controller import AdaptiveController
 
 log = KodiLogger.log
 
+GETACTIVEPLAYERS = '{"jsonrpc": "2.0", "method": "Player.GetActivePlayers", "id": 1}'
+GETITEM = ('{"jsonrpc": "2.0", "method": "Player.GetItem", "params": { "properties": ["title", "album",'
+           ' "artist", "season", "episode", "duration", "showtitle", "tvshowid", "file",  "streamdetails"],'
+           ' "playerid": %s }, "id": "VideoGetItem"}')
+
+def output_basename():
+    if sys.platform.lower().startswith('win'):
+        return r'C:\Temp\output'
+    else:
+        return os.path.expanduser(r'~/.kodi/output')
+
 
 class Player(xbmc.Player):
-    def __init__(self):
+    infocache = LRUCache(maxsize=64)  # normalised video info by file, shared across Player instances
+
+    def __init__(self, detector=None, waittimeout=2.0):
         super(Player, self).__init__()
         self.capture_thread = None
         self.info = None
+        if detector is None:
+            detector = xbmcaddon.Addon().getSetting(u'detector') or u'sampled'
+        if detector not in DETECTORS:
+            log(xbmc.LOGWARNING, u'Unknown duplicate detector %s, using sampled', detector)
+            detector = u'sampled'
+        self.detector = detector
+        self.waittimeout = waittimeout  # seconds to wait for isPlaying before asking for metadata
+        self.getitemrequests = {}
+        self.infotime = 0.0
+        self.infocached = False
+        self.metrics_server = None
+        if xbmcaddon.Addon().getSetting(u'metrics') == u'true':
+            import socket
+            from resources.lib.metrics import server_from_settings
+            try:
+                self.metrics_server = server_from_settings(xbmcaddon.Addon().getSetting, self.snapshot)
+            except (socket.error, ValueError) as e:
+                log(xbmc.LOGWARNING, u'Metrics endpoint not started: %s', unicode(e))
+            else:
+                log(msg=u'metrics served at %s' % self.metrics_server.address)
+
+    def getItemRequest(self, playerid):
+        try:
+            return self.getitemrequests[playerid]
+        except KeyError:
+            request = self.getitemrequests[playerid] = GETITEM % playerid
+            return request
 
     def getVideoInfo(self, playerid):
         try:
-            info = json.loads(xbmc.executeJSONRPC(
-                '{"jsonrpc": "2.0", "method": "Player.GetItem", "params": { "properties": ["title", "album",'
-                ' "artist", "season", "episode", "duration", "showtitle", "tvshowid", "file",  "streamdetails"],'
-                ' "playerid": %s }, "id": "VideoGetItem"}' % playerid))['result']['item']
-        except RuntimeError:
+            info = json.loads(xbmc.executeJSONRPC(self.getItemRequest(playerid)))['result']['item']
+        except (RuntimeError, KeyError):
             self.info = {}
         else:
             items = [u'label', u'id', u'tvshowid']
@@ -97,6 +144,11 @@ class Player(xbmc.Player):
                     info[u'aspectRatio'] = unicode(int((sd[u'video'][0][u'aspect'] * 100.0) + 0.5) / 100.0)
                 except (KeyError, IndexError):
                     info[u'aspectRatio'] = u'unknown'
+                if not info.get(u'duration'):
+                    try:
+                        info[u'duration'] = sd[u'video'][0][u'duration']
+                    except (KeyError, IndexError):
+                        pass
             if info[u'mediaType'] == u'episode':
                 items = [u'episode', u'season']
                 for item in items:
@@ -114,11 +166,29 @@ class Player(xbmc.Player):
             self.info = info
 
     def getInfo(self):
-        tries = 0
-        while tries < 8 and self.isPlaying() is False:
-            xbmc.sleep(250)
+        t0 = timer()
+        deadline = t0 + self.waittimeout
+        while self.isPlaying() is False and timer() < deadline:
+            xbmc.sleep(50)
+        try:
+            fn = self.getPlayingFile()
+        except RuntimeError:
+            fn = None
+        info = self.infocache.get(fn) if fn else None
+        self.infocached = info is not None
+        if info is not None:
+            self.info = dict(info)
+        else:
+            self.fetchInfo()
+            if fn and self.info:
+                self.infocache.put(fn, dict(self.info))
+        self.infotime = timer() - t0
+        log(msg=u'video info %s in %s ms' % (u'from cache' if self.infocached else u'fetched',
+                                             "{0:.2f}".format(self.infotime * 1000.0)))
+
+    def fetchInfo(self):
         try:
-            player = json.loads(xbmc.executeJSONRPC('{"jsonrpc": "2.0", "method": "Player.GetActivePlayers", "id": 1}'))
+            player = json.loads(xbmc.executeJSONRPC(GETACTIVEPLAYERS))
         except RuntimeError:
             playerid = -1
             playertype = 'none'
@@ -126,7 +196,7 @@ class Player(xbmc.Player):
             try:
                 playerid = player['result'][0]['playerid']
                 playertype = player['result'][0]['type']
-            except KeyError:
+            except (KeyError, IndexError):
                 playerid = -1
                 playertype = 'none'
         if playertype == 'video':
@@ -134,60 +204,268 @@ class Player(xbmc.Player):
         else:
             self.info = {}
 
+    def videoSize(self):
+        '''
+        Video width and height from the stream details, falling back to the player's process info
+        and then to 1080 lines at the known aspect ratio
+        '''
+        try:
+            return [int(self.info[u'width']), int(self.info[u'height'])]
+        except (KeyError, ValueError, TypeError):
+            pass
+        try:
+            width = int(xbmc.getInfoLabel('Player.Process(VideoWidth)').replace(',', ''))
+            height = int(xbmc.getInfoLabel('Player.Process(VideoHeight)').replace(',', ''))
+        except ValueError:
+            pass
+        else:
+            if width > 0 and height > 0:
+                return [width, height]
+        try:
+            aspect = float(self.info[u'aspectRatio'])
+        except (KeyError, ValueError, TypeError):
+            aspect = 16.0 / 9.0
+        log(msg=u'video size unknown, assuming 1080 lines at aspect %s' % aspect)
+        return [int(1080 * aspect + 0.5) & ~1, 1080]
+
+    def videoRate(self):
+        '''
+        Content frame rate, 0.0 when unknown. Stream details carry no frame rate, so it comes from the
+        player's process info and is kept with the rest of the video info.
+        '''
+        if u'fps' not in self.info:
+            try:
+                self.info[u'fps'] = float(xbmc.getInfoLabel('Player.Process(VideoFPS)').replace(',', ''))
+            except ValueError:
+                return 0.0
+        return self.info[u'fps']
+
     def onPlayBackStarted(self):
         if self.isPlayingVideo():
             self.getInfo()
-            videoinfo = [int(self.info['width']), int(self.info['height'])]
+            videoinfo = self.videoSize()
+            sourcefps = self.videoRate()
             if isinstance(self.capture_thread, threading.Thread):  # Make sure that thread isn't already running
-                if self.capture_thread.is_alive:
-                    self.capture_thread.join(5)
-                if self.capture_thread.is_alive:
-                    log(msg='Error')
+                if self.capture_thread.is_alive():
+                    self.capture_thread.abort(timeout=5)
+                if self.capture_thread.is_alive():
+                    log(msg=u'Previous capture (%s) did not stop within 5 s, not starting a new one' %
+                            self.capture_thread.name)
                     return
-            self.capture_thread = CaptureThread(videoinfo, self)
+            if xbmcaddon.Addon().getSetting(u'broker') == u'true':
+                self.capture_thread = BrokerCapture(videoinfo, self, detector=self.detector)
+            else:
+                self.capture_thread = CaptureThread(videoinfo, self, detector=self.detector, sourcefps=sourcefps)
             self.capture_thread.start()
 
     def onPlayBackEnded(self):
-        if isinstance(self.capture_thread, CaptureThread):
+        if isinstance(self.capture_thread, threading.Thread):
             self.capture_thread.abort()
         self.capture_thread = None
 
     def onPlayBackStopped(self):
         self.onPlayBackEnded()
 
+    def snapshot(self):
+        '''
+        Metrics of the running capture, for the metrics endpoint
+        '''
+        capture_thread = self.capture_thread
+        if capture_thread is None or not capture_thread.is_alive():
+            return {u'capturing': 0}
+        return capture_thread.metrics()
+
+    def close(self):
+        self.onPlayBackEnded()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+            self.metrics_server = None
+
 
 class BreakLoop(Exception):
     pass
 
 
+STUB = bytearray(b' ')  # stands in for an image where no capture is made
+
+
 class CaptureThread(threading.Thread):
     '''
     Run the capture routine in a separate thread and call abort if playback ends
     '''
 
-    def __init__(self, videoinfo, player):
+    def __init__(self, videoinfo, player, detector=u'sampled', plan=None, basename=None, recalibrate=None,
+                 pipelined=None, workers=None, framepool=None, adaptive=None, target_fps=None, cpu_budget=None,
+                 analyze=None, segments=None, framedelta=None, sourcefps=0.0, session=None,
+                 trace=None, consumer_process=None, record=None):
         self.player = player
         super(CaptureThread, self).__init__(name='Capture')
         self.videoinfo = videoinfo
+        addon = xbmcaddon.Addon()
+        if session is None:
+            from resources.lib.session import session_from_settings
+            try:
+                session = session_from_settings(addon.getSetting,
+                                                os.path.join(os.path.dirname(output_basename()), u'sessions'))
+            except (IOError, OSError) as e:
+                log(msg=u'Session mode disabled, could not create the session directory: %s' % unicode(e))
+        self.session = session or None  # False turns session mode off regardless of settings
+        self.videometa = dict(getattr(player, 'info', None) or {})
+        if self.session is not None and basename is None:
+            basename = self.session.new_run(self.videometa.get(u'title') or
+                                            os.path.basename(self.videometa.get(u'fileName', u'')))
+        if plan is None:
+            plan = plan_from_settings(addon.getSetting)
+        self.plan = plan
+        options = options_from_settings(addon.getSetting, recalibrate=recalibrate, pipelined=pipelined,
+                                        workers=workers, consumer_process=consumer_process, framepool=framepool,
+                                        adaptive=adaptive, target_fps=target_fps, cpu_budget=cpu_budget,
+                                        analysis=analyze, segments=segments, framedelta=framedelta, record=record,
+                                        trace=trace)
+        self.recalibrate = options[u'recalibrate']  # seconds between overhead calibrations, checked between cells
+        self.pipelined = options[u'pipelined']  # keep the next capture request in flight while frames are consumed
+        self.workers = max(1, options[u'workers'])
+        consumer_process = options[u'consumer_process']
+        if consumer_process and not hasattr(os, 'fork'):
+            log(msg=u'consumer process needs fork, consuming frames in this process')
+            consumer_process = False
+        self.consumer_process = consumer_process  # duplicate check, frame delta and analysis in a child process
+        self.framepool = options[u'framepool']
+        self.pool = None
+        self.adaptive = options[u'adaptive']  # let AdaptiveController set capture size and loopsleep
+        self.target_fps = options[u'target_fps']
+        self.cpu_budget = options[u'cpu_budget']
+        self.controller = None
+        self.analyze = options[u'analysis']  # run the colour analysis stage on unique frames
+        self.segments = max(1, options[u'segments'])
+        self.framedelta = options[u'framedelta']
+        self.delta = None  # FrameDelta, change and tearing metrics per frame
+        self.sourcefps = sourcefps
+        self.cadence = None  # CadenceAnalyzer when the source frame rate is known
+        self.analysis = None
+        self.time0 = 0.0
+        self.finished = 0
+        self.record = options[u'record']  # off, timing or frames: write a trace for replay
+        self.recorder = None
+        self.tracer = None  # phase timings of every frame, exported as a Chrome trace
+        if options[u'trace']:
+            from resources.lib.tracing import Tracer
+            self.tracer = Tracer(capacity=max(1024, options[u'trace_events']))
         self.rc = xbmc.RenderCapture()
+        if self.tracer is not None:
+            from resources.lib.tracing import TracedRenderCapture
+            self.rc = TracedRenderCapture(self.rc, self.tracer)
         self.abort_evt = threading.Event()
-        self.capture_monitor_thread = CaptureMonitorThread()
-        self.resultQ = self.capture_monitor_thread.resultQ
+        self.detector = get_detector(detector)
+        self.capture_monitor_thread = CaptureMonitorThread(detector=self.detector.name, basename=basename,
+                                                           session=self.session, tracer=self.tracer)
+        self.put_result = self.capture_monitor_thread.put
         if hasattr(self.rc, 'waitForCaptureStateChangeEvent'):
             self.legacy = True
         else:
             self.legacy = False
         self.dropped = 0
-        self.capture_monitor_thread.start()
+        self.counter = 0
+        self.uniqueframes = 0
         self.dummyQ = Queue.Queue()
-        self.lastimage = bytearray(b'')
+        self.requested = (0, 0)  # size of the capture request in flight when pipelined
+        self.imagesize = (0, 0)  # size of the image get_framePipelined returned last
+        self.cellstats = None  # of the cell being captured, read by metrics()
+
+    def open_stages(self):
+        '''
+        Frame delta, cadence analysis and the colour analysis stage, whichever are enabled
+        '''
+        # imported here rather than at service start: these pull in NumPy
+        if self.framedelta and not self.consumer_process:
+            from resources.lib.framedelta import FrameDelta
+            self.delta = FrameDelta()
+        if self.sourcefps > 0:
+            from resources.lib.cadence import CadenceAnalyzer
+            self.cadence = CadenceAnalyzer(self.sourcefps)
+        if self.analyze and not self.consumer_process:
+            from resources.lib import analysis
+            try:
+                analyzer = analysis.FrameAnalyzer(segments=self.segments)
+            except ImportError as e:
+                log(msg=u'analysis disabled: %s' % unicode(e))
+            else:
+                self.analysis = analysis.AnalysisStage(analyzer, workers=self.workers, maxsize=QUEUESIZE,
+                                                       output=open(self.capture_monitor_thread.basename +
+                                                                   '_analysis.csv', 'w'))
+        if self.record != u'off':
+            from resources.lib.replay import TraceWriter
+            fn = self.capture_monitor_thread.basename + '_capture.trace'
+            meta = {u'detector': self.detector.name, u'videowidth': self.videoinfo[0],
+                    u'videoheight': self.videoinfo[1], u'sourcefps': self.sourcefps, u'plan': self.plan.as_dict(),
+                    u'video': self.videometa, u'started': time.time()}
+            try:
+                self.recorder = TraceWriter(fn, meta, frames=self.record == u'frames', cells=self.plan.cells)
+            except (IOError, OSError) as e:
+                log(msg=u'Could not record the capture: %s' % unicode(e))
+
+    def open_pipeline(self, primed, slotsize):
+        '''
+        The consumer for duplicate checks and frame deltas: a child process, consumer threads when primed,
+        or None to check frames inline. slotsize is the largest frame the child process takes in shared memory.
+        '''
+        if self.consumer_process:
+            childanalysis = None
+            if self.analyze:
+                childanalysis = (self.segments, self.capture_monitor_thread.basename + '_analysis.csv')
+            from resources.lib.procpipe import ProcessPipeline
+            pipeline = ProcessPipeline(self.detector, self.finish_frame, slotsize, framedelta=self.framedelta,
+                                       analysis=childanalysis)
+            log(msg=u'%s capture with a consumer process' % (u'pipelined' if primed else u'serial'))
+            return pipeline
+        if primed:
+            log(msg=u'pipelined capture with %i consumer threads' % self.workers)
+            return FramePipeline(self.detector, self.finish_frame, workers=self.workers, tracer=self.tracer)
+        return None
+
+    def close_stages(self, pipeline):
+        '''
+        Drains the consumer and the analysis stage and adds their summaries to the run metadata
+        '''
+        if pipeline is not None:
+            pipeline.close()
+            log(msg=u'consumer queue high-water mark = %i' % pipeline.highwater)
+            if self.consumer_process and pipeline.analysis is not None:
+                from resources.lib.analysis import format_summary as format_analysis
+                self.capture_monitor_thread.meta[u'analysis'] = pipeline.analysis
+                for line in format_analysis(pipeline.analysis):
+                    log(msg=line)
+        if self.analysis is not None:
+            self.analysis.close()
+            from resources.lib.analysis import format_summary as format_analysis
+            self.capture_monitor_thread.meta[u'analysis'] = self.analysis.summary()
+            for line in format_analysis(self.analysis.summary()):
+                log(msg=line)
+        if self.cadence is not None:
+            self.capture_monitor_thread.meta[u'cadence'] = self.cadence.summary()
+        if self.recorder is not None:
+            self.recorder.close()
+            log(msg=u'%i frames recorded to %s (%i stored, writer queue high-water mark %i)' % (
+                self.recorder.count, self.recorder.fn, self.recorder.written, self.recorder.highwater))
+
+    def log_totals(self, timeout):
+        log(msg=u'timeout = %s' % timeout)
+        log(msg=u'counter = %s' % self.counter)
+        log(msg=u'dropped = %s' % self.dropped)
+        log(msg=u'elapsed = %s' % self.elapsed)
+        log(msg=u'framerate = %s' % str(self.counter / self.elapsed))
+        log(msg=u'uniqueframerate = %s' % str(self.uniqueframes / self.elapsed))
+        if self.cadence is not None:
+            from resources.lib.cadence import format_summary as format_cadence
+            log(msg=format_cadence(self.cadence.summary()))
+        else:
+            log(msg=u'source frame rate unknown, no cadence analysis')
 
     def run(self):
-        counter = 0
-        uniqueframes = 0
+        from resources.lib.cellstats import CellStats
+        self.open_stages()
         timeout = 1000
-        width = self.videoinfo[0] / 2
-        height = self.videoinfo[1] / 2
+        width, height = self.plan.cells[0].size(*self.videoinfo)
         if self.legacy:
             self.rc.capture(width, height, xbmc.CAPTURE_FLAG_CONTINUOUS)
             capturefn = self.get_frameLegacy
@@ -197,58 +475,272 @@ class CaptureThread(threading.Thread):
             capturefn = self.get_frameKrypton
             overheadfn = self.get_frameKryptonOverhead
             log(msg=u'krypton capture')
-        overheadtotal = 0.0
-        for i in xrange(0, 100):
-            capturesleepms = 5 / 1000
-            t0 = timer()
-            _ = overheadfn(width, height, 5)
-            te = timer() - t0 - capturesleepms
-            overheadtotal += te
-        overhead = overheadtotal / 100.0
+        if self.framepool and self.consumer_process:
+            log(msg=u'frame pool not used, frames are copied to the consumer process')
+        elif self.framepool:
+            # enough slots for the consumer and analysis queues, their workers and the previous frame
+            slots = 3
+            if self.pipelined:
+                slots += QUEUESIZE + self.workers
+            if self.analysis is not None:
+                slots += QUEUESIZE + self.workers
+            if self.adaptive:
+                framesize = self.videoinfo[0] * self.videoinfo[1] * 4  # the controller may pick any size up to this
+            else:
+                framesize = 4 * max(w * h for w, h in (cell.size(*self.videoinfo) for cell in self.plan.cells))
+            self.pool = FramePool(framesize, slots=slots)
+        if self.adaptive:
+            first = self.plan.cells[0]
+            self.controller = AdaptiveController(self.videoinfo[0], self.videoinfo[1], scale=first.scale,
+                                                 loopsleep=first.loopsleep, target_fps=self.target_fps,
+                                                 cpu_budget=self.cpu_budget)
+            log(msg=u'adaptive capture: target fps %s, busy budget %s' % (self.target_fps, self.cpu_budget))
+        primed = False  # a capture request is kept in flight
+        if self.pipelined:
+            if self.legacy:
+                log(msg=u'pipelined capture needs the Krypton api, using serial capture')
+            else:
+                capturefn = self.get_framePipelined
+                primed = True
+        pipeline = self.open_pipeline(primed, 4 * max(w * h for w, h in (cell.size(*self.videoinfo)
+                                                                         for cell in self.plan.cells)))
+        calibrator = OverheadCalibrator(overheadfn, (timeout, width, height))
+        record = calibrator.calibrate()
+        overhead = record[u'overhead']
         self.dropped = 0
-        log(msg='overhead for capture function: %s ms' % str(overhead * 1000.0))
-        log(msg=u'starting capture w=%i, h=%i' % (width, height))
-        time0 = timer()
+        log(msg=u'calibration: %s' % format_record(record))
+        log(msg=u'starting capture sweep of %i cells' % len(self.plan.cells))
+        log(msg=u'duplicate detector: %s' % self.detector.name)
+        self.capture_monitor_thread.meta.update({u'api': u'legacy' if self.legacy else u'krypton',
+                                                 u'pipelined': primed,
+                                                 u'consumer': (u'process' if self.consumer_process else
+                                                               u'threads' if pipeline is not None else u'inline'),
+                                                 u'videowidth': self.videoinfo[0], u'videoheight': self.videoinfo[1],
+                                                 u'sourcefps': self.sourcefps,
+                                                 u'overhead': overhead, u'calibration': calibrator.records,
+                                                 u'plan': self.plan.as_dict(),
+                                                 u'started': time.time()})
+        self.detector.reset()
+        summaries = []
+        time0 = self.time0 = timer()
+        if self.consumer_process:
+            pipeline.origin = time0
+        trace = self.tracer
         flagdone = False
-        while not self.abort_evt.is_set():
-            try:
-                # for loopsleep in range(20, -1, -5):  # sleep in between frames
-                loopsleep = 5
-                # log(msg=u'xbmc.sleep(%i)' % loopsleep)
-                capturesleep = 0
-                # for capturesleep in xrange(10, -1, -5):  # sleep between capture request and getImage
-                capturesleepms = capturesleep / 1000.0
-                for timeout in xrange(80, 9, -10):  # timeout parameter for getImage
-                    for frame in xrange(1, 251):
+        cellstats = None
+        try:
+            for cells in self.plan.passes():
+                for cell in cells:
+                    if 0 < self.recalibrate <= time.time() - calibrator.records[-1][u'time']:
+                        record = calibrator.calibrate()
+                        overhead = record[u'overhead']
+                        log(msg=u'recalibration: %s' % format_record(record))
+                    loopsleep = cell.loopsleep
+                    size = cell.size(*self.videoinfo)
+                    if self.controller is not None:
+                        loopsleep = self.controller.loopsleep
+                        size = self.controller.size()
+                    capturesleep = cell.capturesleep  # sleep between capture request and getImage
+                    capturesleepms = capturesleep / 1000.0
+                    timeout = cell.timeout  # timeout parameter for getImage
+                    if size != (width, height):
+                        width, height = size
+                        if self.legacy:
+                            self.rc.capture(width, height, xbmc.CAPTURE_FLAG_CONTINUOUS)
+                    if primed:
+                        self.rc.capture(width, height)  # prime the first request of the cell
+                        self.requested = (width, height)
+                    for _ in xrange(0, cell.warmup):
+                        if self.abort_evt.is_set():
+                            raise BreakLoop
+                        capturefn(timeout, width, height, sleep=capturesleep)
+                        xbmc.sleep(loopsleep)
+                    cellstats = self.cellstats = CellStats(cell, width, height, sourcefps=self.sourcefps)
+                    if pipeline is not None:
+                        pipeline.reset()
+                    else:
+                        self.detector.reset()
+                    for frame in xrange(1, cell.frames + 1):
                         if self.abort_evt.is_set():
                             raise BreakLoop
                         t0 = timer()
                         image = capturefn(timeout, width, height, sleep=capturesleep)
                         te = timer() - t0 - overhead - capturesleepms  # subtract the amount of xbmc.sleep
-                        duplicate = (image == self.lastimage)
-                        if not duplicate and len(image) > 1:
-                            uniqueframes += 1
-                        counter += 1
-                        self.resultQ.put(
-                            [t0 - time0, loopsleep, timeout, capturesleep, frame, te, len(image), duplicate])
-                        self.lastimage = image
-                        xbmc.sleep(loopsleep)  # unclear if this helps avoid GIL issues
-            except BreakLoop:
-                pass
-            if flagdone is False:
-                flagdone = True
-                xbmcgui.Dialog().notification(u'testRenderCapture', u'Adequate data gathered for analysis')
+                        self.counter += 1
+                        if self.pool is not None:
+                            image = self.pool.store(image)
+                        framewidth, frameheight = self.imagesize if primed else (width, height)
+                        row = [t0 - time0, loopsleep, timeout, capturesleep, frame, te, len(image), False, 0.0,
+                               framewidth, frameheight, -1.0, -1.0, -1.0]
+                        log(xbmc.LOGDEBUG, u'frame %i: %.3f ms, %i bytes', frame, te * 1000.0, row[6])
+                        if trace is not None:
+                            trace.add(u'frame', t0, timer())
+                        if pipeline is not None:
+                            t1 = timer()
+                            pipeline.submit((row, cellstats, image), image)
+                            if trace is not None:
+                                trace.add(u'submit', t1, timer())
+                        else:
+                            t1 = timer()
+                            duplicate = self.detector.is_duplicate(image)
+                            td = timer() - t1
+                            if trace is not None:
+                                trace.add(u'dupcheck', t1, t1 + td)
+                            self.finish_frame((row, cellstats, image), duplicate, td)
+                        if self.controller is not None:
+                            action = self.controller.update(te, row[6])
+                            if action is not None:
+                                log(msg=u'adaptive: %s' % action)
+                                loopsleep = self.controller.loopsleep
+                                if self.controller.size() != (width, height):
+                                    width, height = self.controller.size()
+                                    if self.legacy:
+                                        self.rc.capture(width, height, xbmc.CAPTURE_FLAG_CONTINUOUS)
+                        if cellstats.converged(self.plan.ci_target, self.plan.min_frames):
+                            log(msg=u'%s converged after %i frames' % (repr(cell), frame))
+                            break
+                        if trace is not None:
+                            t1 = timer()
+                            xbmc.sleep(loopsleep)
+                            trace.add(u'sleep', t1, timer())
+                        else:
+                            xbmc.sleep(loopsleep)  # unclear if this helps avoid GIL issues
+                    if pipeline is not None:
+                        pipeline.flush()
+                    self.end_cell(cellstats, summaries)
+                    cellstats = None
+                if flagdone is False:
+                    flagdone = True
+                    message = u'Adequate data gathered for analysis'
+                    if self.session is not None:
+                        message += u': ' + os.path.basename(self.capture_monitor_thread.basename)
+                    xbmcgui.Dialog().notification(u'testRenderCapture', message)
+            self.abort_evt.wait()
+        except BreakLoop:
+            if pipeline is not None:
+                pipeline.flush()
+            if cellstats is not None and cellstats.frames > 0:
+                self.end_cell(cellstats, summaries)
         elapsed = timer() - time0
+        self.cellstats = None
+        self.close_stages(pipeline)
+        if self.controller is not None:
+            self.capture_monitor_thread.meta[u'adjustments'] = self.controller.adjustments
+            log(msg=u'adaptive: final capture size %ix%i, loopsleep %i ms after %i adjustments' % (
+                width, height, self.controller.loopsleep, len(self.controller.adjustments)))
+        if self.pool is not None:
+            self.capture_monitor_thread.meta[u'framepool'] = self.pool.get_stats()
+            log(msg=format_stats(self.pool.get_stats()))
         self.capture_monitor_thread.abort(totalelapsed=elapsed)
-        log(msg=u'timeout = %s' % timeout)
-        log(msg=u'counter = %s' % counter)
-        log(msg=u'dropped = %s' % self.dropped)
-        log(msg=u'elapsed = %s' % elapsed)
-        log(msg=u'framerate = %s' % str(counter / elapsed))
-        log(msg=u'uniqueframerate = %s' % str(uniqueframes / elapsed))
+        if self.tracer is not None:  # after the writer has finished, so its last write is traced too
+            fn = self.capture_monitor_thread.basename + '_trace.json'
+            try:
+                self.tracer.export(fn, meta=self.capture_monitor_thread.meta)
+            except (IOError, OSError) as e:
+                log(msg=u'Could not write trace: %s' % unicode(e))
+            else:
+                log(msg=u'trace of %i events written to %s' % (min(self.tracer.count(), self.tracer.capacity), fn))
+        self.elapsed = elapsed
+        if self.session is not None and self.capture_monitor_thread.opened:
+            self.add_session_run(summaries)
+        elif self.session is not None:
+            self.session.release(self.capture_monitor_thread.basename)  # nothing to index
+        self.log_totals(timeout)
 
         xbmcgui.Dialog().notification(u'testRenderCapture', u'DONE')
 
+    def metrics(self):
+        '''
+        Snapshot for the metrics endpoint. Called from another thread: it only reads counters the capture
+        loop keeps anyway, without locking, so the values may be a frame apart.
+        '''
+        time0 = self.time0
+        snapshot = {u'capturing': 1, u'frames': self.counter, u'unique': self.uniqueframes,
+                    u'dropped': self.dropped, u'elapsed': timer() - time0 if time0 else 0.0,
+                    u'queues': {u'consumer': max(0, self.counter - self.finished),
+                                u'writer': self.capture_monitor_thread.resultQ.qsize()}}
+        if self.analysis is not None:
+            snapshot[u'queues'][u'analysis'] = self.analysis.inQ.qsize()
+        cellstats = self.cellstats
+        if cellstats is not None and cellstats.frames > 0:
+            duration = cellstats.last - cellstats.first
+            snapshot.update({u'fps': cellstats.frames / duration if duration > 0 else 0.0,
+                             u'uniquefps': cellstats.unique / duration if duration > 0 else 0.0,
+                             u'droprate': float(cellstats.dropped) / cellstats.frames})
+            if cellstats.frames > 5:  # before that the quantile markers are still being filled
+                snapshot[u'latency'] = dict((unicode(p), v) for p, v in cellstats.sketch.values().iteritems())
+            cell = cellstats.cell.as_dict()
+            cell.update({u'width': cellstats.width, u'height': cellstats.height})
+            snapshot[u'cell'] = cell
+        return snapshot
+
+    def finish_frame(self, item, duplicate, dupchecktime):
+        '''
+        Records a frame once its duplicate check is done. Called in capture order.
+        '''
+        row, cellstats, image = item
+        row[7] = duplicate
+        row[8] = dupchecktime
+        if self.delta is not None and row[6] > 1:
+            row[11], row[12], row[13] = self.delta.update(image, row[9], row[10])
+        self.finished += 1
+        if self.cadence is not None and row[6] > 1:
+            self.cadence.add_capture(row[0] + row[5], not duplicate)
+        if not duplicate and row[6] > 1:
+            self.uniqueframes += 1
+            if self.analysis is not None:
+                self.analysis.submit(row[0], self.time0 + row[0], image, row[9], row[10])
+        if self.tracer is not None:
+            t0 = timer()
+            self.put_result(row)
+            self.tracer.add(u'put', t0, timer())
+        else:
+            self.put_result(row)
+        if self.recorder is not None:
+            self.recorder.add(row, cellstats.cell, duplicate, image, copy=self.pool is not None)
+        cellstats.add_frame(row[0], row[5], row[6], duplicate, changed=row[12], tear=row[13], width=row[9],
+                            height=row[10])
+
+    def add_session_run(self, summaries):
+        '''
+        Records the run in the session index: video metadata, files and totals over all cells
+        '''
+        monitor = self.capture_monitor_thread
+        meta = monitor.meta
+        frames = sum(s[u'frames'] for s in summaries)
+        files = list(monitor.files)
+        for suffix in ('_summary.json', '_analysis.csv', '_capture.trace', '_trace.json'):
+            if os.path.exists(monitor.basename + suffix):
+                files.append(monitor.basename + suffix)
+        record = {u'run': os.path.basename(monitor.basename), u'started': meta.get(u'started'),
+                  u'ended': time.time(), u'video': self.videometa, u'api': meta.get(u'api'),
+                  u'detector': self.detector.name, u'videowidth': self.videoinfo[0],
+                  u'videoheight': self.videoinfo[1], u'sourcefps': self.sourcefps, u'cells': len(summaries),
+                  u'frames': self.counter, u'unique': self.uniqueframes, u'dropped': self.dropped,
+                  u'elapsed': self.elapsed,
+                  u'framerate': self.counter / self.elapsed if self.elapsed > 0 else 0.0,
+                  u'uniqueframerate': self.uniqueframes / self.elapsed if self.elapsed > 0 else 0.0,
+                  u'mean': sum(s[u'mean'] * s[u'frames'] for s in summaries) / frames if frames else None,
+                  u'p95': max(s[u'p95'] for s in summaries) if summaries else None,
+                  u'files': [os.path.basename(fn) for fn in files]}
+        if self.cadence is not None:
+            record[u'efficiency'] = self.cadence.summary()[u'efficiency']
+        try:
+            self.session.add_run(record)
+        except (IOError, OSError) as e:
+            log(msg=u'Could not update the session index: %s' % unicode(e))
+
+    def end_cell(self, cellstats, summaries):
+        from resources.lib.cellstats import format_summary, write_summaries
+        summary = cellstats.summary()
+        summaries.append(summary)
+        log(msg=format_summary(summary))
+        try:
+            write_summaries(self.capture_monitor_thread.basename + '_summary.json', self.capture_monitor_thread.meta,
+                            summaries)
+        except (IOError, OSError) as e:
+            log(msg=u'Could not write cell summary: %s' % unicode(e))
+
     def get_fromqueue(self, timeout, width, height, sleep=0):
         try:
             if sleep > 0:
@@ -257,10 +749,10 @@ class CaptureThread(threading.Thread):
                 self.dummyQ.get(block=True, timeout=timeout / 1000.0)
             except Queue.Empty:
                 pass
-            image = bytearray('b')
+            image = STUB
         except Exception as e:
-            log(msg=u'Exception: %s' % unicode(e))
-            return bytearray(b'')
+            log(xbmc.LOGWARNING, u'Exception: %s', unicode(e), every=1.0)
+            return EMPTY
         else:
             if len(image) == 0:
                 self.dropped += 1
@@ -273,8 +765,29 @@ class CaptureThread(threading.Thread):
                 xbmc.sleep(sleep)  # unclear if this helps avoid GIL issues
             image = self.rc.getImage(timeout)
         except Exception as e:
-            log(msg=u'Exception: %s' % unicode(e))
-            return bytearray(b'')
+            log(xbmc.LOGWARNING, u'Exception: %s', unicode(e), every=1.0)
+            return EMPTY
+        else:
+            if len(image) == 0:
+                self.dropped += 1
+            return image
+
+    def get_framePipelined(self, timeout, width, height, sleep=0):
+        '''
+        Collects the image requested by the previous call and immediately requests the next one,
+        so the renderer works on it while this frame is consumed. The image has the size of the earlier
+        request, left in self.imagesize.
+        '''
+        self.imagesize = self.requested
+        try:
+            if sleep > 0:
+                xbmc.sleep(sleep)  # unclear if this helps avoid GIL issues
+            image = self.rc.getImage(timeout)
+            self.rc.capture(width, height)
+            self.requested = (width, height)
+        except Exception as e:
+            log(xbmc.LOGWARNING, u'Exception: %s', unicode(e), every=1.0)
+            return EMPTY
         else:
             if len(image) == 0:
                 self.dropped += 1
@@ -288,10 +801,10 @@ class CaptureThread(threading.Thread):
                 image = self.rc.getImage()
             else:
                 self.dropped += 1
-                return bytearray(b'')
+                return EMPTY
         except Exception as e:
-            log(msg=u'Exception: %s' % str(e))
-            return bytearray(b'')
+            log(xbmc.LOGWARNING, u'Exception: %s', str(e), every=1.0)
+            return EMPTY
         else:
             return image
 
@@ -300,10 +813,10 @@ class CaptureThread(threading.Thread):
             pass  # self.rc.capture(width, height)
             if sleep > 0:
                 xbmc.sleep(sleep)  # unclear if this helps avoid GIL issues
-            image = bytearray(b' ')  # image = self.rc.getImage(timeout)
+            image = STUB  # image = self.rc.getImage(timeout)
         except Exception as e:
-            log(msg=u'Exception: %s' % unicode(e))
-            return bytearray(b'')
+            log(xbmc.LOGWARNING, u'Exception: %s', unicode(e), every=1.0)
+            return EMPTY
         else:
             if len(image) == 0:
                 self.dropped += 1
@@ -314,13 +827,13 @@ class CaptureThread(threading.Thread):
             pass  # self.rc.waitForCaptureStateChangeEvent(timeout)
             cs = xbmc.CAPTURE_STATE_DONE  # cs = self.rc.getCaptureState()
             if cs == xbmc.CAPTURE_STATE_DONE:
-                image = bytearray(b' ')  # image = self.rc.getImage()
+                image = STUB  # image = self.rc.getImage()
             else:
                 self.dropped += 1
-                return bytearray(b'')
+                return EMPTY
         except Exception as e:
-            log(msg=u'Exception: %s' % str(e))
-            return bytearray(b'')
+            log(xbmc.LOGWARNING, u'Exception: %s', str(e), every=1.0)
+            return EMPTY
         else:
             return image
 
@@ -330,55 +843,386 @@ class CaptureThread(threading.Thread):
             self.join(timeout)
 
 
+class ReplayThread(CaptureThread):
+    '''
+    Feeds a trace recorded with the record setting back through the duplicate check, the consumer, the result
+    writer and the cell statistics, at the recorded pace scaled by speed, or as fast as possible with speed 0.
+    A timing trace has no frames: duplicates are found by comparing the recorded frame digests and frame
+    delta and analysis are off. Capture times in the results are the recorded ones.
+    '''
+
+    def __init__(self, reader, detector=u'sampled', basename=None, speed=1.0, pipelined=False, workers=2,
+                 consumer_process=False, analyze=False, framedelta=True):
+        meta = reader.meta
+        plan = SweepPlan([SweepCell(**cell) for cell in meta[u'plan'][u'cells']], repeat=False)
+        if not reader.frames:
+            detector = meta.get(u'digest', u'sampled')  # the detector the recorded digests come from
+            analyze = framedelta = False
+        super(ReplayThread, self).__init__((meta[u'videowidth'], meta[u'videoheight']), None, detector=detector,
+                                           plan=plan, basename=basename, recalibrate=0, pipelined=pipelined,
+                                           workers=workers, framepool=False, adaptive=False, analyze=analyze,
+                                           framedelta=framedelta, sourcefps=meta.get(u'sourcefps', 0.0),
+                                           session=False, trace=False, consumer_process=consumer_process,
+                                           record=u'off')
+        self.name = 'Replay'
+        self.reader = reader
+        self.speed = speed
+        self.videometa = meta.get(u'video', {})
+        self.elapsed = 0.0
+
+    def run(self):
+        from resources.lib.cellstats import CellStats
+        reader = self.reader
+        self.open_stages()
+        pipeline = None
+        if reader.frames:
+            pipeline = self.open_pipeline(self.pipelined, reader.maxlength)
+        self.capture_monitor_thread.meta.update({u'mode': u'replay', u'trace': reader.fn,
+                                                 u'recorded': reader.meta.get(u'started'),
+                                                 u'recorded_detector': reader.meta.get(u'detector'),
+                                                 u'videowidth': self.videoinfo[0], u'videoheight': self.videoinfo[1],
+                                                 u'sourcefps': self.sourcefps, u'plan': self.plan.as_dict(),
+                                                 u'speed': self.speed, u'started': time.time()})
+        log(msg=u'replaying %i records (%s) from %s with detector %s' % (
+            len(reader), reader.meta.get(u'mode'), reader.fn, self.detector.name))
+        if not reader.frames:
+            log(msg=u'timing trace: duplicates from the recorded digests, no frame delta or analysis')
+        summaries = []
+        cellstats = None
+        cellindex = None
+        timeout = 0
+        time0 = self.time0 = timer()
+        for record, image in reader.records():
+            if self.abort_evt.is_set():
+                break
+            (playtime, te, frame, index, loopsleep, timeout, capturesleep, width, height, length, duplicate, _,
+             digest) = record
+            if index != cellindex:
+                if pipeline is not None:
+                    pipeline.flush()
+                if cellstats is not None:
+                    self.end_cell(cellstats, summaries)
+                cellindex = index
+                cell = self.plan.cells[index] if 0 <= index < len(self.plan.cells) else SweepCell(
+                    loopsleep, capturesleep, timeout)
+                cellstats = self.cellstats = CellStats(cell, width, height, sourcefps=self.sourcefps)
+                if pipeline is not None:
+                    pipeline.reset()
+                else:
+                    self.detector.reset()
+            if self.speed > 0:
+                wait = time0 + playtime / self.speed - timer()
+                if wait > 0 and self.abort_evt.wait(wait):
+                    break
+            if length == 0:
+                self.dropped += 1
+            self.counter += 1
+            row = [playtime, loopsleep, timeout, capturesleep, frame, te, length, False, 0.0,
+                   width, height, -1.0, -1.0, -1.0]
+            if image is None:
+                if length > 1 and not reader.frames:
+                    duplicate = self.detector.check((length, digest))
+                self.finish_frame((row, cellstats, STUB), bool(duplicate), 0.0)
+            elif pipeline is not None:
+                pipeline.submit((row, cellstats, image), image)
+            else:
+                t1 = timer()
+                duplicate = self.detector.is_duplicate(image)
+                self.finish_frame((row, cellstats, image), duplicate, timer() - t1)
+        if pipeline is not None:
+            pipeline.flush()
+        if cellstats is not None and cellstats.frames > 0:
+            self.end_cell(cellstats, summaries)
+        self.elapsed = timer() - time0
+        self.cellstats = None
+        self.close_stages(pipeline)
+        self.capture_monitor_thread.abort(totalelapsed=self.elapsed)
+        self.log_totals(timeout)
+
+
+class BrokerCapture(threading.Thread):
+    '''
+    Broker mode: one RenderCapture, at the size, timeout and loopsleep of the first sweep cell, shared by
+    the result recorder (every frame), the colour analysis and a preview, each at its own rate and
+    downscale. The latest preview frame is kept in self.preview.
+    '''
+
+    def __init__(self, videoinfo, player, detector=u'sampled', plan=None, basename=None, maxsize=None,
+                 analysis_fps=None, preview_fps=None, preview_scale=None):
+        super(BrokerCapture, self).__init__(name='BrokerCapture')
+        self.player = player
+        self.videoinfo = videoinfo
+        addon = xbmcaddon.Addon()
+        if plan is None:
+            plan = plan_from_settings(addon.getSetting)
+        self.cell = plan.cells[0]
+        options = options_from_settings(addon.getSetting, broker_queue=maxsize, broker_analysis_fps=analysis_fps,
+                                        broker_preview_fps=preview_fps, broker_preview_scale=preview_scale)
+        self.settings = dict((name, options[name]) for name in (u'broker_queue', u'broker_analysis_fps',
+                                                                u'broker_preview_fps', u'broker_preview_scale'))
+        self.detector = get_detector(detector)
+        self.framedelta = options[u'framedelta']
+        self.delta = None
+        self.abort_evt = threading.Event()
+        self.capture_monitor_thread = CaptureMonitorThread(detector=self.detector.name, basename=basename)
+        self.broker = None
+        self.preview = None
+        self.analyzed = 0
+        self.latest = None  # colour metrics of the last analysed frame
+
+    def run(self):
+        from resources.lib.broker import CaptureBroker, format_stats
+        if self.framedelta:
+            from resources.lib.framedelta import FrameDelta
+            self.delta = FrameDelta()
+        width, height = self.cell.size(*self.videoinfo)
+        broker = self.broker = CaptureBroker(width, height, timeout=self.cell.timeout, loopsleep=self.cell.loopsleep)
+        maxsize = self.settings[u'broker_queue']
+        # every frame gets a result row: the broker waits for the recorder rather than drop frames for it
+        consumers = [(broker.subscribe(u'results', maxsize=maxsize, block=True), self.record)]
+        if self.settings[u'broker_analysis_fps'] > 0:
+            from resources.lib import analysis
+            try:
+                analyzer = analysis.FrameAnalyzer(segments=8)
+            except ImportError as e:
+                log(msg=u'broker: colour analysis disabled: %s' % unicode(e))
+            else:
+                consumers.append((broker.subscribe(u'colour', fps=self.settings[u'broker_analysis_fps'], scale=2,
+                                                   maxsize=maxsize),
+                                  lambda frame: self.colour(analyzer, frame)))
+        if self.settings[u'broker_preview_fps'] > 0:
+            consumers.append((broker.subscribe(u'preview', fps=self.settings[u'broker_preview_fps'],
+                                               scale=self.settings[u'broker_preview_scale'], maxsize=1),
+                              self.show))
+        threads = [threading.Thread(target=self.consume, args=c, name='BrokerConsumer-%s' % c[0].name)
+                   for c in consumers]
+        for t in threads:
+            t.daemon = True
+        self.capture_monitor_thread.meta.update({u'api': u'legacy' if broker.legacy else u'krypton',
+                                                 u'mode': u'broker', u'width': width, u'height': height,
+                                                 u'videowidth': self.videoinfo[0], u'videoheight': self.videoinfo[1],
+                                                 u'timeout': self.cell.timeout, u'loopsleep': self.cell.loopsleep,
+                                                 u'started': time.time()})
+        for t in threads:
+            t.start()
+        log(msg=u'broker capture %ix%i with subscribers %s' % (width, height, u', '.join(c[0].name for c in consumers)))
+        broker.start()
+        try:
+            self.abort_evt.wait()
+            broker.abort()
+        finally:
+            for subscriber, _ in consumers:
+                subscriber.close()  # also when the broker did not stop in time, so no consumer is left waiting
+            for t in threads:
+                t.join(5)
+        stats = broker.get_stats()
+        self.capture_monitor_thread.meta[u'broker'] = stats
+        self.capture_monitor_thread.abort()
+        if broker.lasterror is not None:
+            log(msg=u'broker: last capture error: %s' % unicode(broker.lasterror))
+        for line in format_stats(stats):
+            log(msg=line)
+
+    def metrics(self):
+        '''
+        Snapshot for the metrics endpoint, see CaptureThread.metrics
+        '''
+        broker = self.broker
+        if broker is None:
+            return {u'capturing': 1}
+        elapsed = timer() - broker.time0 if broker.time0 else 0.0
+        snapshot = {u'capturing': 1, u'frames': broker.captured + broker.failed, u'dropped': broker.failed, u'elapsed': elapsed,
+                    u'fps': (broker.captured + broker.failed) / elapsed if elapsed > 0 else 0.0,
+                    u'queues': dict((s.name, len(s.queue)) for s in broker.subscribers)}
+        snapshot[u'queues'][u'writer'] = self.capture_monitor_thread.resultQ.qsize()
+        cell = self.cell.as_dict()
+        cell.update({u'width': broker.width, u'height': broker.height})
+        snapshot[u'cell'] = cell
+        return snapshot
+
+    def consume(self, subscriber, fn):
+        while True:
+            frame = subscriber.get(timeout=1.0)
+            if frame is None:
+                if subscriber.closed:
+                    return
+                continue
+            fn(frame)
+
+    def record(self, frame):
+        image = frame.image
+        t0 = timer()
+        duplicate = self.detector.is_duplicate(image)
+        td = timer() - t0
+        row = [frame.timestamp - self.broker.time0, self.cell.loopsleep, self.cell.timeout, 0, frame.seq + 1,
+               frame.elapsed, len(image), duplicate, td, frame.width, frame.height, -1.0, -1.0, -1.0]
+        if self.delta is not None:
+            row[11], row[12], row[13] = self.delta.update(image, frame.width, frame.height)
+        self.capture_monitor_thread.put(row)
+
+    def colour(self, analyzer, frame):
+        try:
+            self.latest = analyzer.analyze(frame.image, frame.width, frame.height)[0]
+        except ValueError:
+            return
+        self.analyzed += 1
+
+    def show(self, frame):
+        self.preview = frame
+
+    def abort(self, timeout=5):
+        self.abort_evt.set()
+        if self.is_alive():
+            self.join(timeout)
+
+
 class CaptureMonitorThread(threading.Thread):
     '''
     Writes frame by frame results to file.
     Runs in separate thread to avoid possible I/O bound waiting.
+    Blocks on the queue and writes rows in batches, flushing when batchsize rows are pending or
+    flushinterval seconds have passed. abort() queues a sentinel so every row put before it is written.
     '''
+    sentinel = None
 
-    def __init__(self):
+    def __init__(self, detector=u'sampled', batchsize=500, flushinterval=1.0, formats=(u'csv', u'bin'),
+                 basename=None, session=None, tracer=None):
         super(CaptureMonitorThread, self).__init__(name='CaptureMonitor')
-        self.abort_evt = threading.Event()
+        if basename is None:
+            basename = output_basename()
+        self.basename = basename  # result files are basename + '.csv' / '.bin'
         self.resultQ = Queue.Queue()
+        self.detector = detector
+        self.formats = formats
+        self.meta = {u'detector': detector}  # run description for the binary log header
+        self.batchsize = batchsize
+        self.flushinterval = flushinterval
         self.totalelapsed = 0
+        self.rows = 0
+        self.rowrate = 0.0
+        self.highwater = 0
+        self.writetime = 0.0
+        self.session = session  # rotates the files by size when set
+        self.part = 0
+        self.files = []  # result files written, complete once the thread has finished
+        self.tracer = tracer
+        self.opened = False  # the thread, and with it the files, start with the first row
+        self.startlock = threading.Lock()
+
+    def format_row(self, result):
+        return format_csv_row(result, self.detector)
+
+    def put(self, row):
+        if not self.opened:
+            with self.startlock:
+                if not self.opened:
+                    self.start()
+        self.resultQ.put(row)
+
+    def start(self):
+        self.opened = True
+        super(CaptureMonitorThread, self).start()
+
+    def open_files(self):
+        f = None
+        if u'csv' in self.formats:
+            f = open(self.basename + '.csv', 'w')
+            f.write(CSVHEADER)
+        fb = None
+        if u'bin' in self.formats:
+            fb = BinaryResultWriter(self.basename + '.bin', self.meta)
+        return f, fb
+
+    def rotate(self, f, fb):
+        '''
+        Moves the current files aside once either one reaches the session's size limit
+        '''
+        size = max(f.tell() if f is not None else 0, fb.f.tell() if fb is not None else 0)
+        if size < self.session.rotatebytes:
+            return f, fb
+        self.part += 1
+        for ext, writer in (('.csv', f), ('.bin', fb)):
+            if writer is not None:
+                writer.close()
+                self.files.append(self.session.rotate(self.basename + ext, self.part))
+        return self.open_files()
 
     def run(self):
-        self.abort_evt.clear()
-        if sys.platform.lower().startswith('win'):
-            fn = r'C:\Temp\output.csv'
-        else:
-            fn = os.path.expanduser(r'~/.kodi/output.csv')
-        f = open(fn, 'w', 0)  # '0' buffersize so that line is immediately written to file
-        f.write(
-            '"playtime","loopsleep","timeout","capturesleep","frame","timeelapsed","imagelength","dup"\n')  # header for import
+        f, fb = self.open_files()
         timerequestingframes = 0
-        while not self.abort_evt.is_set():
-            while not self.resultQ.empty():
+        batch = []
+        done = False
+        tstart = timer()
+        lastflush = tstart
+        while not done:
+            try:
+                result = self.resultQ.get(block=True, timeout=self.flushinterval)
+            except Queue.Empty:
+                result = []
+            self.highwater = max(self.highwater, self.resultQ.qsize() + 1)
+            while True:
+                if result is self.sentinel:
+                    done = True
+                    break
+                if result:
+                    batch.append(result)
+                    timerequestingframes += result[5]
+                if len(batch) >= self.batchsize:
+                    break
                 try:
-                    result = self.resultQ.get(block=True, timeout=1)
+                    result = self.resultQ.get_nowait()
                 except Queue.Empty:
-                    pass
-                else:
-                    f.write('%s,%i,%i,%i,%i,%s,%i,%s\n' % (
-                        "{0:.4f}".format(result[0]), result[1], result[2], result[3], result[4],
-                        "{0:.4f}".format(result[5] * 1000.0), result[6], result[7]))
-                    timerequestingframes += result[5]
-            xbmc.sleep(5)  # unclear if this helps avoid GIL issues
-        f.close()
+                    break
+            now = timer()
+            if batch and (done or len(batch) >= self.batchsize or now - lastflush >= self.flushinterval):
+                if f is not None:
+                    f.write(''.join([self.format_row(row) for row in batch]))
+                    f.flush()
+                if fb is not None:
+                    fb.write_rows(batch)
+                    fb.flush()
+                self.rows += len(batch)
+                batch = []
+                if self.session is not None and self.session.rotatebytes > 0:
+                    f, fb = self.rotate(f, fb)
+                lastflush = timer()
+                if self.tracer is not None:
+                    self.tracer.add(u'write', now, lastflush)
+                self.writetime += lastflush - now
+        if f is not None:
+            f.close()
+            self.files.append(self.basename + '.csv')
+        if fb is not None:
+            fb.close()
+            self.files.append(self.basename + '.bin')
+        elapsed = timer() - tstart
+        if elapsed > 0:
+            self.rowrate = self.rows / elapsed
+        log(msg=u'Result rows written: %i (%s rows/sec), queue high-water mark: %i, time writing: %s ms' % (
+            self.rows, "{0:.1f}".format(self.rowrate), self.highwater, "{0:.1f}".format(self.writetime * 1000.0)))
         if self.totalelapsed != 0:
             log(msg=u'Percent time waiting for frames: %s' % "{0:.2f}".format(
                 timerequestingframes / self.totalelapsed * 100.0))
 
+    def get_stats(self):
+        return {u'rows': self.rows, u'rowrate': self.rowrate, u'highwater': self.highwater,
+                u'writetime': self.writetime}
+
     def abort(self, timeout=5, totalelapsed=0):
         self.totalelapsed = totalelapsed
-        self.abort_evt.set()
+        if not self.opened:
+            return  # no rows, no files
+        self.resultQ.put(self.sentinel)
         if self.is_alive():
             self.join(timeout)
 
 
 if __name__ == '__main__':
     KodiLogger.setLogLevel(KodiLogger.LOGNOTICE)
+    logging_from_settings(xbmcaddon.Addon().getSetting)
     log(msg=u'Starting Up')
     p = Player()
     m = xbmc.Monitor()
     m.waitForAbort()
+    p.close()
+    KodiLogger.setAsync(False)  # writes out the messages still queued, the run totals among them
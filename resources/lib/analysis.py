@@ -0,0 +1,221 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2016 KenV99
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+'''
+Optional frame analysis stage (ambilight style colour extraction), run on worker threads after
+capture. Needs NumPy; the BGRA buffer is wrapped with numpy.frombuffer, never copied.
+
+Per frame metrics:
+    average     mean B, G, R of the frame
+    edges       mean B, G, R of N segments along each border zone (top, bottom, left, right)
+    histogram   luminance histogram
+    blackbars   rows/columns of black bars at top, bottom, left, right
+'''
+import threading
+import Queue
+from timeit import default_timer as timer
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from resources.lib.utils.rolling_stats import RollingStats
+from resources.lib.utils.quantiles import QuantileSketch
+
+STAGES = [u'view', u'average', u'edges', u'luminance', u'histogram', u'blackbars', u'total']
+
+
+class FrameAnalyzer(object):
+    def __init__(self, segments=8, border=0.1, bins=16, blackthreshold=24):
+        if numpy is None:
+            raise ImportError(u'Frame analysis needs NumPy')
+        self.segments = segments
+        self.border = border  # depth of the edge zones as a fraction of height/width
+        self.bins = bins
+        self.blackthreshold = blackthreshold  # max luminance (0-255) of a black bar line
+        self.shift = 8 - (bins - 1).bit_length()
+
+    def analyze(self, image, width, height):
+        '''
+        Returns (metrics, stage timings in seconds)
+        '''
+        times = {}
+        t = t0 = timer()
+        frame = numpy.frombuffer(image, dtype=numpy.uint8, count=width * height * 4).reshape(height, width, 4)
+        t, times[u'view'] = self._lap(t)
+        # reductions sum down the rows first (contiguous, uint32 accumulators), much faster than mean()
+        columns = frame.reshape(height, width * 4).sum(axis=0, dtype=numpy.uint32).reshape(width, 4)
+        average = columns.sum(axis=0)[:3] / float(width * height)
+        t, times[u'average'] = self._lap(t)
+        edges = self.edges(frame, width, height)
+        t, times[u'edges'] = self._lap(t)
+        # integer Rec.709 luma approximation: (19 B + 183 G + 54 R) / 256
+        luma = ((frame[:, :, 0].astype(numpy.uint16) * 19 + frame[:, :, 1].astype(numpy.uint16) * 183 +
+                 frame[:, :, 2].astype(numpy.uint16) * 54) >> 8).astype(numpy.uint8)
+        t, times[u'luminance'] = self._lap(t)
+        histogram = numpy.bincount((luma >> self.shift).ravel(), minlength=self.bins)
+        t, times[u'histogram'] = self._lap(t)
+        blackbars = self.blackbars(luma)
+        t, times[u'blackbars'] = self._lap(t)
+        times[u'total'] = t - t0
+        metrics = {u'average': average.tolist(), u'edges': edges, u'histogram': histogram.tolist(),
+                   u'blackbars': blackbars}
+        return metrics, times
+
+    @staticmethod
+    def _lap(t):
+        now = timer()
+        return now, now - t
+
+    def edges(self, frame, width, height):
+        n = self.segments
+        depthy = max(1, int(height * self.border))
+        depthx = max(1, int(width * self.border))
+        segw = width // n
+        segh = height // n
+
+        def horizontal(zone):
+            columns = zone.reshape(depthy, width * 4).sum(axis=0, dtype=numpy.uint32).reshape(width, 4)
+            return (columns[:segw * n, :3].reshape(n, segw, 3).sum(axis=1) / float(depthy * segw)).tolist()
+
+        def vertical(zone):
+            rows = zone.sum(axis=1, dtype=numpy.uint32)
+            return (rows[:segh * n, :3].reshape(n, segh, 3).sum(axis=1) / float(depthx * segh)).tolist()
+
+        return {u'top': horizontal(frame[:depthy]), u'bottom': horizontal(frame[height - depthy:]),
+                u'left': vertical(frame[:, :depthx]), u'right': vertical(frame[:, width - depthx:])}
+
+    def blackbars(self, luma):
+        bright = luma > self.blackthreshold
+        rows = bright.any(axis=1)
+        cols = bright.any(axis=0)
+        if not rows.any():
+            return {u'top': 0, u'bottom': 0, u'left': 0, u'right': 0, u'black': True}
+        return {u'top': int(rows.argmax()), u'bottom': int(rows[::-1].argmax()),
+                u'left': int(cols.argmax()), u'right': int(cols[::-1].argmax()), u'black': False}
+
+
+class StageTimer(object):
+    '''
+    Mean and quantiles (ms) of one stage's latency
+    '''
+
+    def __init__(self):
+        self.stats = RollingStats()
+        self.sketch = QuantileSketch((0.5, 0.95))
+        self.max = 0.0
+
+    def add_value(self, seconds):
+        ms = seconds * 1000.0
+        self.stats.add_value(ms)
+        self.sketch.add_value(ms)
+        if ms > self.max:
+            self.max = ms
+
+    def summary(self):
+        quantiles = self.sketch.values()
+        return {u'n': self.stats.n, u'mean': self.stats.get_mean(), u'p50': quantiles[0.5], u'p95': quantiles[0.95],
+                u'max': self.max}
+
+
+class AnalysisStage(object):
+    '''
+    Worker pool running FrameAnalyzer on submitted frames. submit() never blocks the caller: when
+    maxsize frames are already waiting the frame is skipped and counted.
+    Besides the analyzer stages, 'queue' (wait before a worker picks the frame up) and 'endtoend'
+    (capture start to analysis done) are timed. The latest metrics are kept in self.latest.
+    '''
+
+    def __init__(self, analyzer=None, workers=2, maxsize=8, output=None):
+        self.analyzer = analyzer if analyzer is not None else FrameAnalyzer()
+        self.inQ = Queue.Queue(maxsize)
+        self.timers = dict((name, StageTimer()) for name in STAGES + [u'queue', u'endtoend'])
+        self.lock = threading.Lock()
+        self.latest = None
+        self.analyzed = 0
+        self.skipped = 0
+        self.output = output  # file-like object for per frame csv lines, optional
+        if output is not None:
+            output.write('"playtime","capturestart","b","g","r","bartop","barbottom","barleft","barright","analysisms"\n')
+        self.threads = [threading.Thread(target=self.work, name='FrameAnalysis%i' % i) for i in xrange(workers)]
+        for t in self.threads:
+            t.daemon = True
+            t.start()
+
+    def submit(self, playtime, capturestart, image, width, height):
+        '''
+        playtime is the frame's key in the results csv, capturestart the timer() value when it was requested
+        '''
+        try:
+            self.inQ.put_nowait((playtime, capturestart, timer(), image, width, height))
+        except Queue.Full:
+            self.skipped += 1
+
+    def work(self):
+        while True:
+            task = self.inQ.get()
+            if task is None:
+                self.inQ.task_done()
+                return
+            playtime, capturestart, submitted, image, width, height = task
+            started = timer()
+            try:
+                metrics, times = self.analyzer.analyze(image, width, height)
+            except ValueError:
+                self.skipped += 1  # buffer does not match width x height
+            else:
+                done = timer()
+                with self.lock:
+                    for name, seconds in times.iteritems():
+                        self.timers[name].add_value(seconds)
+                    self.timers[u'queue'].add_value(started - submitted)
+                    self.timers[u'endtoend'].add_value(done - capturestart)
+                    self.latest = metrics
+                    self.analyzed += 1
+                    if self.output is not None:
+                        average = metrics[u'average']
+                        bars = metrics[u'blackbars']
+                        self.output.write('%.4f,%.4f,%.1f,%.1f,%.1f,%i,%i,%i,%i,%.3f\n' % (
+                            playtime, capturestart, average[0], average[1], average[2], bars[u'top'],
+                            bars[u'bottom'], bars[u'left'], bars[u'right'], times[u'total'] * 1000.0))
+            self.inQ.task_done()
+
+    def close(self):
+        self.inQ.join()
+        for _ in self.threads:
+            self.inQ.put(None)
+        for t in self.threads:
+            t.join()
+        if self.output is not None:
+            self.output.close()
+
+    def summary(self):
+        with self.lock:
+            stages = dict((name, t.summary()) for name, t in self.timers.iteritems())
+        return {u'analyzed': self.analyzed, u'skipped': self.skipped, u'stages': stages}
+
+
+def format_summary(summary):
+    lines = [u'analysis: %i frames analysed, %i skipped' % (summary[u'analyzed'], summary[u'skipped'])]
+    for name in STAGES + [u'queue', u'endtoend']:
+        stage = summary[u'stages'][name]
+        if stage[u'n']:
+            lines.append(u'analysis %-10s mean %.3f ms p50 %.3f p95 %.3f max %.3f' % (
+                name, stage[u'mean'], stage[u'p50'], stage[u'p95'], stage[u'max']))
+    return lines
@@ -0,0 +1,599 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2016 KenV99
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+'''
+Microbenchmarks for the capture pipeline, run against the simulated xbmc modules.
+
+From the add-on root:
+    python -m resources.lib.benchmarks                      # run all, save to ~/.kodi/benchmarks
+    python -m resources.lib.benchmarks --baseline latest    # and compare with the previous run
+    python -m resources.lib.benchmarks --only dupdetect
+
+Each result is seconds per operation (median and best of --repeat runs), plus any extra figures the
+benchmark reports from its last run (e.g. fps for the capture modes). A benchmark is a regression when its median is more than --threshold (fraction) slower than the baseline.
+'''
+import argparse
+import glob
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from timeit import default_timer as timer
+
+from resources.lib.sim import SimConfig, install
+
+BENCHMARKS = []
+RESOLUTIONS = [(480, 270), (960, 540), (1920, 1080)]
+
+
+def benchmark(name, number):
+    '''
+    Registers fn(env, number) as a benchmark. It must perform number operations.
+    '''
+
+    def decorator(fn):
+        BENCHMARKS.append((name, number, fn))
+        return fn
+
+    return decorator
+
+
+class BenchEnv(object):
+    '''
+    Shared state for the benchmarks: the imported add-on module and a scratch directory
+    '''
+
+    def __init__(self):
+        self.xbmc = install(SimConfig(latency=0.0, jitter=0.0, loglevel=4))
+        import default
+        self.default = default
+        self.tmpdir = tempfile.mkdtemp(prefix=u'trcbench')
+
+    def basename(self, name):
+        return os.path.join(self.tmpdir, name)
+
+    def capture_thread(self, width=1920, height=1080, **kwargs):
+        return self.default.CaptureThread([width, height], None, basename=self.basename(u'capture'), **kwargs)
+
+    def run_capture(self, frames, latency=8.0, jitter=1.0, loopsleep=5, observer=None, **kwargs):
+        '''
+        Runs a full CaptureThread for a single cell of frames against a simulated renderer with the
+        given latency. Returns achieved frames/sec and unique frames/sec.
+        observer(capture_thread) is called once the thread has started and returns a function that stops it.
+        '''
+        from resources.lib.sweep import SweepPlan, SweepCell
+        config = self.xbmc._config
+        saved = config.latency, config.jitter
+        config.latency, config.jitter = latency, jitter
+        plan = SweepPlan([SweepCell(loopsleep, 0, 100, 2, frames)], repeat=False)
+        ct = self.capture_thread(plan=plan, recalibrate=0, **kwargs)
+        stop = None
+        try:
+            ct.start()
+            if observer is not None:
+                stop = observer(ct)
+            while ct.counter < frames and ct.is_alive():
+                time.sleep(0.01)
+            ct.abort(timeout=60)
+        finally:
+            if stop is not None:
+                stop()
+            config.latency, config.jitter = saved
+        return {u'fps': ct.counter / ct.elapsed, u'uniquefps': ct.uniqueframes / ct.elapsed}
+
+    def close(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+
+def measure(fn, env, number, repeat):
+    times = []
+    extra = None
+    for _ in xrange(repeat):
+        t0 = timer()
+        extra = fn(env, number)
+        times.append((timer() - t0) / number)
+    times.sort()
+    result = {u'median': times[len(times) // 2], u'best': times[0], u'number': number, u'repeat': repeat}
+    if isinstance(extra, dict):
+        result.update(extra)
+    return result
+
+
+STARTUP = '''
+import json, sys
+from timeit import default_timer as timer
+from resources.lib.sim import SimConfig, install
+install(SimConfig(loglevel=4))
+t0 = timer()
+import default
+t1 = timer()
+default.Player()
+t2 = timer()
+print json.dumps({"import_ms": (t1 - t0) * 1000.0, "player_ms": (t2 - t1) * 1000.0,
+                  "numpy": "numpy" in sys.modules})
+'''
+
+
+@benchmark(u'startup.service', 5)
+def bench_startup(env, number):
+    '''
+    Import of default.py and creation of the Player in a fresh interpreter, as at Kodi startup
+    '''
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    runs = [json.loads(subprocess.check_output([sys.executable, '-c', STARTUP], cwd=root))
+            for _ in xrange(number)]
+    runs.sort(key=lambda r: r[u'import_ms'])
+    median = runs[len(runs) // 2]
+    return {u'import_ms': median[u'import_ms'], u'player_ms': median[u'player_ms'],
+            u'numpy_loaded': float(any(r[u'numpy'] for r in runs))}
+
+
+@benchmark(u'capture.krypton.960x540', 200)
+def bench_capture_krypton(env, number):
+    ct = env.capture_thread()
+    try:
+        for _ in xrange(number):
+            ct.get_frameKrypton(1000, 960, 540)
+    finally:
+        ct.capture_monitor_thread.abort()
+
+
+@benchmark(u'capture.serial', 200)
+def bench_capture_serial(env, number):
+    return env.run_capture(number, pipelined=False)
+
+
+@benchmark(u'capture.pipelined', 200)
+def bench_capture_pipelined(env, number):
+    return env.run_capture(number, pipelined=True)
+
+
+@benchmark(u'capture.serial.framepool', 200)
+def bench_capture_serial_pool(env, number):
+    return env.run_capture(number, pipelined=False, framepool=True)
+
+
+@benchmark(u'capture.pipelined.framepool', 200)
+def bench_capture_pipelined_pool(env, number):
+    return env.run_capture(number, pipelined=True, framepool=True)
+
+
+for _w, _h in RESOLUTIONS:
+    for _name in [u'digest', u'sampled', u'exact']:
+        def _bench_dupdetect(env, number, name=_name, width=_w, height=_h):
+            from resources.lib.dupdetect import get_detector
+            images = [bytearray(os.urandom(64)) * (width * height * 4 / 64) for _ in xrange(2)]
+            detector = get_detector(name)
+            for i in xrange(number):
+                detector.is_duplicate(images[i & 1])
+
+        benchmark(u'dupdetect.%s.%ix%i' % (_name, _w, _h), 50)(_bench_dupdetect)
+
+
+for _w, _h in RESOLUTIONS:
+    def _bench_analysis(env, number, width=_w, height=_h):
+        from resources.lib.analysis import FrameAnalyzer
+        image = bytearray(os.urandom(64)) * (width * height * 4 / 64)
+        analyzer = FrameAnalyzer()
+        for _ in xrange(number):
+            analyzer.analyze(image, width, height)
+
+    benchmark(u'analysis.%ix%i' % (_w, _h), 20)(_bench_analysis)
+
+
+for _w, _h in RESOLUTIONS:
+    def _bench_framedelta(env, number, width=_w, height=_h):
+        from resources.lib.framedelta import FrameDelta
+        images = [bytearray(os.urandom(64)) * (width * height * 4 / 64) for _ in xrange(2)]
+        delta = FrameDelta()
+        for i in xrange(number):
+            delta.update(images[i & 1], width, height)
+
+    benchmark(u'framedelta.%ix%i' % (_w, _h), 50)(_bench_framedelta)
+
+
+@benchmark(u'capture.pipelined.analysis', 200)
+def bench_capture_pipelined_analysis(env, number):
+    return env.run_capture(number, pipelined=True, analyze=True)
+
+
+# consumer process A/B, compare with capture.serial, capture.pipelined and capture.pipelined.analysis
+@benchmark(u'capture.process', 200)
+def bench_capture_process(env, number):
+    return env.run_capture(number, consumer_process=True)
+
+
+@benchmark(u'capture.process.pipelined', 200)
+def bench_capture_process_pipelined(env, number):
+    return env.run_capture(number, pipelined=True, consumer_process=True)
+
+
+@benchmark(u'capture.process.analysis', 200)
+def bench_capture_process_analysis(env, number):
+    return env.run_capture(number, pipelined=True, analyze=True, consumer_process=True)
+
+
+def _bench_broker(env, number, subscribers):
+    '''
+    Captured and delivered frames per second of a broker serving the given (name, fps, scale) subscribers
+    '''
+    import threading
+    from resources.lib.broker import CaptureBroker
+    config = env.xbmc._config
+    saved = config.latency, config.jitter
+    config.latency, config.jitter = 8.0, 1.0
+    broker = CaptureBroker(960, 540, timeout=100, loopsleep=5)
+    subs = [broker.subscribe(name, fps=fps, scale=scale) for name, fps, scale in subscribers]
+
+    def consume(subscriber):
+        while subscriber.get(timeout=1.0) is not None or not subscriber.closed:
+            pass
+    threads = [threading.Thread(target=consume, args=(s,)) for s in subs]
+    for t in threads:
+        t.start()
+    t0 = timer()
+    try:
+        broker.start()
+        while broker.captured < number and broker.is_alive():
+            time.sleep(0.01)
+        broker.abort()
+    finally:
+        config.latency, config.jitter = saved
+    elapsed = timer() - t0
+    for t in threads:
+        t.join()
+    result = {u'fps': broker.captured / elapsed}
+    for s in subs:
+        result[u'%s_fps' % s.name] = s.delivered / elapsed
+    return result
+
+
+@benchmark(u'broker.subscribers.1', 200)
+def bench_broker_one(env, number):
+    return _bench_broker(env, number, [(u'results', 0, 1)])
+
+
+@benchmark(u'broker.subscribers.3', 200)
+def bench_broker_three(env, number):
+    return _bench_broker(env, number, [(u'results', 0, 1), (u'colour', 5, 2), (u'preview', 2, 4)])
+
+
+@benchmark(u'capture.serial.trace', 200)
+def bench_capture_serial_trace(env, number):
+    return env.run_capture(number, trace=True)
+
+
+def _scrape(ct, interval=0.01):
+    '''
+    Serves ct.metrics on a free local port and fetches /metrics every interval seconds
+    '''
+    import threading
+    import urllib2
+    from resources.lib.metrics import MetricsServer
+    server = MetricsServer(u'127.0.0.1:0', ct.metrics)
+    server.start()
+    done = threading.Event()
+
+    def scrape():
+        url = 'http://%s/metrics' % server.address
+        while not done.wait(interval):
+            urllib2.urlopen(url).read()
+
+    scraper = threading.Thread(target=scrape, name='MetricsScraper')
+    scraper.start()
+
+    def stop():
+        done.set()
+        scraper.join()
+        server.stop()
+
+    return stop
+
+
+def _replay_trace(env, frames=400, width=960, height=540):
+    '''
+    A frames trace of alternating unique and duplicated random frames, written once per run
+    '''
+    fn = env.basename(u'replay.trace')
+    if not os.path.exists(fn):
+        from resources.lib.replay import TraceWriter
+        from resources.lib.sweep import SweepCell
+        cell = SweepCell(5, 0, 80)
+        meta = {u'detector': u'digest', u'videowidth': width * 2, u'videoheight': height * 2, u'sourcefps': 0.0,
+                u'plan': {u'cells': [cell.as_dict()]}}
+        writer = TraceWriter(fn, meta, frames=True, cells=[cell])
+        image = None
+        for i in xrange(frames):
+            if i % 2 == 0:
+                image = bytearray(os.urandom(64)) * (width * height * 4 / 64)
+            writer.add([i / 60.0, 5, 80, 0, i + 1, 0.008, len(image), False, 0.0, width, height], cell, i % 2 == 1,
+                       image)
+        writer.close()
+    return fn
+
+
+for _mode, _kwargs in [(u'digest', {u'detector': u'digest'}), (u'exact', {u'detector': u'exact'}), (u'pipelined', {u'pipelined': True}),
+                       (u'process', {u'consumer_process': True})]:
+    def _bench_replay(env, number, kwargs=_kwargs):
+        from resources.lib.replay import TraceReader
+        reader = TraceReader(_replay_trace(env, frames=number))
+        try:
+            thread = env.default.ReplayThread(reader, basename=env.basename(u'replay'), speed=0, framedelta=False,
+                                              **kwargs)
+            thread.start()
+            thread.join()
+        finally:
+            reader.close()
+        return {u'fps': thread.counter / thread.elapsed, u'uniquefps': thread.uniqueframes / thread.elapsed}
+
+    benchmark(u'replay.%s' % _mode, 400)(_bench_replay)
+
+
+@benchmark(u'capture.serial.scraped', 200)
+def bench_capture_serial_scraped(env, number):
+    return env.run_capture(number, observer=_scrape)
+
+
+@benchmark(u'metrics.prometheus', 2000)
+def bench_metrics_prometheus(env, number):
+    from resources.lib.metrics import format_prometheus
+    ct = env.capture_thread()
+    ct.time0 = timer()
+    try:
+        for _ in xrange(number):
+            format_prometheus(ct.metrics())
+    finally:
+        ct.capture_monitor_thread.abort()
+
+
+@benchmark(u'tracer.add', 100000)
+def bench_tracer_add(env, number):
+    from resources.lib.tracing import Tracer
+    tracer = Tracer(capacity=65536)
+    add = tracer.add
+    for i in xrange(number):
+        add(u'frame', 1.0, 1.001)
+
+
+def _bench_log(env, number, threshold, background=False, **kwargs):
+    '''
+    number debug messages with two args, written by the simulated xbmc.log to a scratch file.
+    The time includes draining the async queue, caller_us is the cost seen by the logging thread.
+    '''
+    from resources.lib.utils.kodilogging import KodiLogger
+    config = env.xbmc._config
+    saved = config.loglevel, config.logfile, KodiLogger.threshold
+    config.loglevel, config.logfile = 0, open(env.basename(u'log.txt'), 'w')
+    KodiLogger.setThreshold(threshold)
+    KodiLogger.setAsync(background, maxsize=number + 1)
+    try:
+        log = KodiLogger.log
+        t0 = timer()
+        for i in xrange(number):
+            log(KodiLogger.LOGDEBUG, u'frame %i: %.3f ms', i, 8.0, **kwargs)
+        caller = timer() - t0
+        KodiLogger.setAsync(False)  # waits for the handler to drain the queue
+    finally:
+        KodiLogger.setAsync(False)
+        config.logfile.close()
+        config.loglevel, config.logfile, KodiLogger.threshold = saved
+    return {u'caller_us': caller / number * 1e6}
+
+
+@benchmark(u'log.filtered', 100000)
+def bench_log_filtered(env, number):
+    from resources.lib.utils.kodilogging import KodiLogger
+    return _bench_log(env, number, KodiLogger.LOGNOTICE)
+
+
+@benchmark(u'log.sync', 20000)
+def bench_log_sync(env, number):
+    from resources.lib.utils.kodilogging import KodiLogger
+    return _bench_log(env, number, KodiLogger.LOGDEBUG)
+
+
+@benchmark(u'log.async', 20000)
+def bench_log_async(env, number):
+    from resources.lib.utils.kodilogging import KodiLogger
+    return _bench_log(env, number, KodiLogger.LOGDEBUG, background=True)
+
+
+@benchmark(u'log.ratelimited', 100000)
+def bench_log_ratelimited(env, number):
+    from resources.lib.utils.kodilogging import KodiLogger
+    return _bench_log(env, number, KodiLogger.LOGDEBUG, every=1.0)
+
+
+@benchmark(u'capture.serial.debuglog', 200)
+def bench_capture_serial_debuglog(env, number):
+    from resources.lib.utils.kodilogging import KodiLogger
+    saved = KodiLogger.threshold
+    KodiLogger.setThreshold(KodiLogger.LOGDEBUG)
+    try:
+        return env.run_capture(number, pipelined=False)
+    finally:
+        KodiLogger.setThreshold(saved)
+
+
+@benchmark(u'monitor.write', 20000)
+def bench_monitor_write(env, number):
+    monitor = env.default.CaptureMonitorThread(basename=env.basename(u'monitor'))
+    monitor.start()
+    put = monitor.resultQ.put
+    for i in xrange(number):
+        put([i * 0.01, 5, 50, 0, i, 0.008, 2073600, False, 0.0001, 960, 540, 0.5, 0.1, 0.0])
+    monitor.abort(timeout=60)
+
+
+@benchmark(u'player.getVideoInfo', 2000)
+def bench_getvideoinfo(env, number):
+    player = env.default.Player()
+    for _ in xrange(number):
+        player.getVideoInfo(1)
+
+
+@benchmark(u'player.getInfo.cached', 2000)
+def bench_getinfo_cached(env, number):
+    player = env.default.Player()
+    env.xbmc._playing.set()
+    try:
+        for _ in xrange(number):
+            player.getInfo()
+    finally:
+        env.xbmc._playing.clear()
+
+
+@benchmark(u'rollingstats.add_value', 100000)
+def bench_rollingstats_add(env, number):
+    from resources.lib.utils.rolling_stats import RollingStats
+    rs = RollingStats()
+    add = rs.add_value
+    for i in xrange(number):
+        add(float(i))
+
+
+@benchmark(u'rollingstats.add_value.window', 100000)
+def bench_rollingstats_add_window(env, number):
+    from resources.lib.utils.rolling_stats import RollingStats
+    rs = RollingStats(windowsize=100)
+    add = rs.add_value
+    for i in xrange(number):
+        add(float(i))
+
+
+@benchmark(u'rollingstats.add_values', 100000)
+def bench_rollingstats_add_values(env, number):
+    from resources.lib.utils.rolling_stats import RollingStats
+    rs = RollingStats()
+    values = [float(i) for i in xrange(1000)]
+    for _ in xrange(number // 1000):
+        rs.add_values(values)
+
+
+@benchmark(u'rollingstats.get_variance', 100000)
+def bench_rollingstats_variance(env, number):
+    from resources.lib.utils.rolling_stats import RollingStats
+    rs = RollingStats()
+    rs.add_values([1.0, 2.0, 3.0])
+    get = rs.get_variance
+    for _ in xrange(number):
+        get()
+
+
+@benchmark(u'report.aggregate', 655360)
+def bench_report_aggregate(env, number):
+    import numpy
+    from resources.lib.report import Aggregator, CHUNKSIZE
+    rows = numpy.arange(CHUNKSIZE)
+    chunk = {u'playtime': rows * 0.015, u'timeout': (rows // 1000 % 8 + 1) * 10.0,
+             u'loopsleep': numpy.full(CHUNKSIZE, 5.0), u'capturesleep': numpy.zeros(CHUNKSIZE),
+             u'latency': numpy.random.gamma(4.0, 2.0, CHUNKSIZE), u'imagelength': numpy.full(CHUNKSIZE, 2073600),
+             u'dup': numpy.random.rand(CHUNKSIZE) < 0.6, u'width': numpy.full(CHUNKSIZE, 960),
+             u'height': numpy.full(CHUNKSIZE, 540)}
+    aggregator = Aggregator()
+    for _ in xrange(number // CHUNKSIZE):
+        aggregator.add_chunk(chunk)
+
+
+def run(names=None, repeat=5):
+    env = BenchEnv()
+    results = {}
+    try:
+        for name, number, fn in BENCHMARKS:
+            if names and not [n for n in names if name.startswith(n)]:
+                continue
+            try:
+                results[name] = measure(fn, env, number, repeat)
+            except ImportError as e:  # an optional dependency such as NumPy is missing
+                results[name] = {u'skipped': unicode(e)}
+                sys.stdout.write(u'%-40s skipped: %s\n' % (name, e))
+                continue
+            except Exception as e:  # one broken benchmark must not lose the results of the others
+                results[name] = {u'error': u'%s: %s' % (type(e).__name__, e)}
+                sys.stdout.write(u'%-40s error: %s\n' % (name, results[name][u'error']))
+                continue
+            extra = u''.join(u'  %s=%.2f' % (k, v) for k, v in sorted(results[name].iteritems())
+                             if k not in (u'median', u'best', u'number', u'repeat'))
+            sys.stdout.write(u'%-40s %12.3f us/op%s\n' % (name, results[name][u'median'] * 1e6, extra))
+    finally:
+        env.close()
+    return {u'meta': {u'time': time.time(), u'python': platform.python_version(), u'platform': platform.platform(),
+                      u'machine': platform.machine(), u'repeat': repeat}, u'results': results}
+
+
+def compare(current, baseline, threshold):
+    '''
+    Returns a list of (name, baseline, current, ratio) for benchmarks slower than threshold allows
+    '''
+    regressions = []
+    for name, result in current[u'results'].iteritems():
+        try:
+            old, new = baseline[u'results'][name][u'median'], result[u'median']
+        except KeyError:
+            continue  # new, skipped or failed
+        ratio = new / old if old > 0 else 1.0
+        if ratio > 1.0 + threshold:
+            regressions.append((name, old, new, ratio))
+    return regressions
+
+
+def latest(directory, exclude=None):
+    files = sorted(f for f in glob.glob(os.path.join(directory, u'bench-*.json')) if f != exclude)
+    if files:
+        return files[-1]
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=u'testRenderCapture microbenchmarks')
+    parser.add_argument('--only', action='append', default=[], help=u'benchmark name prefix, may be repeated')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--outdir', default=os.path.expanduser(u'~/.kodi/benchmarks'))
+    parser.add_argument('--baseline', help=u"results file to compare with, or 'latest'")
+    parser.add_argument('--threshold', type=float, default=0.2)
+    args = parser.parse_args(argv)
+    baselinefn = args.baseline
+    if baselinefn == u'latest':
+        baselinefn = latest(args.outdir)
+    report = run(args.only, args.repeat)
+    if not os.path.isdir(args.outdir):
+        os.makedirs(args.outdir)
+    fn = os.path.join(args.outdir, u'bench-%s.json' % time.strftime('%Y%m%d-%H%M%S'))
+    with open(fn, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    sys.stdout.write(u'results saved to %s\n' % fn)
+    if baselinefn:
+        with open(baselinefn, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        for name, old, new, ratio in regressions:
+            sys.stdout.write(u'REGRESSION %s: %.3f -> %.3f us/op (x%.2f)\n' % (name, old * 1e6, new * 1e6, ratio))
+        if regressions:
+            return 1
+        sys.stdout.write(u'no regressions against %s\n' % baselinefn)
+    if [name for name, result in report[u'results'].iteritems() if u'error' in result]:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
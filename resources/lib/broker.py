@@ -0,0 +1,230 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2016 KenV99
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+'''
+A single RenderCapture shared by several consumers. The broker captures at the rate of its fastest
+subscriber and offers every frame to each subscriber; a subscriber takes frames at its own rate and
+downscale, through a bounded queue that drops the oldest frame when the consumer falls behind.
+'''
+import collections
+import threading
+from timeit import default_timer as timer
+
+import xbmc
+
+Frame = collections.namedtuple('Frame', 'seq timestamp elapsed width height image')
+
+
+def downscale(image, width, height, factor, bpp=4):
+    '''
+    Nearest neighbour decimation of a BGRA buffer by an integer factor. Returns (image, width, height).
+    '''
+    if factor <= 1:
+        return image, width, height
+    outw = width // factor
+    outh = height // factor
+    out = bytearray(outw * outh * bpp)
+    stride = width * bpp
+    rowlen = outw * bpp
+    for y in xrange(outh):
+        row = image[y * factor * stride:y * factor * stride + outw * factor * bpp]
+        o = y * rowlen
+        for c in xrange(bpp):
+            out[o + c:o + rowlen:bpp] = row[c::factor * bpp]
+    return out, outw, outh
+
+
+class Subscriber(object):
+    '''
+    fps of 0 takes every captured frame. lag is how many frames the broker had captured after the frame
+    the consumer last took, at the time it took it, and age how old that frame was then (ms); frames
+    skipped for the subscriber's rate are not lag. dropped counts frames pushed out of the full queue;
+    with block set nothing is dropped, offer() waits for the consumer instead.
+    '''
+
+    def __init__(self, name, fps=0.0, scale=1, maxsize=4, block=False):
+        self.name = name
+        self.block = block
+        self.interval = 1.0 / fps if fps > 0 else 0.0
+        self.scale = max(1, int(scale))
+        self.queue = collections.deque(maxlen=max(1, maxsize))
+        self.cond = threading.Condition()
+        self.closed = False
+        self.due = 0.0
+        self.offered = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.newest = -1
+        self.lag = 0
+        self.maxlag = 0
+        self.age = 0.0
+
+    def offer(self, frame):
+        '''
+        Called by the broker for every captured frame; frames arriving before the subscriber's next
+        due time are skipped. Due times stay on a grid of interval from the first frame taken, so a late
+        frame or a gap does not shift the schedule.
+        '''
+        self.newest = frame.seq
+        if frame.timestamp < self.due:
+            return
+        if self.interval:
+            if not self.due:
+                self.due = frame.timestamp
+            self.due += self.interval * (int((frame.timestamp - self.due) / self.interval) + 1)
+        with self.cond:
+            while self.block and len(self.queue) == self.queue.maxlen and not self.closed:
+                self.cond.wait(0.5)
+            if self.closed:
+                return
+            if len(self.queue) == self.queue.maxlen:
+                self.dropped += 1
+            self.queue.append(frame)
+            self.offered += 1
+            self.cond.notify()
+
+    def get(self, timeout=None):
+        '''
+        The oldest queued frame, downscaled, or None once closed or after timeout seconds
+        '''
+        with self.cond:
+            if not self.queue and not self.closed:
+                self.cond.wait(timeout)
+            if not self.queue:
+                return None
+            frame = self.queue.popleft()
+            self.cond.notify_all()  # a blocked offer() waits for the space
+            self.delivered += 1
+            self.lag = self.newest - frame.seq
+            if self.lag > self.maxlag:
+                self.maxlag = self.lag
+            self.age = timer() - frame.timestamp
+        if self.scale > 1 and len(frame.image) >= frame.width * frame.height * 4:
+            image, width, height = downscale(frame.image, frame.width, frame.height, self.scale)
+            frame = frame._replace(image=image, width=width, height=height)
+        return frame
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def next_due(self):
+        return self.due if self.interval else 0.0
+
+    def get_stats(self):
+        with self.cond:
+            return {u'offered': self.offered, u'delivered': self.delivered, u'dropped': self.dropped,
+                    u'queued': len(self.queue), u'lag': self.lag,
+                    u'maxlag': self.maxlag, u'age': self.age * 1000.0}
+
+
+class CaptureBroker(threading.Thread):
+    '''
+    Owns the RenderCapture. Frames that fail to capture are counted in failed and not offered.
+    Subscribers may be added and removed while the broker runs.
+    '''
+
+    def __init__(self, width, height, timeout=100, loopsleep=5):
+        super(CaptureBroker, self).__init__(name='CaptureBroker')
+        self.width = width
+        self.height = height
+        self.timeout = timeout
+        self.loopsleep = loopsleep
+        self.rc = xbmc.RenderCapture()
+        self.legacy = hasattr(self.rc, 'waitForCaptureStateChangeEvent')
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.abort_evt = threading.Event()
+        self.captured = 0
+        self.failed = 0
+        self.capturetime = 0.0
+        self.lasterror = None
+        self.time0 = timer()
+
+    def subscribe(self, name, fps=0.0, scale=1, maxsize=4, block=False):
+        subscriber = Subscriber(name, fps=fps, scale=scale, maxsize=maxsize, block=block)
+        with self.lock:
+            self.subscribers = self.subscribers + [subscriber]
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers = [s for s in self.subscribers if s is not subscriber]
+        subscriber.close()
+
+    def grab(self):
+        try:
+            if self.legacy:
+                self.rc.waitForCaptureStateChangeEvent(self.timeout)
+                if self.rc.getCaptureState() != xbmc.CAPTURE_STATE_DONE:
+                    return None
+                return self.rc.getImage()
+            self.rc.capture(self.width, self.height)
+            image = self.rc.getImage(self.timeout)
+            return image if len(image) > 0 else None
+        except Exception as e:
+            self.lasterror = e
+            return None
+
+    def run(self):
+        if self.legacy:
+            self.rc.capture(self.width, self.height, xbmc.CAPTURE_FLAG_CONTINUOUS)
+        seq = 0
+        while not self.abort_evt.is_set():
+            subscribers = self.subscribers
+            if not subscribers:
+                self.abort_evt.wait(0.05)
+                continue
+            # sleep until the earliest subscriber wants a frame, at least loopsleep
+            wait = min(s.next_due() for s in subscribers) - timer()
+            xbmc.sleep(max(self.loopsleep, int(wait * 1000.0)))
+            t0 = timer()
+            image = self.grab()
+            elapsed = timer() - t0
+            self.capturetime += elapsed
+            if image is None:
+                self.failed += 1
+                continue
+            self.captured += 1
+            frame = Frame(seq, t0, elapsed, self.width, self.height, image)
+            seq += 1
+            for subscriber in subscribers:
+                subscriber.offer(frame)
+        for subscriber in self.subscribers:
+            subscriber.close()
+
+    def abort(self, timeout=5):
+        self.abort_evt.set()
+        if self.is_alive():
+            self.join(timeout)
+
+    def get_stats(self):
+        elapsed = timer() - self.time0
+        return {u'captured': self.captured, u'failed': self.failed,
+                u'capturerate': self.captured / elapsed if elapsed > 0 else 0.0,
+                u'capturetime': self.capturetime,
+                u'subscribers': dict((s.name, s.get_stats()) for s in self.subscribers)}
+
+
+def format_stats(stats):
+    lines = [u'broker: %(captured)i frames captured (%(capturerate).2f/s), %(failed)i failed' % stats]
+    for name, s in sorted(stats[u'subscribers'].items()):
+        lines.append(u'subscriber %s: %i delivered, %i dropped, lag %i frames (max %i, age %.1f ms), %i queued' % (
+            name, s[u'delivered'], s[u'dropped'], s[u'lag'], s[u'maxlag'], s[u'age'], s[u'queued']))
+    return lines
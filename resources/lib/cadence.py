@@ -0,0 +1,121 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2016 KenV99
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+'''
+Cadence of unique frames measured against the source frame rate.
+'''
+import collections
+import math
+
+
+class CadenceAnalyzer(object):
+    '''
+    Places each unique frame on the source frame grid (1/fps) and counts how many source frames
+    passed since the previous one. A step of 1 means every source frame was seen, larger steps are
+    missed source frames. Duplicate captures are source frames that were captured more than once.
+    A capture sees a frame some time after it was shown, so the grid is anchored on the least delayed
+    frame so far: a unique frame that would land on the previous position was shown earlier than the
+    anchor assumed, the anchor moves back to it and it is counted as an early frame, not as a miss.
+    The judder pattern is the most frequent run of steps, reduced to its shortest period,
+    e.g. 1-2 for alternating single and double steps.
+    '''
+
+    def __init__(self, fps, patternlength=6):
+        self.fps = float(fps)
+        self.interval = 1.0 / self.fps
+        self.captures = 0
+        self.doubles = 0
+        self.unique = 0
+        self.anchor = None  # timer value of grid position 0, moved back to the least delayed frame
+        self.position = 0
+        self.missed = 0
+        self.early = 0
+        self.steps = collections.Counter()
+        self.window = collections.deque(maxlen=patternlength)
+        self.patterns = collections.Counter()
+        self.delay = 0.0  # sum and sum of squares of the delays after the anchor, for the jitter
+        self.sqdelay = 0.0
+
+    def add_capture(self, timestamp, unique):
+        '''
+        timestamp in seconds of a capture that returned an image, unique False for a duplicate.
+        Positions are taken on the grid from the anchor so that rounding errors do not accumulate.
+        '''
+        self.captures += 1
+        if not unique:
+            self.doubles += 1
+            return
+        self.unique += 1
+        if self.anchor is None:
+            self.anchor = timestamp
+            return
+        position = int(math.floor((timestamp - self.anchor) * self.fps))
+        if position <= self.position:
+            position = self.position + 1
+            shift = self.anchor - (timestamp - position * self.interval)
+            self.anchor -= shift
+            n = self.unique - 2  # delays recorded so far, all grow by shift
+            self.sqdelay += 2.0 * shift * self.delay + n * shift * shift
+            self.delay += n * shift
+            self.early += 1
+        step = position - self.position
+        self.position = position
+        self.missed += step - 1
+        delay = timestamp - self.anchor - position * self.interval
+        self.delay += delay
+        self.sqdelay += delay * delay
+        self.steps[step] += 1
+        self.window.append(min(step, 9))
+        if len(self.window) == self.window.maxlen:
+            self.patterns[canonical(tuple(self.window))] += 1
+
+    def pattern(self):
+        if not self.patterns:
+            return u''
+        return u'-'.join(unicode(s) for s in self.patterns.most_common(1)[0][0])
+
+    def summary(self):
+        intervals = self.unique - 1
+        regular = 0.0
+        if self.patterns:
+            regular = float(self.patterns.most_common(1)[0][1]) / sum(self.patterns.values())
+        return {u'sourcefps': self.fps, u'captures': self.captures, u'doublecaptures': self.doubles,
+                u'missedframes': self.missed, u'earlyframes': self.early,
+                u'efficiency': 100.0 * (self.unique - 1) / self.position if self.position > 0 else 0.0,
+                u'judder': self.pattern(), u'judderregularity': regular,
+                u'steps': dict((unicode(k), v) for k, v in sorted(self.steps.items())),
+                u'cadencejitter': math.sqrt(max(0.0, self.sqdelay / intervals - (self.delay / intervals) ** 2)) *
+                1000.0 if intervals > 0 else 0.0}
+
+
+def canonical(window):
+    '''
+    Shortest period of a run of steps, rotated to its smallest form so phase does not matter
+    '''
+    n = len(window)
+    for period in xrange(1, n + 1):
+        if n % period == 0 and window == window[:period] * (n / period):
+            break
+    window = window[:period]
+    return min(window[i:] + window[:i] for i in xrange(period))
+
+
+def format_summary(summary):
+    return (u'cadence at %(sourcefps).3f fps: efficiency=%(efficiency).1f%% missed=%(missedframes)i '
+            u'double=%(doublecaptures)i early=%(earlyframes)i judder=%(judder)s (%(judderregularity).2f) '
+            u'jitter=%(cadencejitter).2f ms' % summary)
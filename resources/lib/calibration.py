@@ -0,0 +1,100 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2016 KenV99
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+'''
+Estimates the fixed cost of timing a capture call: the timer() pair plus the call into the capture
+function with the renderer work stubbed out. Samples are taken in batches until the median is stable.
+'''
+import time
+from timeit import default_timer as timer
+
+
+def _percentile(ordered, p):
+    if not ordered:
+        return float('nan')
+    return ordered[min(len(ordered) - 1, int(p * (len(ordered) - 1) + 0.5))]
+
+
+class OverheadCalibrator(object):
+    '''
+    fn(*args) is the stubbed capture function. calibrate() returns a record (dict, seconds) with the
+    median overhead used for correction, its spread and the timer() overhead alone.
+    '''
+
+    def __init__(self, fn, args=(), batch=100, rel_tol=0.02, abs_tol=2e-7, min_samples=300, max_samples=20000,
+                 max_time=0.5):
+        self.fn = fn
+        self.args = args
+        self.batch = batch
+        self.rel_tol = rel_tol
+        self.abs_tol = abs_tol
+        self.min_samples = min_samples
+        self.max_samples = max_samples
+        self.max_time = max_time
+        self.records = []
+
+    def sample_timer(self, samples):
+        for _ in xrange(self.batch):
+            t0 = timer()
+            samples.append(timer() - t0)
+
+    def sample_call(self, samples):
+        fn = self.fn
+        args = self.args
+        for _ in xrange(self.batch):
+            t0 = timer()
+            fn(*args)
+            samples.append(timer() - t0)
+
+    def converge(self, sampler):
+        '''
+        Adds batches until two consecutive medians agree within tolerance. Returns (sorted samples, converged)
+        '''
+        samples = []
+        last = None
+        stable = 0
+        tstart = timer()
+        while len(samples) < self.max_samples and timer() - tstart < self.max_time:
+            sampler(samples)
+            median = _percentile(sorted(samples), 0.5)
+            if last is not None and abs(median - last) <= max(self.rel_tol * median, self.abs_tol):
+                stable += 1
+            else:
+                stable = 0
+            last = median
+            if stable >= 2 and len(samples) >= self.min_samples:
+                return sorted(samples), True
+        return sorted(samples), False
+
+    def calibrate(self):
+        timersamples, timerconverged = self.converge(self.sample_timer)
+        callsamples, callconverged = self.converge(self.sample_call)
+        median = _percentile(callsamples, 0.5)
+        record = {u'time': time.time(), u'overhead': median, u'samples': len(callsamples),
+                  u'p25': _percentile(callsamples, 0.25), u'p75': _percentile(callsamples, 0.75),
+                  u'mad': _percentile(sorted(abs(s - median) for s in callsamples), 0.5),
+                  u'min': callsamples[0], u'timeroverhead': _percentile(timersamples, 0.5),
+                  u'timersamples': len(timersamples), u'converged': timerconverged and callconverged}
+        self.records.append(record)
+        return record
+
+
+def format_record(record):
+    return (u'overhead %.2f us (p25 %.2f, p75 %.2f, mad %.2f us, n=%i%s), timer() %.2f us' % (
+        record[u'overhead'] * 1e6, record[u'p25'] * 1e6, record[u'p75'] * 1e6, record[u'mad'] * 1e6,
+        record[u'samples'], u'' if record[u'converged'] else u', not converged', record[u'timeroverhead'] * 1e6))
@@ -0,0 +1,136 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2016 KenV99
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+'''
+Live statistics for one sweep cell, summarised and written out when the cell ends.
+'''
+import collections
+import json
+import math
+
+from resources.lib.utils.rolling_stats import RollingStats
+from resources.lib.utils.quantiles import QuantileSketch
+from resources.lib.cadence import CadenceAnalyzer, format_summary as format_cadence
+
+
+class CellStats(object):
+    '''
+    Capture time statistics (ms) plus drop and unique frame counts for a sweep cell.
+    width and height follow the frames, the adaptive controller may resize within a cell; the summary
+    gives the size most frames were captured at and, when there were several, frames per size.
+    '''
+
+    def __init__(self, cell, width, height, sourcefps=0.0):
+        self.cell = cell
+        self.cadence = CadenceAnalyzer(sourcefps) if sourcefps > 0 else None
+        self.width = width
+        self.height = height
+        self.sizes = collections.Counter()
+        self.latency = RollingStats(expected_mean=0.0)
+        self.sketch = QuantileSketch((0.5, 0.95, 0.99))
+        self.frames = 0
+        self.dropped = 0
+        self.unique = 0
+        self.distinct = 0
+        self.torn = 0
+        self.min = float('inf')
+        self.max = float('-inf')
+        self.first = None
+        self.last = None
+
+    def add_frame(self, playtime, te, imagelength, duplicate, changed=-1.0, tear=-1.0, width=None, height=None):
+        '''
+        changed and tear come from FrameDelta, negative when not measured. A frame is distinct when
+        any block changed visibly, or when not measured and not a duplicate.
+        '''
+        if width is not None:
+            self.width, self.height = width, height
+        self.sizes[(self.width, self.height)] += 1
+        ms = te * 1000.0
+        self.latency.add_value(ms)
+        self.sketch.add_value(ms)
+        self.frames += 1
+        if ms < self.min:
+            self.min = ms
+        if ms > self.max:
+            self.max = ms
+        if imagelength == 0:
+            self.dropped += 1
+        elif not duplicate and imagelength > 1:
+            self.unique += 1
+            if self.cadence is not None:
+                self.cadence.add_capture(playtime + te, True)
+            if changed != 0.0:
+                self.distinct += 1
+        if duplicate and imagelength > 1 and self.cadence is not None:
+            self.cadence.add_capture(playtime + te, False)
+        if tear >= 0.5:
+            self.torn += 1
+        if self.first is None:
+            self.first = playtime
+        self.last = playtime + te
+
+    def converged(self, ci_target, min_frames):
+        '''
+        True once the 95% confidence interval half-width of the mean capture time is within
+        ci_target (a fraction of the mean)
+        '''
+        if ci_target <= 0 or self.frames < min_frames:
+            return False
+        halfwidth = 1.96 * math.sqrt(self.variance() / self.frames)
+        return halfwidth <= ci_target * abs(self.latency.get_mean())
+
+    def variance(self):
+        try:
+            return self.latency.get_variance()
+        except ZeroDivisionError:
+            return 0.0
+
+    def summary(self):
+        duration = (self.last - self.first) if self.frames > 0 else 0.0
+        variance = self.variance()
+        quantiles = self.sketch.values()
+        width, height = self.sizes.most_common(1)[0][0] if self.sizes else (self.width, self.height)
+        summary = self.cell.as_dict()
+        summary.update({u'width': width, u'height': height, u'frames': self.frames,
+                        u'mean': self.latency.get_mean(), u'variance': variance, u'stdev': math.sqrt(variance),
+                        u'min': self.min if self.frames else None, u'max': self.max if self.frames else None,
+                        u'p50': quantiles[0.5], u'p95': quantiles[0.95], u'p99': quantiles[0.99],
+                        u'dropped': self.dropped, u'droprate': float(self.dropped) / self.frames if self.frames else 0.0,
+                        u'unique': self.unique, u'distinct': self.distinct, u'torn': self.torn, u'duration': duration,
+                        u'framerate': self.frames / duration if duration > 0 else 0.0,
+                        u'uniqueframerate': self.unique / duration if duration > 0 else 0.0,
+                        u'distinctframerate': self.distinct / duration if duration > 0 else 0.0})
+        if len(self.sizes) > 1:
+            summary[u'sizes'] = dict((u'%ix%i' % size, n) for size, n in self.sizes.iteritems())
+        if self.cadence is not None:
+            summary[u'cadence'] = self.cadence.summary()
+        return summary
+
+
+def format_summary(summary):
+    return (u'cell loopsleep=%(loopsleep)i capturesleep=%(capturesleep)i timeout=%(timeout)i %(width)ix%(height)i: '
+            u'frames=%(frames)i mean=%(mean).3f ms sd=%(stdev).3f p50=%(p50).3f p95=%(p95).3f p99=%(p99).3f '
+            u'droprate=%(droprate).3f fps=%(framerate).2f unique fps=%(uniqueframerate).2f '
+            u'distinct fps=%(distinctframerate).2f torn=%(torn)i' % summary +
+            (u' ' + format_cadence(summary[u'cadence']) if u'cadence' in summary else u''))
+
+
+def write_summaries(fn, meta, summaries):
+    with open(fn, 'w') as f:
+        json.dump({u'run': meta, u'cells': summaries}, f, indent=2, sort_keys=True)
@@ -0,0 +1,120 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2016 KenV99
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+'''
+Closed loop control of the capture size and inter-frame sleep.
+
+Every window frames the controller looks at the achieved frame rate, the drop rate and the busy
+fraction (time spent waiting in getImage over wall time) and makes at most one adjustment:
+    - behind target or dropping frames: remove sleep first, then shrink
+    - over the busy budget: shrink when a target rate is set, otherwise add sleep
+    - comfortably ahead with headroom: grow the capture size back towards the video size
+    - ahead without room to grow: add sleep so the target rate is not overshot
+The capture size keeps the video aspect ratio and is stepped by a constant factor.
+'''
+from timeit import default_timer as timer
+
+
+class AdaptiveController(object):
+    def __init__(self, videowidth, videoheight, scale=2.0, loopsleep=5, target_fps=0.0, cpu_budget=0.0,
+                 max_droprate=0.05, window=30, step=1.25, minwidth=64, minscale=1.0):
+        self.videowidth = videowidth
+        self.videoheight = videoheight
+        self.scale = float(scale)
+        self.loopsleep = int(loopsleep)
+        self.target_fps = float(target_fps)
+        self.cpu_budget = float(cpu_budget)  # fraction of wall time, 0 = not used
+        self.max_droprate = max_droprate
+        self.window = window
+        self.step = step
+        self.minscale = minscale
+        self.maxscale = max(minscale, float(videowidth) / minwidth)
+        self.adjustments = []
+        self.reset_window()
+
+    def reset_window(self):
+        self.frames = 0
+        self.drops = 0
+        self.busy = 0.0
+        self.start = timer()
+
+    def size(self):
+        width = max(2, int(self.videowidth / self.scale)) & ~1
+        height = max(2, int(round(width * float(self.videoheight) / self.videowidth))) & ~1
+        return width, height
+
+    def update(self, te, imagelength):
+        '''
+        Feeds one frame. Returns a description of the adjustment made, or None.
+        '''
+        self.frames += 1
+        self.busy += te
+        if imagelength == 0:
+            self.drops += 1
+        if self.frames < self.window:
+            return None
+        elapsed = timer() - self.start
+        fps = self.frames / elapsed if elapsed > 0 else 0.0
+        droprate = float(self.drops) / self.frames
+        busy = self.busy / elapsed if elapsed > 0 else 0.0
+        meanlatency = self.busy / self.frames
+        self.reset_window()
+        behind = (self.target_fps > 0 and fps < self.target_fps * 0.95) or droprate > self.max_droprate
+        overbudget = self.cpu_budget > 0 and busy > self.cpu_budget
+        if behind:
+            if self.loopsleep > 0 and not overbudget:
+                action = self.set_sleep(self.loopsleep // 2)
+            else:
+                action = self.set_scale(self.scale * self.step)
+        elif overbudget:
+            if self.target_fps > 0:
+                action = self.set_scale(self.scale * self.step)
+            else:
+                action = self.set_sleep(self.loopsleep + max(1, self.loopsleep // 2))
+        else:
+            interval = 1.0 / self.target_fps if self.target_fps > 0 else None
+            headroom = ((interval is None or meanlatency * self.step * self.step < interval * 0.8) and
+                        (self.cpu_budget <= 0 or busy * self.step * self.step < self.cpu_budget * 0.8))
+            if headroom and self.scale > self.minscale and (self.target_fps > 0 or self.cpu_budget > 0):
+                action = self.set_scale(self.scale / self.step)
+            elif interval is not None and fps > self.target_fps * 1.1:
+                slack = interval - elapsed / self.window
+                action = self.set_sleep(self.loopsleep + max(1, int(slack * 1000.0 / 2)))
+            else:
+                action = None
+        if action is not None:
+            action = u'%s (fps %.1f, droprate %.3f, busy %.2f, mean latency %.2f ms)' % (
+                action, fps, droprate, busy, meanlatency * 1000.0)
+            self.adjustments.append(action)
+        return action
+
+    def set_sleep(self, loopsleep):
+        loopsleep = max(0, loopsleep)
+        if loopsleep == self.loopsleep:
+            return None
+        old, self.loopsleep = self.loopsleep, loopsleep
+        return u'loopsleep %i -> %i ms' % (old, loopsleep)
+
+    def set_scale(self, scale):
+        scale = min(self.maxscale, max(self.minscale, scale))
+        if scale == self.scale:
+            return None
+        old = self.size()
+        self.scale = scale
+        new = self.size()
+        return u'capture size %ix%i -> %ix%i' % (old[0], old[1], new[0], new[1])
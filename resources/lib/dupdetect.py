@@ -0,0 +1,106 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2016 KenV99
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+import binascii
+
+
+class DuplicateDetector(object):
+    '''
+    Base class for duplicate frame detection.
+    Only a digest of the previous frame is retained, except by ExactDetector which keeps the frame.
+    '''
+    name = u'base'
+
+    def __init__(self):
+        self.last = None
+
+    def digest(self, image):
+        raise NotImplementedError
+
+    def is_duplicate(self, image):
+        return self.check(self.digest(image))
+
+    def check(self, d):
+        '''
+        Compares a digest with the previous one. Split from digest() so that digests can be
+        computed out of order and compared in capture order.
+        '''
+        duplicate = (d == self.last)
+        self.last = d
+        return duplicate
+
+    def reset(self):
+        self.last = None
+
+
+class DigestDetector(DuplicateDetector):
+    '''
+    CRC32 of the whole buffer (non-cryptographic), one pass and no copy of the frame is held.
+    binascii is used rather than zlib since it accepts a bytearray without a copy.
+    Under Python 2 this is slower than a plain comparison, see the dupdetect benchmarks.
+    '''
+    name = u'digest'
+
+    def digest(self, image):
+        return len(image), binascii.crc32(image) & 0xffffffff
+
+
+class SampledDetector(DuplicateDetector):
+    '''
+    Checksum of a sparse grid of pixels, B, G and R channels only (alpha is constant). The default:
+    cost is independent of resolution, but small localized changes may be missed.
+    '''
+    name = u'sampled'
+
+    def __init__(self, samples=1024, bpp=4):
+        super(SampledDetector, self).__init__()
+        self.samples = samples
+        self.bpp = bpp
+
+    def digest(self, image):
+        length = len(image)
+        step = max(1, length / self.bpp / self.samples) * self.bpp
+        crc = 0
+        for channel in xrange(0, min(3, self.bpp)):
+            crc = binascii.crc32(image[channel::step], crc)
+        return length, crc & 0xffffffff
+
+
+class ExactDetector(DuplicateDetector):
+    '''
+    Full byte by byte comparison against the previous frame, opt-in: it keeps one whole frame. Under
+    Python 2 it beats the full digest even on identical frames, see the dupdetect benchmarks. The frame is
+    not copied, so it must not be modified after capture (getImage returns a new buffer, FramePool keeps
+    spare slots).
+    '''
+    name = u'exact'
+
+    def digest(self, image):
+        return image
+
+
+DETECTORS = {DigestDetector.name: DigestDetector,
+             SampledDetector.name: SampledDetector,
+             ExactDetector.name: ExactDetector}
+
+
+def get_detector(name=u'sampled', **kwargs):
+    try:
+        return DETECTORS[name](**kwargs)
+    except KeyError:
+        raise ValueError(u'Unknown duplicate detector: %s' % name)
@@ -0,0 +1,125 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2016 KenV99
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+'''
+Per frame change metrics from a sparse grid of pixels, compared with the previous frame:
+    delta     mean absolute difference of the B, G, R samples (0-255)
+    changed   fraction of blocks whose mean difference exceeds threshold
+    tear      difference between the changed fractions of the top and bottom halves; near 1 means
+              one half changed and the other did not, the signature of a torn or partial frame
+A frame with changed == 0 is a duplicate or differs only by noise. Uses NumPy when available.
+'''
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+NONE = (-1.0, -1.0, -1.0)  # metrics for a frame with nothing to compare
+
+
+class FrameDelta(object):
+    def __init__(self, gridw=32, gridh=18, blocksx=8, blocksy=6, threshold=6.0, bpp=4):
+        self.gridw = gridw
+        self.gridh = gridh
+        self.blocksx = blocksx
+        self.blocksy = blocksy
+        self.threshold = threshold
+        self.bpp = bpp
+        self.size = None
+        self.prev = None
+        self.offsets = None
+        self.blockindex = None
+
+    def reset(self):
+        self.prev = None
+
+    def update(self, image, width, height):
+        '''
+        Returns (delta, changed, tear) against the previous frame and keeps this frame's samples
+        '''
+        if len(image) < width * height * self.bpp or width < self.gridw or height < self.gridh:
+            return NONE
+        if self.size != (width, height):
+            self.size = (width, height)
+            self.prev = None
+            self.offsets = None
+        if numpy is not None:
+            samples = self.samples_numpy(image, width, height)
+            metrics = self.compare_numpy(samples) if self.prev is not None else NONE
+        else:
+            samples = self.samples_python(image, width, height)
+            metrics = self.compare_python(samples) if self.prev is not None else NONE
+        self.prev = samples
+        return metrics
+
+    def steps(self, width, height):
+        sx = width // self.gridw
+        sy = height // self.gridh
+        return sx, sy, sx // 2, sy // 2
+
+    def samples_numpy(self, image, width, height):
+        sx, sy, ox, oy = self.steps(width, height)
+        frame = numpy.frombuffer(image, dtype=numpy.uint8, count=width * height * self.bpp).reshape(
+            height, width, self.bpp)
+        return frame[oy::sy, ox::sx, :3][:self.gridh, :self.gridw].astype(numpy.int16)
+
+    def compare_numpy(self, samples):
+        diff = numpy.abs(samples - self.prev).mean(axis=2)
+        bh = self.gridh // self.blocksy
+        bw = self.gridw // self.blocksx
+        blocks = diff[:bh * self.blocksy, :bw * self.blocksx].reshape(self.blocksy, bh, self.blocksx, bw).mean(
+            axis=(1, 3)) > self.threshold
+        half = self.blocksy // 2
+        tear = abs(blocks[:half].mean() - blocks[half:].mean())
+        return float(diff.mean()), float(blocks.mean()), float(tear)
+
+    def samples_python(self, image, width, height):
+        if self.offsets is None:
+            sx, sy, ox, oy = self.steps(width, height)
+            bh = self.gridh // self.blocksy
+            bw = self.gridw // self.blocksx
+            self.offsets = []
+            self.blockindex = []
+            for r in xrange(self.gridh):
+                for c in xrange(self.gridw):
+                    for ch in xrange(3):
+                        self.offsets.append(((oy + r * sy) * width + ox + c * sx) * self.bpp + ch)
+                        if r < bh * self.blocksy and c < bw * self.blocksx:
+                            self.blockindex.append((r // bh) * self.blocksx + c // bw)
+                        else:
+                            self.blockindex.append(-1)
+        if isinstance(image, bytearray):
+            return [image[o] for o in self.offsets]
+        return [ord(image[o]) for o in self.offsets]  # str and buffer index as characters
+
+    def compare_python(self, samples):
+        nblocks = self.blocksx * self.blocksy
+        sums = [0] * nblocks
+        counts = [0] * nblocks
+        total = 0
+        for a, b, block in zip(samples, self.prev, self.blockindex):
+            d = abs(a - b)
+            total += d
+            if block >= 0:
+                sums[block] += d
+                counts[block] += 1
+        changed = [counts[i] > 0 and float(sums[i]) / counts[i] > self.threshold for i in xrange(nblocks)]
+        half = (self.blocksy // 2) * self.blocksx
+        top = float(sum(changed[:half])) / half
+        bottom = float(sum(changed[half:])) / (nblocks - half)
+        return float(total) / len(samples), float(sum(changed)) / nblocks, abs(top - bottom)
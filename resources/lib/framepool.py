@@ -0,0 +1,76 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2016 KenV99
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+'''
+Preallocated frame buffers for captured images.
+
+RenderCapture.getImage always returns a newly allocated bytearray, so the pool cannot avoid that
+allocation. What it does is copy each frame into one of a fixed ring of buffers, sized once for the
+largest capture, and drop Kodi's buffer straight away, so the frames kept alive downstream (pipeline
+queue, exact duplicate detector) use a fixed amount of memory however the capture size changes.
+Consumers receive a read-only buffer() view of the slot trimmed to the frame, not a copy; py2 buffers
+can be sliced with a step and wrapped by numpy.frombuffer, as the replay traces are.
+'''
+
+EMPTY = bytearray(b'')  # shared by every empty or failed capture, must not be modified
+
+
+class FramePool(object):
+    '''
+    Ring of slots buffers of framesize bytes. A slot is reused after slots further frames,
+    so slots must exceed the number of frames a consumer may still hold. A frame larger than
+    framesize is passed through uncopied and counted in oversize.
+    '''
+
+    def __init__(self, framesize, slots=4):
+        self.framesize = framesize
+        self.ring = [bytearray(framesize) for _ in xrange(slots)]
+        self.index = 0
+        self.allocatedbytes = framesize * slots
+        self.stores = 0
+        self.empties = 0
+        self.oversize = 0
+        self.copiedbytes = 0
+
+    def store(self, image):
+        '''
+        Returns a view of a pooled buffer holding a copy of image
+        '''
+        length = len(image)
+        if length == 0:
+            self.empties += 1
+            return EMPTY
+        if length > self.framesize:
+            self.oversize += 1
+            return image
+        slot = self.ring[self.index]
+        slot[:length] = image
+        self.index = (self.index + 1) % len(self.ring)
+        self.stores += 1
+        self.copiedbytes += length
+        return buffer(slot, 0, length)
+
+    def get_stats(self):
+        return {u'slots': len(self.ring), u'framesize': self.framesize, u'allocatedbytes': self.allocatedbytes,
+                u'stores': self.stores, u'empties': self.empties, u'oversize': self.oversize,
+                u'copiedbytes': self.copiedbytes}
+
+
+def format_stats(stats):
+    return (u'frame pool: %(slots)i slots of %(framesize)i bytes (%(allocatedbytes)i bytes), '
+            u'%(stores)i frames pooled, %(empties)i empty, %(oversize)i too large' % stats)
@@ -0,0 +1,165 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2016 KenV99
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+'''
+Live capture metrics over HTTP, on a local TCP port or a Unix socket, served from a background thread.
+
+    GET /metrics       Prometheus text format
+    GET /metrics.json  the same snapshot as JSON
+
+The snapshot comes from a source callable, normally Player.snapshot, which reads the counters the capture
+thread already keeps without taking a lock. Values may be a frame apart from each other.
+'''
+import BaseHTTPServer
+import json
+import os
+import SocketServer
+import threading
+
+PREFIX = u'trc_'
+COUNTERS = [(u'frames', u'frames_total', u'Frames captured'),
+            (u'unique', u'unique_frames_total', u'Unique frames captured'),
+            (u'dropped', u'dropped_frames_total', u'Capture requests that returned no frame')]
+GAUGES = [(u'capturing', u'1 while a capture is running'), (u'elapsed', u'Seconds since the capture started'),
+          (u'fps', u'Capture rate in the current sweep cell'),
+          (u'uniquefps', u'Unique frame rate in the current sweep cell'),
+          (u'droprate', u'Fraction of capture requests in the current sweep cell that returned no frame')]
+
+
+def format_prometheus(snapshot):
+    lines = []
+    for key, name, helptext in COUNTERS:
+        if key in snapshot:
+            lines.append(u'# HELP %s%s %s' % (PREFIX, name, helptext))
+            lines.append(u'# TYPE %s%s counter' % (PREFIX, name))
+            lines.append(u'%s%s %s' % (PREFIX, name, _value(snapshot[key])))
+    for name, helptext in GAUGES:
+        if name in snapshot:
+            lines.append(u'# HELP %s%s %s' % (PREFIX, name, helptext))
+            lines.append(u'# TYPE %s%s gauge' % (PREFIX, name))
+            lines.append(u'%s%s %s' % (PREFIX, name, _value(snapshot[name])))
+    if snapshot.get(u'latency'):
+        lines.append(u'# HELP %slatency_ms Capture time quantiles in the current sweep cell' % PREFIX)
+        lines.append(u'# TYPE %slatency_ms summary' % PREFIX)
+        for q, v in sorted(snapshot[u'latency'].iteritems()):
+            lines.append(u'%slatency_ms{quantile="%s"} %s' % (PREFIX, q, _value(v)))
+    if snapshot.get(u'queues'):
+        lines.append(u'# HELP %squeue_depth Items waiting in each queue' % PREFIX)
+        lines.append(u'# TYPE %squeue_depth gauge' % PREFIX)
+        for name, depth in sorted(snapshot[u'queues'].iteritems()):
+            lines.append(u'%squeue_depth{queue="%s"} %s' % (PREFIX, _label(name), _value(depth)))
+    if snapshot.get(u'cell'):
+        labels = u','.join(u'%s="%s"' % (k, _label(v)) for k, v in sorted(snapshot[u'cell'].iteritems()))
+        lines.append(u'# HELP %scell_info The active sweep cell' % PREFIX)
+        lines.append(u'# TYPE %scell_info gauge' % PREFIX)
+        lines.append(u'%scell_info{%s} 1' % (PREFIX, labels))
+    return u'\n'.join(lines) + u'\n'
+
+
+def _value(v):
+    if v is None or v != v:
+        return u'NaN'
+    return u'%r' % float(v) if isinstance(v, float) else unicode(int(v))
+
+
+def _label(v):
+    return unicode(v).replace(u'\\', u'\\\\').replace(u'"', u'\\"').replace(u'\n', u'\\n')
+
+
+class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        if path not in ('/', '/metrics', '/metrics.json'):
+            self.send_error(404)
+            return
+        try:
+            snapshot = self.server.source()
+        except Exception as e:  # a snapshot racing the end of a capture, must not kill the server
+            self.send_error(503, str(e))
+            return
+        if path == '/metrics.json':
+            body = json.dumps(snapshot, sort_keys=True)
+            ctype = 'application/json'
+        else:
+            body = format_prometheus(snapshot).encode('utf-8')
+            ctype = 'text/plain; version=0.0.4; charset=utf-8'
+        self.send_response(200)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass  # no access log, and client_address is empty on a Unix socket
+
+
+class TCPMetricsServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class UnixMetricsServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+class MetricsServer(threading.Thread):
+    '''
+    Serves source() until stop(). address is 'host:port' (port 0 picks a free one) or 'unix:/path'.
+    Binding happens in the constructor so that errors reach the caller.
+    '''
+
+    def __init__(self, address, source):
+        super(MetricsServer, self).__init__(name='MetricsServer')
+        self.daemon = True
+        self.path = None
+        if address.startswith(u'unix:'):
+            self.path = address[len(u'unix:'):]
+            if os.path.exists(self.path):
+                os.remove(self.path)  # left over from a previous run
+            self.server = UnixMetricsServer(self.path, MetricsHandler)
+        else:
+            host, _, port = address.rpartition(u':')
+            self.server = TCPMetricsServer((host or u'127.0.0.1', int(port)), MetricsHandler)
+        self.server.source = source
+
+    @property
+    def address(self):
+        if self.path is not None:
+            return u'unix:' + self.path
+        return u'%s:%i' % self.server.server_address[:2]
+
+    def run(self):
+        self.server.serve_forever(poll_interval=0.5)
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def server_from_settings(getSetting, source):
+    '''
+    A started MetricsServer when the metrics setting is on, else None. Raises socket.error or ValueError
+    when metrics_address cannot be used.
+    '''
+    if getSetting(u'metrics') != u'true':
+        return None
+    server = MetricsServer(getSetting(u'metrics_address') or u'127.0.0.1:9731', source)
+    server.start()
+    return server
@@ -0,0 +1,71 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2016 KenV99
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+'''
+Capture options from the add-on settings, each read and parsed once. A blank or invalid setting gets
+its default from resources/settings.xml, with a warning when it was not blank.
+'''
+from resources.lib.utils.kodilogging import KodiLogger
+
+log = KodiLogger.log
+
+RECORD = (u'off', u'timing', u'frames')
+
+
+def _flag(text):
+    if text not in (u'true', u'false'):
+        raise ValueError(text)
+    return text == u'true'
+
+
+def _percent(text):
+    return float(text) / 100.0
+
+
+def _record(text):
+    if text not in RECORD:
+        raise ValueError(text)
+    return text
+
+
+OPTIONS = {u'recalibrate': (float, 60.0), u'pipelined': (_flag, False), u'workers': (int, 2),
+           u'consumer_process': (_flag, False), u'framepool': (_flag, False), u'adaptive': (_flag, False),
+           u'target_fps': (float, 0.0), u'cpu_budget': (_percent, 0.0), u'analysis': (_flag, False),
+           u'segments': (int, 8), u'framedelta': (_flag, True), u'record': (_record, u'off'),
+           u'trace': (_flag, False), u'trace_events': (int, 65536), u'broker_queue': (int, 4),
+           u'broker_analysis_fps': (int, 5), u'broker_preview_fps': (int, 2), u'broker_preview_scale': (int, 4)}
+
+
+def options_from_settings(getSetting, **overrides):
+    '''
+    getSetting is xbmcaddon.Addon().getSetting. Overrides that are not None take the place of the setting,
+    cpu_budget as a fraction rather than a percentage.
+    '''
+    options = {}
+    for name, (parse, default) in OPTIONS.iteritems():
+        if overrides.get(name) is not None:
+            options[name] = overrides[name]
+            continue
+        text = getSetting(name)
+        try:
+            options[name] = parse(text)
+        except ValueError:
+            if text:
+                log(KodiLogger.LOGWARNING, u'Invalid %s setting "%s", using %s', name, text, default)
+            options[name] = default
+    return options
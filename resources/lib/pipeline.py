@@ -0,0 +1,102 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2016 KenV99
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+import threading
+import Queue
+from timeit import default_timer as timer
+
+QUEUESIZE = 8
+
+
+class FramePipeline(object):
+    '''
+    Hands captured frames to a small pool of worker threads so the capture thread can go straight
+    back to RenderCapture. Workers compute duplicate digests in parallel; frames are then released
+    in capture order, so the duplicate comparison and the result rows stay sequential.
+    release(item, duplicate, dupchecktime) is called for every frame, one frame at a time.
+    '''
+    reset_token = object()
+
+    def __init__(self, detector, release, workers=2, maxsize=QUEUESIZE, tracer=None):
+        self.detector = detector
+        self.tracer = tracer
+        self.release = release
+        self.inQ = Queue.Queue(maxsize)
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.seq = 0
+        self.next = 0
+        self.highwater = 0
+        self.threads = [threading.Thread(target=self.work, name='CaptureConsumer%i' % i) for i in xrange(workers)]
+        for t in self.threads:
+            t.daemon = True
+            t.start()
+
+    def submit(self, item, image):
+        '''
+        Queues a frame, blocking while maxsize frames are already waiting
+        '''
+        self.inQ.put((self.seq, item, image))
+        self.seq += 1
+        qsize = self.inQ.qsize()
+        if qsize > self.highwater:
+            self.highwater = qsize
+
+    def reset(self):
+        '''
+        Forgets the previous digest once all frames submitted so far are released
+        '''
+        self.submit(self.reset_token, None)
+
+    def work(self):
+        while True:
+            task = self.inQ.get()
+            if task is None:
+                self.inQ.task_done()
+                return
+            seq, item, image = task
+            digest = None
+            t0 = timer()
+            if item is not self.reset_token:
+                digest = self.detector.digest(image)
+            td = timer() - t0
+            if self.tracer is not None:
+                self.tracer.add(u'digest', t0, t0 + td)
+            with self.lock:
+                self.pending[seq] = (item, digest, td)
+                while self.next in self.pending:
+                    item, digest, td = self.pending.pop(self.next)
+                    self.next += 1
+                    if item is self.reset_token:
+                        self.detector.reset()
+                    else:
+                        self.release(item, self.detector.check(digest), td)
+            self.inQ.task_done()
+
+    def flush(self):
+        '''
+        Blocks until every submitted frame has been released
+        '''
+        self.inQ.join()
+
+    def close(self):
+        self.flush()
+        for _ in self.threads:
+            self.inQ.put(None)
+        for t in self.threads:
+            t.join()
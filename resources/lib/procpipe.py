@@ -0,0 +1,194 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2016 KenV99
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+'''
+Frame consumer in a separate process, so duplicate checks, frame deltas and the colour analysis run
+under their own interpreter lock instead of competing with the capture thread and Kodi's callbacks.
+Frames are copied into slots of an anonymous shared memory map created before the fork; only small
+descriptors (sequence, slot, length, size, times) go through the pipes. The child reads the
+slot through a buffer view, without a copy. POSIX only (needs fork).
+'''
+import mmap
+import multiprocessing
+import os
+import threading
+import Queue
+from timeit import default_timer as timer
+
+from resources.lib.dupdetect import get_detector
+from resources.lib.framedelta import FrameDelta, NONE
+from resources.lib.pipeline import QUEUESIZE
+
+RESET = -1  # slot value of a detector reset
+INLINE = -2  # slot value of a frame too large for a slot, sent through the pipe
+
+
+def available():
+    return hasattr(os, 'fork')
+
+
+class ProcessPipeline(object):
+    '''
+    Same interface as FramePipeline. release(item, duplicate, dupchecktime) is called in capture order
+    from a receiver thread; when the child computes frame deltas they are set in the row (item[0]) first.
+    submit() blocks while all slots are in use. The slot of the last checked frame stays held until the
+    next one is checked, since the child's detector may keep a view of it (exact).
+    '''
+
+    def __init__(self, detector, release, slotsize, slots=QUEUESIZE + 1, framedelta=False, analysis=None):
+        '''
+        analysis is None or (segments, filename) to run the colour analysis in the child
+        '''
+        self.release = release
+        self.slotsize = slotsize
+        self.shm = mmap.mmap(-1, slotsize * slots)
+        self.free = Queue.Queue()
+        for slot in xrange(slots):
+            self.free.put(slot)
+        self.pending = {}
+        self.held = None  # slot of the frame the child's detector compares against next
+        self.seq = 0
+        self.done = 0
+        self.highwater = 0
+        self.inline = 0
+        self.origin = 0.0  # timer() value the row playtimes are relative to
+        self.analysis = None  # analysis summary from the child, once closed
+        self.cond = threading.Condition()
+        childtasks, self.tasks = multiprocessing.Pipe(duplex=False)
+        self.results, childresults = multiprocessing.Pipe(duplex=False)
+        self.process = multiprocessing.Process(target=consume, name='CaptureConsumerProcess',
+                                               args=(childtasks, childresults, self.shm, slotsize, detector.name,
+                                                     framedelta, analysis))
+        self.process.daemon = True
+        self.process.start()
+        childtasks.close()
+        childresults.close()
+        self.receiver = threading.Thread(target=self.receive, name='CaptureConsumerResults')
+        self.receiver.daemon = True
+        self.receiver.start()
+
+    def submit(self, item, image):
+        length = len(image)
+        if length > self.slotsize:
+            slot = INLINE
+            self.inline += 1
+        else:
+            slot = self.free.get()
+            self.shm.seek(slot * self.slotsize)
+            self.shm.write(buffer(image))  # py2 mmap.write takes a read-only buffer, not a bytearray
+        row = item[0]
+        with self.cond:
+            self.pending[self.seq] = (item, slot)
+            inflight = self.seq - self.done + 1
+        if inflight > self.highwater:
+            self.highwater = inflight
+        task = (self.seq, slot, length, row[9], row[10], self.origin + row[0], row[0])
+        self.tasks.send(task + (bytes(image),) if slot == INLINE else task)
+        self.seq += 1
+
+    def reset(self):
+        with self.cond:
+            self.pending[self.seq] = (None, RESET)
+        self.tasks.send((self.seq, RESET, 0, 0, 0, 0.0, 0))
+        self.seq += 1
+
+    def receive(self):
+        while True:
+            try:
+                message = self.results.recv()
+            except EOFError:
+                return
+            seq = message[0]
+            if seq is None:
+                self.analysis = message[1]
+                return
+            with self.cond:
+                item, slot = self.pending.pop(seq)
+            if self.held is not None:
+                self.free.put(self.held)  # the child has moved on to this frame, or was reset
+            self.held = slot if slot >= 0 else None
+            if item is not None:
+                duplicate, td, delta = message[1:]
+                if delta is not None:
+                    item[0][11:14] = delta
+                self.release(item, duplicate, td)
+            with self.cond:
+                self.done = seq + 1
+                self.cond.notify_all()
+
+    def flush(self):
+        '''
+        Blocks until every submitted frame has been released
+        '''
+        with self.cond:
+            while self.done < self.seq and self.process.is_alive():
+                self.cond.wait(1.0)
+
+    def close(self):
+        self.flush()
+        self.held = None
+        self.tasks.send(None)
+        self.receiver.join(10)
+        self.process.join(10)
+        self.tasks.close()
+        self.shm.close()
+
+
+def consume(tasks, results, shm, slotsize, detectorname, framedelta, analysis):
+    '''
+    Child process loop: frames are read in place from their slot, which the parent does not reuse until
+    the next frame is checked. Only the colour analysis, which runs later, gets its own copy.
+    '''
+    detector = get_detector(detectorname)
+    delta = FrameDelta() if framedelta else None
+    stage = None
+    if analysis is not None:
+        from resources.lib.analysis import AnalysisStage, FrameAnalyzer
+        try:
+            stage = AnalysisStage(FrameAnalyzer(segments=analysis[0]), workers=1, maxsize=QUEUESIZE,
+                                  output=open(analysis[1], 'w'))
+        except ImportError:
+            pass
+    while True:
+        task = tasks.recv()
+        if task is None:
+            break
+        seq, slot, length, width, height, capturestart, playtime = task[:7]
+        if slot == RESET:
+            detector.reset()
+            results.send((seq, None, 0.0, None))
+            continue
+        if slot == INLINE:
+            image = buffer(task[7])  # compares equal to the slot views, unlike a str
+        else:
+            image = buffer(shm, slot * slotsize, length)
+        t0 = timer()
+        duplicate = detector.is_duplicate(image)
+        td = timer() - t0
+        metrics = None
+        if delta is not None:
+            metrics = delta.update(image, width, height) if length > 1 else NONE
+        if stage is not None and not duplicate and length > 1:
+            stage.submit(playtime, capturestart, bytearray(image), width, height)
+        results.send((seq, duplicate, td, metrics))
+    summary = None
+    if stage is not None:
+        stage.close()
+        summary = stage.summary()
+    results.send((None, summary))
+    results.close()
@@ -0,0 +1,215 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2016 KenV99
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+'''
+Record and replay of capture runs, so that duplicate detectors, analysis stages and writers can be compared
+on identical input without Kodi.
+
+The record setting makes CaptureThread write <basename>_capture.trace: a JSON header with the video and
+sweep plan, then one fixed size record per frame with its timing, capture parameters, duplicate verdict and
+a sampled digest of the frame (timing mode), followed by the raw BGRA frame in frames mode. Frames recorded
+as duplicates are not written again, the record refers to the last frame written. A timing trace replays
+duplicates by comparing the digests. Traces are written on a thread of their own, and read through mmap
+with frames handed on as buffers into the map, not copied.
+
+From the add-on root:
+    python -m resources.lib.replay ~/.kodi/output_capture.trace --speed 0 --detector exact
+'''
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import Queue
+
+from resources.lib.dupdetect import SampledDetector
+
+MAGIC = b'TRCREC2\n'
+HEADER = struct.Struct('<I')
+# playtime, capture time, frame, cell index, loopsleep, timeout, capturesleep, width, height, length,
+# duplicate, image (NOIMAGE, FRAME or SAME), digest
+RECORD = struct.Struct('<dd8iBBI')
+NOIMAGE = 0
+FRAME = 1  # the frame follows the record
+SAME = 2  # a duplicate, the frame is the last one written
+
+
+class TraceWriter(object):
+    '''
+    Appends frames to a trace from a writer thread, so the file writes stay off the capture and consumer
+    threads; add() blocks while maxsize records are waiting. cells are the sweep cells the frames refer to,
+    recorded by index. With copy set in add() the frame is copied first, for callers that reuse its buffer.
+    '''
+
+    def __init__(self, fn, meta, frames=False, cells=(), maxsize=32):
+        self.fn = fn
+        self.frames = frames
+        self.cells = dict((id(cell), i) for i, cell in enumerate(cells))
+        self.digest = SampledDetector().digest
+        self.count = 0
+        self.written = 0  # frames written, the others are digests or references
+        self.highwater = 0
+        self.f = open(fn, 'wb', 1 << 20)
+        meta = dict(meta, mode=u'frames' if frames else u'timing', digest=SampledDetector.name)
+        header = json.dumps(meta).encode('utf-8')
+        self.f.write(MAGIC + HEADER.pack(len(header)) + header)
+        self.queue = Queue.Queue(maxsize)
+        self.thread = threading.Thread(target=self.write, name='CaptureRecorder')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def add(self, row, cell, duplicate, image, copy=False):
+        kind = NOIMAGE
+        digest = 0
+        if row[6] > 1:
+            if not self.frames:
+                digest = self.digest(image)[1]
+            elif duplicate and self.written:
+                kind = SAME
+            else:
+                kind = FRAME
+                self.written += 1
+                if copy:
+                    image = bytes(image)
+        record = RECORD.pack(row[0], row[5], row[4], self.cells.get(id(cell), -1), row[1], row[2], row[3],
+                             row[9], row[10], row[6], duplicate, kind, digest)
+        self.queue.put((record, image if kind == FRAME else None))
+        self.highwater = max(self.highwater, self.queue.qsize())
+        self.count += 1
+
+    def write(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            record, image = item
+            self.f.write(record)
+            if image is not None:
+                self.f.write(image)
+        self.f.close()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+class TraceReader(object):
+    '''
+    Maps a trace and indexes its records. A record cut short at the end (a run that did not finish) is ignored.
+    '''
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.f = open(fn, 'rb')
+        try:
+            self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            self.f.close()
+            raise ValueError(u'Not a capture trace: %s' % fn)
+        if self.mm[:len(MAGIC)] != MAGIC:
+            old = self.mm[:len(MAGIC) - 2] == MAGIC[:-2]
+            self.close()
+            if old:
+                raise ValueError(u'Capture trace from an older version, record it again: %s' % fn)
+            raise ValueError(u'Not a capture trace: %s' % fn)
+        start = len(MAGIC) + HEADER.size
+        length = HEADER.unpack_from(self.mm, len(MAGIC))[0]
+        self.meta = json.loads(self.mm[start:start + length].decode('utf-8'))
+        self.offsets = []
+        self.maxlength = 0
+        pos = start + length
+        size = len(self.mm)
+        while pos + RECORD.size <= size:
+            record = RECORD.unpack_from(self.mm, pos)
+            end = pos + RECORD.size + (record[9] if record[11] == FRAME else 0)
+            if end > size:
+                break
+            self.offsets.append(pos)
+            self.maxlength = max(self.maxlength, record[9])
+            pos = end
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @property
+    def frames(self):
+        return self.meta.get(u'mode') == u'frames'
+
+    def records(self, copy=False):
+        '''
+        Yields (record, image). image is a read-only buffer into the map (a bytearray with copy set), valid
+        until close(), the last frame written for a recorded duplicate, or None when no frame was recorded.
+        '''
+        mm = self.mm
+        last = None
+        for pos in self.offsets:
+            record = RECORD.unpack_from(mm, pos)
+            image = None
+            if record[11] == FRAME:
+                image = last = buffer(mm, pos + RECORD.size, record[9])
+                if copy:
+                    image = last = bytearray(image)
+            elif record[11] == SAME:
+                image = last
+            yield record, image
+
+    def close(self):
+        self.mm.close()
+        self.f.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=u'Replay a recorded capture trace through the frame pipeline')
+    parser.add_argument('trace')
+    parser.add_argument('--detector', default=u'sampled')
+    parser.add_argument('--speed', type=float, default=1.0, help=u'1 keeps the recorded timing, 0 runs flat out')
+    parser.add_argument('--pipelined', action='store_true', help=u'check frames on consumer threads')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--process', action='store_true', help=u'check frames in a consumer process')
+    parser.add_argument('--analysis', action='store_true')
+    parser.add_argument('--no-framedelta', dest='framedelta', action='store_false')
+    parser.add_argument('--output', help=u'basename of the result files, default next to the trace')
+    parser.add_argument('--loglevel', type=int, default=2)
+    args = parser.parse_args(argv)
+    from resources.lib.sim import SimConfig, install
+    install(SimConfig(loglevel=args.loglevel))
+    import default
+    default.KodiLogger.setLogLevel(default.KodiLogger.LOGNOTICE)
+    try:
+        reader = TraceReader(args.trace)
+    except (IOError, ValueError) as e:
+        sys.stderr.write(u'%s\n' % e)
+        return 1
+    basename = args.output or os.path.splitext(args.trace)[0] + u'_replay'
+    thread = default.ReplayThread(reader, detector=args.detector, basename=basename, speed=args.speed,
+                                  pipelined=args.pipelined, workers=args.workers, consumer_process=args.process,
+                                  analyze=args.analysis, framedelta=args.framedelta)
+    thread.start()
+    while thread.is_alive():
+        thread.join(0.5)
+    reader.close()
+    print json.dumps({u'frames': thread.counter, u'unique': thread.uniqueframes, u'elapsed': thread.elapsed,
+                      u'fps': thread.counter / thread.elapsed if thread.elapsed > 0 else 0.0,
+                      u'results': thread.capture_monitor_thread.files}, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
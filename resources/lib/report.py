@@ -0,0 +1,307 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2016 KenV99
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+'''
+Offline analysis of result files, runs without Kodi but needs NumPy.
+Reads output.csv/.bin files, rotated parts (also gzipped) and session directories in chunks, so memory
+use does not depend on the size of the logs, and reports capture time percentiles, drop rate and unique
+frame rate for every (timeout, loopsleep, capturesleep) combination at each capture size.
+
+Usage:  python -m resources.lib.report [--json report.json] [--markdown report.md] FILE|DIR [...]
+'''
+import argparse
+import gzip
+import json
+import os
+import re
+import sys
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from resources.lib import resultlog
+
+KEYS = (u'timeout', u'loopsleep', u'capturesleep', u'width', u'height')
+PART = re.compile(r'^(.*)\.(\d+)$')  # rotated part, see Session.rotate
+CHUNKSIZE = 65536  # rows per chunk
+BINWIDTH = 0.05  # ms, resolution of the capture time percentiles
+MAXLATENCY = 1000.0  # ms, longer capture times are counted in the last bin
+MAXGAP = 1.0  # s, longer gaps between rows (cell changes, calibration) are not counted as capture time
+
+
+def open_file(fn):
+    if fn.endswith('.gz'):
+        return gzip.open(fn, 'rb')
+    return open(fn, 'rb')
+
+
+def iter_bin(fn, chunksize=CHUNKSIZE):
+    with open_file(fn) as f:
+        header = resultlog.read_header(f)[0]
+        dtype = resultlog.numpy_dtype(resultlog.header_columns(header))
+        while True:
+            data = f.read(dtype.itemsize * chunksize)
+            count = len(data) // dtype.itemsize
+            if count == 0:
+                break
+            records = numpy.frombuffer(data, dtype=dtype, count=count)
+            chunk = dict((k, records[str(k)] if str(k) in dtype.names else numpy.zeros(count)) for k in KEYS)
+            chunk.update({u'playtime': records['playtime'], u'latency': records['timeelapsed'] * 1000.0,
+                          u'imagelength': records['imagelength'], u'dup': records['dup'].astype(bool)})
+            yield chunk
+
+
+def iter_csv(fn, chunksize=CHUNKSIZE):
+    '''
+    Older result files with fewer columns are read by their header names, a missing size as 0x0
+    '''
+    with open_file(fn) as f:
+        names = [name.strip().strip('"') for name in f.readline().split(',')]
+        try:
+            index = [names.index(name) for name in (u'playtime', u'timeout', u'loopsleep', u'capturesleep',
+                                                    u'timeelapsed', u'imagelength', u'dup')]
+        except ValueError:
+            raise ValueError(u'Not a result file: %s' % fn)
+        size = [names.index(name) if name in names else None for name in (u'width', u'height')]
+        while True:
+            rows = [line.split(',') for _, line in zip(xrange(chunksize), f)]
+            rows = [row for row in rows if len(row) == len(names)]
+            if not rows:
+                break
+            columns = zip(*rows)
+            number = [numpy.array(columns[i], dtype=numpy.float64) for i in index[:6]]
+            width, height = [numpy.array(columns[i], dtype=numpy.float64) if i is not None else
+                             numpy.zeros(len(rows)) for i in size]
+            yield {u'playtime': number[0], u'timeout': number[1], u'loopsleep': number[2],
+                   u'capturesleep': number[3], u'width': width, u'height': height, u'latency': number[4],
+                   u'imagelength': number[5], u'dup': numpy.array(columns[index[6]]) == 'True'}
+
+
+def iter_chunks(fn, chunksize=CHUNKSIZE):
+    if fn.endswith('.bin') or fn.endswith('.bin.gz'):
+        return iter_bin(fn, chunksize)
+    return iter_csv(fn, chunksize)
+
+
+def expand(paths):
+    '''
+    Result files for the given files and directories. Where a run has both a .bin and a .csv only
+    the .bin is read, and parts of a run are kept in the order they were written: the numbered parts,
+    then the unnumbered last one. Replay results (*_replay) are skipped in directories, their frames
+    are already counted in the recorded run.
+    '''
+    files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append(path)
+            continue
+        found = {}
+        for name in sorted(os.listdir(path)):
+            stem = name[:-3] if name.endswith('.gz') else name
+            stem, ext = os.path.splitext(stem)
+            if stem.endswith('_replay') or (ext == '.csv' and stem.endswith('_analysis')):
+                continue
+            if ext == '.bin' or (ext == '.csv' and stem not in found):
+                found[stem] = os.path.join(path, name)
+        files.extend(found[stem] for stem in sorted(found, key=part_order))
+    return files
+
+
+def part_order(stem):
+    match = PART.match(stem)
+    if match is None:
+        return stem, float('inf')
+    return match.group(1), int(match.group(2))
+
+
+class Aggregator(object):
+    '''
+    Per group frame counts, time sums and a latency histogram, updated with bincount on every chunk
+    '''
+
+    def __init__(self, binwidth=BINWIDTH, maxlatency=MAXLATENCY, maxgap=MAXGAP):
+        if numpy is None:
+            raise ImportError(u'The report needs NumPy')
+        self.binwidth = binwidth
+        self.nbins = int(maxlatency / binwidth) + 1
+        self.maxgap = maxgap
+        self.index = {}
+        self.keys = []
+        self.frames = numpy.zeros(0, dtype=numpy.int64)
+        self.dropped = numpy.zeros(0, dtype=numpy.int64)
+        self.unique = numpy.zeros(0, dtype=numpy.int64)
+        self.latency = numpy.zeros(0)
+        self.duration = numpy.zeros(0)
+        self.hist = numpy.zeros((0, self.nbins), dtype=numpy.int64)
+        self.rows = 0
+        self.files = []
+        self.prev = None
+
+    def add_file(self, fn, chunksize=CHUNKSIZE):
+        self.prev = None  # no gap across files
+        for chunk in iter_chunks(fn, chunksize):
+            self.add_chunk(chunk)
+        self.files.append(fn)
+
+    def group_indices(self, chunk):
+        keys = numpy.column_stack([chunk[k] for k in KEYS]).astype(numpy.int64)
+        groups, inverse = numpy.unique(keys, axis=0, return_inverse=True)
+        mapping = numpy.array([self.group(tuple(int(v) for v in key)) for key in groups], dtype=numpy.int64)
+        return mapping[inverse]
+
+    def group(self, key):
+        try:
+            return self.index[key]
+        except KeyError:
+            self.index[key] = len(self.keys)
+            self.keys.append(key)
+            return self.index[key]
+
+    def grow(self):
+        n = len(self.keys)
+        extra = n - len(self.frames)
+        if extra > 0:
+            self.frames, self.dropped, self.unique = [numpy.concatenate((a, numpy.zeros(extra, dtype=numpy.int64)))
+                                                      for a in (self.frames, self.dropped, self.unique)]
+            self.latency, self.duration = [numpy.concatenate((a, numpy.zeros(extra)))
+                                           for a in (self.latency, self.duration)]
+            self.hist = numpy.vstack((self.hist, numpy.zeros((extra, self.nbins), dtype=numpy.int64)))
+        return n
+
+    def add_chunk(self, chunk):
+        gidx = self.group_indices(chunk)
+        n = self.grow()
+        imagelength = chunk[u'imagelength']
+        dropped = imagelength == 0
+        unique = ~chunk[u'dup'] & (imagelength > 1)
+        latency = chunk[u'latency']
+        self.frames += numpy.bincount(gidx, minlength=n)
+        self.dropped += numpy.bincount(gidx[dropped], minlength=n)
+        self.unique += numpy.bincount(gidx[unique], minlength=n)
+        self.latency += numpy.bincount(gidx, weights=latency, minlength=n)
+        bins = numpy.clip((latency / self.binwidth).astype(numpy.int64), 0, self.nbins - 1)
+        self.hist += numpy.bincount(gidx * self.nbins + bins, minlength=n * self.nbins).reshape(n, self.nbins)
+        # time from each row to the next belongs to the row's group while both are in the same cell
+        playtime = chunk[u'playtime']
+        if self.prev is not None:
+            playtime = numpy.concatenate(([self.prev[0]], playtime))
+            gidx = numpy.concatenate(([self.prev[1]], gidx))
+        gaps = numpy.diff(playtime)
+        current = gidx[:-1]
+        counted = (gidx[1:] == current) & (gaps > 0) & (gaps < self.maxgap)
+        self.duration += numpy.bincount(current[counted], weights=gaps[counted], minlength=n)
+        self.prev = playtime[-1], gidx[-1]
+        self.rows += len(imagelength)
+
+    def percentile(self, cumulative, total, q):
+        return (numpy.searchsorted(cumulative, q * total) + 0.5) * self.binwidth
+
+    def summary(self):
+        groups = []
+        cumulative = self.hist.cumsum(axis=1)
+        for i, key in enumerate(self.keys):
+            frames = int(self.frames[i])
+            duration = float(self.duration[i])
+            group = dict(zip(KEYS, key))
+            group.update({u'frames': frames, u'dropped': int(self.dropped[i]), u'unique': int(self.unique[i]),
+                          u'mean': float(self.latency[i]) / frames if frames else 0.0,
+                          u'droprate': float(self.dropped[i]) / frames if frames else 0.0,
+                          u'duration': duration,
+                          u'framerate': frames / duration if duration > 0 else 0.0,
+                          u'uniqueframerate': self.unique[i] / duration if duration > 0 else 0.0})
+            for q in (0.5, 0.95, 0.99):
+                group[u'p%i' % int(q * 100)] = float(self.percentile(cumulative[i], frames, q))
+            groups.append(group)
+        groups.sort(key=lambda g: tuple(g[k] for k in KEYS))
+        return groups
+
+
+def recommend(groups, max_droprate=0.05, min_frames=100):
+    '''
+    The combination with the highest unique frame rate among those that drop few enough frames,
+    the lower p95 capture time breaking near ties (within 1%)
+    '''
+    candidates = [g for g in groups if g[u'frames'] >= min_frames and g[u'droprate'] <= max_droprate]
+    if not candidates:
+        return None
+    best = max(g[u'uniqueframerate'] for g in candidates)
+    near = [g for g in candidates if g[u'uniqueframerate'] >= 0.99 * best]
+    choice = min(near, key=lambda g: g[u'p95'])
+    return dict((k, choice[k]) for k in KEYS + (u'uniqueframerate', u'p95', u'droprate'))
+
+
+def build_report(paths, max_droprate=0.05, min_frames=100, chunksize=CHUNKSIZE):
+    aggregator = Aggregator()
+    for fn in expand(paths):
+        try:
+            aggregator.add_file(fn, chunksize)
+        except (IOError, ValueError) as e:
+            print >> sys.stderr, u'skipped %s: %s' % (fn, e)
+    groups = aggregator.summary()
+    return {u'files': aggregator.files, u'rows': aggregator.rows, u'groups': groups,
+            u'criteria': {u'max_droprate': max_droprate, u'min_frames': min_frames},
+            u'recommendation': recommend(groups, max_droprate, min_frames)}
+
+
+def format_markdown(report):
+    lines = [u'# Capture report', u'',
+             u'%i rows from %i files' % (report[u'rows'], len(report[u'files'])), u'',
+             u'| timeout | loopsleep | capturesleep | size | frames | mean ms | p50 | p95 | p99 | droprate | fps '
+             u'| unique fps |',
+             u'|---:|---:|---:|---:|---:|---:|---:|---:|---:|---:|---:|---:|']
+    for g in report[u'groups']:
+        lines.append(u'| %(timeout)i | %(loopsleep)i | %(capturesleep)i | %(width)ix%(height)i | %(frames)i | %(mean).3f | %(p50).2f '
+                     u'| %(p95).2f | %(p99).2f | %(droprate).3f | %(framerate).2f | %(uniqueframerate).2f |' % g)
+    lines.append(u'')
+    rec = report[u'recommendation']
+    if rec is None:
+        lines.append(u'No combination has at least %(min_frames)i frames with a drop rate of at most '
+                     u'%(max_droprate).3f.' % report[u'criteria'])
+    else:
+        lines.append(u'Recommended: timeout=%(timeout)i loopsleep=%(loopsleep)i capturesleep=%(capturesleep)i '
+                     u'at %(width)ix%(height)i '
+                     u'(unique fps %(uniqueframerate).2f, p95 %(p95).2f ms, droprate %(droprate).3f)' % rec)
+    return u'\n'.join(lines) + u'\n'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=u'Summarise testRenderCapture result files')
+    parser.add_argument('paths', nargs='+', metavar=u'FILE|DIR')
+    parser.add_argument('--json', help=u'write the report as JSON')
+    parser.add_argument('--markdown', help=u'write the report as Markdown (default: print it)')
+    parser.add_argument('--max-droprate', type=float, default=0.05)
+    parser.add_argument('--min-frames', type=int, default=100)
+    parser.add_argument('--chunksize', type=int, default=CHUNKSIZE)
+    args = parser.parse_args(argv)
+    report = build_report(args.paths, args.max_droprate, args.min_frames, args.chunksize)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    markdown = format_markdown(report)
+    if args.markdown:
+        with open(args.markdown, 'w') as f:
+            f.write(markdown.encode('utf-8'))
+    elif not args.json:
+        print markdown.encode('utf-8')
+    return 0 if report[u'rows'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,199 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2016 KenV99
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+'''
+Compact binary result log.
+
+Layout: a 16 byte preamble (magic, version, header length), a JSON header describing the run,
+padding to an 8 byte boundary, then fixed width little-endian records with the same columns as
+output.csv. Times are stored in seconds (the csv uses ms for elapsed and dupcheck).
+
+Usage:  python -m resources.lib.resultlog tocsv output.bin output.csv
+'''
+import json
+import os
+import struct
+import sys
+
+MAGIC = b'TRCRES\x00\x00'
+VERSION = 2  # 2 added width, height, delta, changed and tear; the header names the columns of either
+VERSIONS = (1, 2)
+PREAMBLE = struct.Struct('<8sII')
+COLUMNS = [(u'playtime', u'd'), (u'loopsleep', u'i'), (u'timeout', u'i'), (u'capturesleep', u'i'),
+           (u'frame', u'i'), (u'timeelapsed', u'd'), (u'imagelength', u'I'), (u'dup', u'B'),
+           (u'dupcheck', u'd'), (u'width', u'H'), (u'height', u'H'), (u'delta', u'f'), (u'changed', u'f'),
+           (u'tear', u'f')]
+RECORD = struct.Struct('<' + ''.join(c[1] for c in COLUMNS))
+CSVHEADER = ('"playtime","loopsleep","timeout","capturesleep","frame","timeelapsed","imagelength","dup","detector",'
+             '"dupcheck","width","height","delta","changed","tear"\n')  # header for import
+MISSING = {u'width': 0, u'height': 0, u'delta': -1.0, u'changed': -1.0, u'tear': -1.0}  # of older logs
+
+
+def format_csv_row(r, detector):
+    '''
+    One output.csv line from a result row (or binary record). elapsed and dupcheck are written in ms.
+    '''
+    return '%s,%i,%i,%i,%i,%s,%i,%s,%s,%s,%i,%i,%s,%s,%s\n' % (
+        "{0:.4f}".format(r[0]), r[1], r[2], r[3], r[4], "{0:.4f}".format(r[5] * 1000.0), r[6], bool(r[7]),
+        detector, "{0:.4f}".format(r[8] * 1000.0), r[9], r[10], "{0:.3f}".format(r[11]), "{0:.3f}".format(r[12]),
+        "{0:.3f}".format(r[13]))
+
+
+def numpy_dtype(columns=None):
+    import numpy
+    kinds = {u'd': '<f8', u'f': '<f4', u'i': '<i4', u'I': '<u4', u'B': 'u1', u'H': '<u2'}
+    return numpy.dtype([(str(name), kinds[code]) for name, code in (columns or COLUMNS)])
+
+
+def header_columns(header):
+    '''
+    The (name, code) columns a log was written with, from its header. Logs written before a column
+    was added stay readable.
+    '''
+    try:
+        return zip(header[u'columns'], header[u'record'].lstrip(u'<'))
+    except (KeyError, AttributeError):
+        return COLUMNS
+
+
+class BinaryResultWriter(object):
+    '''
+    Appends result rows (the lists put on resultQ) as packed records.
+    The header is written with the first rows, so meta may be filled in until then.
+    '''
+
+    def __init__(self, fn, meta=None):
+        self.fn = fn
+        self.meta = meta if meta is not None else {}
+        self.f = open(fn, 'wb')
+        self.headerwritten = False
+        self.records = 0
+
+    def write_header(self):
+        meta = dict(self.meta)
+        meta[u'columns'] = [name for name, _ in COLUMNS]
+        meta[u'record'] = RECORD.format
+        header = json.dumps(meta, sort_keys=True).encode('utf-8')
+        header += b' ' * (-(PREAMBLE.size + len(header)) % 8)
+        self.f.write(PREAMBLE.pack(MAGIC, VERSION, len(header)))
+        self.f.write(header)
+        self.headerwritten = True
+
+    def write_rows(self, rows):
+        if not self.headerwritten:
+            self.write_header()
+        pack = RECORD.pack
+        self.f.write(b''.join([pack(*row[:len(COLUMNS)]) for row in rows]))
+        self.records += len(rows)
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        if not self.headerwritten:
+            self.write_header()
+        self.f.close()
+
+
+def read_header(f):
+    magic, version, length = PREAMBLE.unpack(f.read(PREAMBLE.size))
+    if magic != MAGIC:
+        raise ValueError(u'Not a binary result log')
+    if version not in VERSIONS:
+        raise ValueError(u'Unsupported result log version: %s' % version)
+    return json.loads(f.read(length).decode('utf-8')), PREAMBLE.size + length
+
+
+def convert_columns(columns):
+    '''
+    For a log written with other columns, a function mapping its records to tuples in COLUMNS order,
+    with the MISSING values for columns it lacks; None when the columns are the current ones.
+    '''
+    if list(columns) == COLUMNS:
+        return None
+    names = [name for name, _ in columns]
+    index = [(names.index(name), None) if name in names else (None, MISSING.get(name, 0)) for name, _ in COLUMNS]
+    return lambda values: tuple(default if i is None else values[i] for i, default in index)
+
+
+def iter_records(fn, chunksize=4096):
+    '''
+    Pure python reader, yields tuples in COLUMNS order whatever columns the log was written with
+    '''
+    with open(fn, 'rb') as f:
+        columns = header_columns(read_header(f)[0])
+        record = struct.Struct('<' + ''.join(code for _, code in columns))
+        convert = convert_columns(columns)
+        while True:
+            data = f.read(record.size * chunksize)
+            if not data:
+                break
+            for offset in xrange(0, len(data) - record.size + 1, record.size):
+                values = record.unpack_from(data, offset)
+                yield values if convert is None else convert(values)
+
+
+def load(fn, mmap=True):
+    '''
+    Returns (header, records) where records is a NumPy structured array with the current columns.
+    With mmap the file is memory mapped and nothing is read until used; a log written with other
+    columns is read and converted, with the MISSING values for columns it lacks.
+    '''
+    import numpy
+    with open(fn, 'rb') as f:
+        header, offset = read_header(f)
+        columns = header_columns(header)
+        dtype = numpy_dtype(columns)
+        current = convert_columns(columns) is None
+        if not mmap or not current:
+            records = numpy.fromfile(f, dtype=dtype)
+        else:
+            count = (os.path.getsize(fn) - offset) // dtype.itemsize
+            if count == 0:
+                return header, numpy.zeros(0, dtype=dtype)
+            return header, numpy.memmap(fn, dtype=dtype, mode='r', offset=offset, shape=(count,))
+    if current:
+        return header, records
+    converted = numpy.zeros(len(records), dtype=numpy_dtype())
+    for name, _ in COLUMNS:
+        converted[name] = records[name] if name in records.dtype.names else MISSING.get(name, 0)
+    return header, converted
+
+
+def to_csv(binfn, csvfn):
+    with open(binfn, 'rb') as f:
+        header = read_header(f)[0]
+    detector = header.get(u'detector', u'unknown')
+    with open(csvfn, 'w') as out:
+        out.write(CSVHEADER)
+        batch = []
+        for r in iter_records(binfn):
+            batch.append(format_csv_row(r, detector))
+            if len(batch) >= 4096:
+                out.write(''.join(batch))
+                batch = []
+        out.write(''.join(batch))
+    return header
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] == 'tocsv':
+        to_csv(sys.argv[2], sys.argv[3])
+    else:
+        print 'usage: python -m resources.lib.resultlog tocsv <input.bin> <output.csv>'
+        sys.exit(1)
@@ -0,0 +1,177 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2016 KenV99
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+'''
+Checks of the statistics and file formats that run without Kodi or NumPy: P-square quantiles, the
+Welford merge, the binary result log round trip and the cadence counts.
+
+Usage:  python -m resources.lib.selfcheck
+'''
+import json
+import os
+import random
+import shutil
+import struct
+import sys
+import tempfile
+
+from resources.lib import cadence, resultlog
+from resources.lib.utils.quantiles import P2Quantile, QuantileSketch
+from resources.lib.utils.rolling_stats import RollingStats
+
+
+def expect(condition, message, *args):
+    if not condition:
+        raise AssertionError(message % args)
+
+
+def close(a, b, tolerance):
+    return abs(a - b) <= tolerance * max(1.0, abs(a), abs(b))
+
+
+def check_quantiles():
+    small = P2Quantile(0.5)
+    for x in (3.0, 1.0, 2.0):
+        small.add_value(x)
+    expect(small.value() == 2.0, u'median of 3 values: %s', small.value())
+    rng = random.Random(1)
+    sketch = QuantileSketch()
+    for _ in xrange(20000):
+        sketch.add_value(rng.random())
+    for p, value in sketch.values().iteritems():
+        expect(abs(value - p) < 0.02, u'p%i of uniform(0, 1): %.4f', p * 100, value)
+
+
+def check_welford():
+    rng = random.Random(2)
+    values = [rng.gauss(1e6, 3.0) for _ in xrange(3000)]  # large offset, small spread
+    mean = sum(values) / len(values)
+    variance = sum([(v - mean) ** 2 for v in values]) / (len(values) - 1)
+    parts = [RollingStats() for _ in xrange(3)]
+    for i, v in enumerate(values):
+        parts[i % 3].add_value(v)
+    merged = parts[0].merge(parts[1]).merge(parts[2])
+    expect(merged.n == len(values), u'merged count: %i', merged.n)
+    expect(close(merged.get_mean(), mean, 1e-12), u'merged mean: %r != %r', merged.get_mean(), mean)
+    expect(close(merged.get_variance(), variance, 1e-6), u'merged variance: %r != %r', merged.get_variance(),
+           variance)
+    batch = RollingStats()
+    batch.add_values(values[:1000])
+    batch.add_values(values[1000:])
+    expect(close(batch.get_variance(), variance, 1e-6), u'batch variance: %r != %r', batch.get_variance(), variance)
+    try:
+        RollingStats(windowsize=10).merge(RollingStats())
+    except ValueError:
+        pass
+    else:
+        raise AssertionError(u'windowed merge did not raise')
+
+
+def check_resultlog():
+    rows = [[0.25 * i, 5, 80, 0, i + 1, 0.01 + i * 1e-4, 2073600, i % 2 == 1, 1.5e-5, 960, 540, 0.5, 0.25, -1.0]
+            for i in xrange(100)]
+    directory = tempfile.mkdtemp()
+    try:
+        fn = os.path.join(directory, u'output.bin')
+        writer = resultlog.BinaryResultWriter(fn, meta={u'detector': u'exact'})
+        writer.write_rows(rows[:60])
+        writer.write_rows(rows[60:])
+        writer.close()
+        with open(fn, 'rb') as f:
+            header, offset = resultlog.read_header(f)
+        expect(offset % 8 == 0, u'records start at %i, not 8 byte aligned', offset)
+        expect(header[u'detector'] == u'exact', u'header: %r', header)
+        expect(header[u'columns'] == [name for name, _ in resultlog.COLUMNS], u'columns: %r', header[u'columns'])
+        records = list(resultlog.iter_records(fn, chunksize=7))
+        expect(len(records) == len(rows), u'%i records read, %i written', len(records), len(rows))
+        for row, record in zip(rows, records):
+            expect(list(record[:7]) == row[:7] and record[7] == int(row[7]) and list(record[8:11]) == row[8:11],
+                   u'record %r != row %r', record, row)
+            expect(all(close(a, b, 1e-6) for a, b in zip(record[11:], row[11:])), u'metrics %r != %r',
+                   record[11:], row[11:])
+        columns = resultlog.COLUMNS[:11]  # a version 1 log, before the frame change metrics
+        record = struct.Struct('<' + ''.join(code for _, code in columns))
+        header = json.dumps({u'columns': [name for name, _ in columns], u'record': record.format})
+        header += ' ' * (-(resultlog.PREAMBLE.size + len(header)) % 8)
+        oldfn = os.path.join(directory, u'old.bin')
+        with open(oldfn, 'wb') as f:
+            f.write(resultlog.PREAMBLE.pack(resultlog.MAGIC, 1, len(header)) + header +
+                    ''.join([record.pack(*row[:11]) for row in rows]))
+        records = list(resultlog.iter_records(oldfn))
+        expect(len(records) == len(rows), u'%i records read from a version 1 log, %i written', len(records),
+               len(rows))
+        expect(all(list(r[:7]) == row[:7] and r[11:] == (-1.0, -1.0, -1.0) for r, row in zip(records, rows)),
+               u'version 1 record %r not converted', records[0])
+        resultlog.to_csv(oldfn, os.path.join(directory, u'old.csv'))
+    finally:
+        shutil.rmtree(directory)
+
+
+def capture(fps, rate, seconds, jitter=0.0, skip=0, seed=3):
+    '''
+    Feeds a CadenceAnalyzer with captures at rate per second of a source at fps, each capture late by up
+    to jitter seconds; with skip every skip-th source frame is never shown
+    '''
+    rng = random.Random(seed)
+    analyzer = cadence.CadenceAnalyzer(fps)
+    last = None
+    for i in xrange(int(seconds * rate)):
+        timestamp = i / float(rate) + rng.random() * jitter
+        frame = int(timestamp * fps)
+        if skip and frame % skip == skip - 1:
+            frame -= 1
+        analyzer.add_capture(timestamp, frame != last)
+        last = frame
+    return analyzer.summary()
+
+
+def check_cadence():
+    summary = capture(23.976, 60, 10)
+    expect(summary[u'efficiency'] == 100.0, u'efficiency of a clean 60 Hz capture: %.1f', summary[u'efficiency'])
+    expect(summary[u'missedframes'] == 0, u'missed frames of a clean capture: %i', summary[u'missedframes'])
+    expect(summary[u'doublecaptures'] > 0, u'no double captures at 60 Hz of a 24 fps source')
+    for seed in xrange(1, 6):
+        summary = capture(23.976, 60, 10, jitter=0.016, seed=seed)  # less than the capture interval
+        expect(summary[u'missedframes'] == 0 and summary[u'efficiency'] == 100.0,
+               u'capture jitter counted as missed frames: %i missed, efficiency %.1f', summary[u'missedframes'],
+               summary[u'efficiency'])
+    summary = capture(25.0, 100, 10, skip=5)
+    expect(summary[u'missedframes'] > 0, u'skipped source frames not counted as missed')
+    expect(close(summary[u'efficiency'], 80.0, 0.02), u'efficiency with every fifth frame skipped: %.1f',
+           summary[u'efficiency'])
+
+
+CHECKS = [(u'quantiles', check_quantiles), (u'welford', check_welford), (u'resultlog', check_resultlog),
+          (u'cadence', check_cadence)]
+
+
+def main(argv=None):
+    failed = 0
+    for name, check in CHECKS:
+        try:
+            check()
+        except AssertionError as e:
+            failed += 1
+            sys.stdout.write(u'FAIL %s: %s\n' % (name, e))
+        else:
+            sys.stdout.write(u'ok   %s\n' % name)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
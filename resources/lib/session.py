@@ -0,0 +1,145 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2016 KenV99
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+'''
+Session mode for soak testing: every playback gets its own timestamped result files in one directory,
+rotated by size, and a line in the session index (session.jsonl) describing the run.
+'''
+import gzip
+import json
+import os
+import re
+import shutil
+import threading
+import time
+
+INDEX = u'session.jsonl'
+
+
+class Session(object):
+    '''
+    Names the result files of each run and keeps the session index.
+    rotatebytes of 0 turns rotation off. Rotated parts are gzipped in the background when compress is set.
+    '''
+
+    def __init__(self, directory, rotatebytes=0, compress=False):
+        self.directory = directory
+        self.rotatebytes = rotatebytes
+        self.compress = compress
+        self.lock = threading.Lock()
+        self.compressors = []
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def new_run(self, label=u''):
+        '''
+        Returns the basename for a new run, e.g. <directory>/20161218-231502-big_buck_bunny
+        '''
+        name = time.strftime('%Y%m%d-%H%M%S')
+        label = re.sub(r'[^\w.-]+', u'_', label, flags=re.UNICODE).strip(u'_')[:40]
+        if label:
+            name += u'-' + label
+        with self.lock:
+            basename = os.path.join(self.directory, name)
+            n = 1
+            while os.path.exists(basename + '.csv') or os.path.exists(basename + '.bin'):
+                n += 1
+                basename = os.path.join(self.directory, u'%s-%i' % (name, n))
+            open(basename + '.csv', 'a').close()  # claim the name
+        return basename
+
+    def release(self, basename):
+        '''
+        Removes the empty placeholder new_run left for a run that wrote no rows
+        '''
+        fn = basename + '.csv'
+        try:
+            if os.path.getsize(fn) == 0:
+                os.remove(fn)
+        except OSError:
+            pass
+
+    def rotate(self, fn, part):
+        '''
+        Moves a full result file aside as <base>.<part><ext>, gzipped if configured.
+        Returns the name the part will finally have.
+        '''
+        base, ext = os.path.splitext(fn)
+        target = u'%s.%03i%s' % (base, part, ext)
+        os.rename(fn, target)
+        if not self.compress:
+            return target
+        thread = threading.Thread(target=compress, args=(target,), name='SessionCompress')
+        thread.start()
+        self.compressors.append(thread)
+        return target + '.gz'
+
+    def add_run(self, record):
+        '''
+        Appends one run to the session index, a JSON object per line
+        '''
+        line = json.dumps(record, sort_keys=True) + '\n'
+        with self.lock:
+            with open(os.path.join(self.directory, INDEX), 'a') as f:
+                f.write(line)
+
+    def wait(self, timeout=None):
+        for thread in self.compressors:
+            thread.join(timeout)
+        self.compressors = [t for t in self.compressors if t.is_alive()]
+
+
+def compress(fn):
+    with open(fn, 'rb') as src:
+        with gzip.open(fn + '.gz', 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+    os.remove(fn)
+
+
+def load_index(directory):
+    '''
+    The runs recorded in a session directory, oldest first
+    '''
+    runs = []
+    try:
+        with open(os.path.join(directory, INDEX)) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    try:
+                        runs.append(json.loads(line))
+                    except ValueError:
+                        pass  # a run that was cut off while writing
+    except IOError:
+        pass
+    return runs
+
+
+def session_from_settings(getSetting, default):
+    '''
+    The Session configured in the add-on settings, or None when session mode is off.
+    default is the directory used when none is set.
+    '''
+    if getSetting(u'session') != u'true':
+        return None
+    directory = getSetting(u'session_dir') or default
+    try:
+        rotatebytes = int(float(getSetting(u'rotate_mb')) * 1024 * 1024)
+    except ValueError:
+        rotatebytes = 0
+    return Session(directory, rotatebytes=max(0, rotatebytes), compress=getSetting(u'compress') == u'true')
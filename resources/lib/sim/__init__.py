@@ -0,0 +1,68 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2016 KenV99
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+'''
+Stand-in for the Kodi python modules (xbmc, xbmcgui, xbmcaddon) so that the capture code can be run
+and benchmarked on a plain machine. Call install() before anything imports xbmc.
+'''
+import sys
+
+
+class SimConfig(object):
+    '''
+    Behaviour of the simulated player and RenderCapture.
+    Times are in milliseconds, rates are probabilities per captured frame.
+    '''
+
+    def __init__(self, **kwargs):
+        self.api = u'krypton'  # 'krypton' (capture/getImage) or 'legacy' (waitForCaptureStateChangeEvent)
+        self.width = 1920
+        self.height = 1080
+        self.aspect = 1.78
+        self.fps = 23.976
+        self.duration = 7200
+        self.file = u'/media/sim/video.mkv'
+        self.title = u'Simulated Video'
+        self.latency = 8.0  # mean time for a requested capture to become available
+        self.jitter = 2.0  # standard deviation of latency
+        self.droprate = 0.0
+        self.duprate = 0.0
+        self.seed = 0
+        self.loglevel = 0
+        self.logfile = None  # file-like object for xbmc.log output, defaults to sys.stderr
+        self.settings = {}  # add-on setting overrides, see resources/settings.xml
+        for key, value in kwargs.iteritems():
+            if not hasattr(self, key):
+                raise AttributeError(u'Unknown simulator option: %s' % key)
+            setattr(self, key, value)
+
+
+def install(config=None, **kwargs):
+    '''
+    Registers the simulated modules as 'xbmc', 'xbmcgui' and 'xbmcaddon' and returns the xbmc module.
+    '''
+    from resources.lib.sim import xbmc as simxbmc
+    from resources.lib.sim import xbmcgui as simxbmcgui
+    from resources.lib.sim import xbmcaddon as simxbmcaddon
+    if config is None:
+        config = SimConfig(**kwargs)
+    simxbmc.configure(config)
+    sys.modules['xbmc'] = simxbmc
+    sys.modules['xbmcgui'] = simxbmcgui
+    sys.modules['xbmcaddon'] = simxbmcaddon
+    return simxbmc
@@ -0,0 +1,80 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2016 KenV99
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+'''
+Runs the add-on headless against the simulated xbmc modules.
+From the add-on root:  python -m resources.lib.sim.harness --seconds 10 --seed 1
+'''
+import argparse
+import os
+import time
+
+from resources.lib.sim import SimConfig, install
+
+
+def parse_args(argv=None):
+    defaults = SimConfig()
+    parser = argparse.ArgumentParser(description=u'Headless testRenderCapture run with a simulated RenderCapture')
+    parser.add_argument('--seconds', type=float, default=10.0, help=u'length of simulated playback')
+    parser.add_argument('--api', choices=[u'krypton', u'legacy'], default=defaults.api)
+    parser.add_argument('--width', type=int, default=defaults.width)
+    parser.add_argument('--height', type=int, default=defaults.height)
+    parser.add_argument('--fps', type=float, default=defaults.fps)
+    parser.add_argument('--latency', type=float, default=defaults.latency, help=u'mean capture latency, ms')
+    parser.add_argument('--jitter', type=float, default=defaults.jitter, help=u'latency standard deviation, ms')
+    parser.add_argument('--droprate', type=float, default=defaults.droprate)
+    parser.add_argument('--duprate', type=float, default=defaults.duprate)
+    parser.add_argument('--seed', type=int, default=defaults.seed)
+    parser.add_argument('--loglevel', type=int, default=2)
+    parser.add_argument('--detector', help=u'default: the detector setting')
+    parser.add_argument('--runs', type=int, default=1, help=u'playbacks in a row, e.g. for session mode')
+    parser.add_argument('--setting', action='append', default=[], metavar=u'ID=VALUE',
+                        help=u'override an add-on setting, may be repeated')
+    return parser.parse_args(argv)
+
+
+def simconfig(args):
+    return SimConfig(api=args.api, width=args.width, height=args.height, fps=args.fps, latency=args.latency,
+                     jitter=args.jitter, droprate=args.droprate, duprate=args.duprate, seed=args.seed,
+                     loglevel=args.loglevel, settings=dict(s.split(u'=', 1) for s in args.setting))
+
+
+def run(args):
+    install(simconfig(args))
+    import default
+    outdir = os.path.expanduser(u'~/.kodi')
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    default.KodiLogger.setLogLevel(default.KodiLogger.LOGNOTICE)
+    import xbmcaddon
+    default.logging_from_settings(xbmcaddon.Addon().getSetting)
+    player = default.Player(detector=args.detector)
+    import xbmc
+    for _ in xrange(max(1, args.runs)):
+        xbmc.play()
+        capture_thread = player.capture_thread
+        time.sleep(args.seconds)
+        xbmc.stop()
+        capture_thread.join(10)
+    player.close()
+    default.KodiLogger.setAsync(False)
+    return capture_thread
+
+
+if __name__ == '__main__':
+    run(parse_args())
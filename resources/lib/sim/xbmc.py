@@ -0,0 +1,295 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2016 KenV99
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+'''
+Simulated xbmc module. See resources.lib.sim.SimConfig for the tunable behaviour.
+'''
+import json
+import random
+import struct
+import sys
+import threading
+import time
+
+LOGDEBUG = 0
+LOGINFO = 1
+LOGNOTICE = 2
+LOGWARNING = 3
+LOGERROR = 4
+LOGSEVERE = 5
+LOGFATAL = 6
+LOGNONE = 7
+
+CAPTURE_STATE_WORKING = 0
+CAPTURE_STATE_DONE = 1
+CAPTURE_STATE_FAILED = 2
+CAPTURE_FLAG_CONTINUOUS = 1
+CAPTURE_FLAG_IMMEDIATELY = 2
+
+_levelnames = ['DEBUG', 'INFO', 'NOTICE', 'WARNING', 'ERROR', 'SEVERE', 'FATAL', 'NONE']
+_config = None
+_rng = random.Random(0)
+_rnglock = threading.Lock()
+_players = []
+_playing = threading.Event()
+_abort_evt = threading.Event()
+_playstart = [0.0]
+_loglock = threading.Lock()
+
+
+def configure(config):
+    global _config, _rng
+    _config = config
+    _rng = random.Random(config.seed)
+    _playing.clear()
+    _abort_evt.clear()
+    del _players[:]
+
+
+def _random():
+    with _rnglock:
+        return _rng.random()
+
+
+def _latency():
+    with _rnglock:
+        return max(0.0, _rng.gauss(_config.latency, _config.jitter)) / 1000.0
+
+
+def log(msg, level=LOGDEBUG):
+    if level < _config.loglevel:
+        return
+    out = _config.logfile or sys.stderr
+    with _loglock:
+        out.write('%.3f %s: %s\n' % (time.time(), _levelnames[level], msg))
+
+
+def sleep(timemillis):
+    time.sleep(timemillis / 1000.0)
+
+
+def getFreeMem():
+    return 1024
+
+
+def executeJSONRPC(jsonrpccommand):
+    request = json.loads(jsonrpccommand)
+    method = request.get('method')
+    if method == 'Player.GetActivePlayers':
+        if _playing.is_set():
+            result = [{'playerid': 1, 'type': 'video'}]
+        else:
+            result = []
+    elif method == 'Player.GetItem':
+        result = {'item': {'id': -1, 'label': _config.title, 'title': _config.title, 'type': 'movie',
+                           'file': _config.file, 'duration': int(_config.duration),
+                           'streamdetails': {'audio': [], 'subtitle': [],
+                                             'video': [{'aspect': _config.aspect, 'codec': 'h264',
+                                                        'duration': int(_config.duration),
+                                                        'height': _config.height, 'stereomode': '',
+                                                        'width': _config.width}]}}}
+    else:
+        return json.dumps({'id': request.get('id'), 'jsonrpc': '2.0',
+                           'error': {'code': -32601, 'message': 'Method not found.'}})
+    return json.dumps({'id': request.get('id'), 'jsonrpc': '2.0', 'result': result})
+
+
+def getInfoLabel(cLine):
+    if _playing.is_set():
+        if cLine == 'Player.Process(VideoWidth)':
+            return '{0:,}'.format(_config.width)
+        if cLine == 'Player.Process(VideoHeight)':
+            return '{0:,}'.format(_config.height)
+        if cLine == 'Player.Process(VideoFPS)':
+            return '{0:.3f}'.format(_config.fps)
+    return ''
+
+
+def play():
+    '''
+    Starts simulated playback and fires onPlayBackStarted on every Player, as Kodi would
+    '''
+    _playstart[0] = time.time()
+    _playing.set()
+    for player in list(_players):
+        player.onPlayBackStarted()
+
+
+def stop():
+    _playing.clear()
+    for player in list(_players):
+        player.onPlayBackStopped()
+
+
+def end():
+    _playing.clear()
+    for player in list(_players):
+        player.onPlayBackEnded()
+
+
+def requestAbort():
+    _abort_evt.set()
+
+
+class Player(object):
+    def __init__(self):
+        _players.append(self)
+
+    def isPlaying(self):
+        return _playing.is_set()
+
+    def isPlayingVideo(self):
+        return _playing.is_set()
+
+    def getPlayingFile(self):
+        if not _playing.is_set():
+            raise RuntimeError('XBMC is not playing any file')
+        return _config.file
+
+    def getTime(self):
+        return time.time() - _playstart[0]
+
+    def getTotalTime(self):
+        return float(_config.duration)
+
+    def stop(self):
+        stop()
+
+    def onPlayBackStarted(self):
+        pass
+
+    def onPlayBackEnded(self):
+        pass
+
+    def onPlayBackStopped(self):
+        pass
+
+
+class Monitor(object):
+    def abortRequested(self):
+        return _abort_evt.is_set()
+
+    def waitForAbort(self, timeout=None):
+        return _abort_evt.wait(timeout)
+
+
+class _RenderCaptureBase(object):
+    '''
+    The source produces a new frame every 1/fps seconds. A captured image is a copy of the
+    frame being shown when the capture completes, so capturing faster than the source rate
+    naturally yields duplicates. droprate and duprate add renderer failures on top of that.
+    '''
+
+    def __init__(self):
+        self.width = 0
+        self.height = 0
+        self.base = bytearray(b'')
+        self.lastframe = -1
+        self.requested = 0.0
+        self.latency = 0.0
+
+    def _request(self, width, height):
+        if width != self.width or height != self.height:
+            self.width = width
+            self.height = height
+            self.base = bytearray(b'\x10\x20\x30\xff') * (width * height)
+        self.requested = time.time()
+        self.latency = _latency()
+
+    def _wait(self, timeout):
+        '''
+        Blocks as the renderer would, returns True if the image became available within timeout ms
+        '''
+        if _random() < _config.droprate:
+            time.sleep(timeout / 1000.0)
+            return False
+        remaining = self.requested + self.latency - time.time()
+        if remaining > timeout / 1000.0:
+            time.sleep(timeout / 1000.0)
+            return False
+        if remaining > 0:
+            time.sleep(remaining)
+        return True
+
+    def _frame(self):
+        if self.lastframe >= 0 and _random() < _config.duprate:
+            frame = self.lastframe
+        else:
+            frame = int((time.time() - _playstart[0]) * _config.fps)
+        self.lastframe = frame
+        image = bytearray(self.base)
+        struct.pack_into('<I', image, 0, frame & 0xffffffff)
+        return image
+
+    def getWidth(self):
+        return self.width
+
+    def getHeight(self):
+        return self.height
+
+    def getAspectRatio(self):
+        return _config.aspect
+
+    def getImageFormat(self):
+        return 'BGRA'
+
+
+class RenderCaptureKrypton(_RenderCaptureBase):
+    def capture(self, width, height):
+        self._request(width, height)
+
+    def getImage(self, msecs=1000):
+        if self._wait(msecs):
+            return self._frame()
+        return bytearray(b'')
+
+
+class RenderCaptureLegacy(_RenderCaptureBase):
+    def __init__(self):
+        super(RenderCaptureLegacy, self).__init__()
+        self.state = CAPTURE_STATE_WORKING
+        self.flags = 0
+        self.image = bytearray(b'')
+
+    def capture(self, width, height, flags=0):
+        self.flags = flags
+        self._request(width, height)
+
+    def waitForCaptureStateChangeEvent(self, msecs=0):
+        if self._wait(msecs):
+            self.state = CAPTURE_STATE_DONE
+            self.image = self._frame()
+            changed = True
+        else:
+            self.state = CAPTURE_STATE_WORKING
+            changed = False
+        if self.flags & CAPTURE_FLAG_CONTINUOUS:
+            self._request(self.width, self.height)
+        return changed
+
+    def getCaptureState(self):
+        return self.state
+
+    def getImage(self):
+        return self.image
+
+
+def RenderCapture():
+    if _config.api == u'legacy':
+        return RenderCaptureLegacy()
+    return RenderCaptureKrypton()
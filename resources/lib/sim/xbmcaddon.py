@@ -0,0 +1,57 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2016 KenV99
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+'''
+Simulated xbmcaddon module. Settings default to resources/settings.xml, overridden by SimConfig.settings.
+'''
+import os
+import xml.etree.ElementTree as ET
+
+import xbmc
+
+_root = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, os.pardir))
+
+
+def _defaults():
+    settings = {}
+    try:
+        tree = ET.parse(os.path.join(_root, u'resources', u'settings.xml'))
+    except (IOError, ET.ParseError):
+        return settings
+    for setting in tree.iter(u'setting'):
+        if setting.get(u'id') is not None:
+            settings[setting.get(u'id')] = setting.get(u'default', u'')
+    return settings
+
+
+class Addon(object):
+    def __init__(self, id=u'testRenderCapture'):
+        self.id = id
+        self.settings = _defaults()
+        self.settings.update(xbmc._config.settings)
+
+    def getSetting(self, id):
+        return unicode(self.settings.get(id, u''))
+
+    def setSetting(self, id, value):
+        self.settings[id] = value
+
+    def getAddonInfo(self, id):
+        info = {u'id': self.id, u'name': self.id, u'path': _root, u'version': u'1.0.0.0',
+                u'profile': os.path.join(os.path.expanduser(u'~/.kodi'), u'userdata', u'addon_data', self.id)}
+        return info.get(id, u'')
@@ -0,0 +1,35 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2016 KenV99
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+'''
+Simulated xbmcgui module, only what the add-on uses.
+'''
+import xbmc
+
+NOTIFICATION_INFO = 'info'
+NOTIFICATION_WARNING = 'warning'
+NOTIFICATION_ERROR = 'error'
+
+
+class Dialog(object):
+    def notification(self, heading, message, icon=NOTIFICATION_INFO, time=5000, sound=True):
+        xbmc.log(msg=u'Notification [%s] %s: %s' % (icon, heading, message), level=xbmc.LOGNOTICE)
+
+    def ok(self, heading, line1, line2='', line3=''):
+        xbmc.log(msg=u'Dialog.ok %s: %s %s %s' % (heading, line1, line2, line3), level=xbmc.LOGNOTICE)
+        return True
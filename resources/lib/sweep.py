@@ -0,0 +1,161 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2016 KenV99
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+'''
+Parameter sweep for the capture benchmark.
+
+A plan is either built from the add-on settings or read from a JSON file, e.g.
+    {"loopsleep": [5, 10], "capturesleep": [0], "timeout": [80, 40, 20], "scale": [2, 4],
+     "frames": 250, "warmup": 10, "randomize": true, "seed": 1, "ci_target": 0.02, "min_frames": 30}
+or with an explicit list of cells:
+    {"cells": [{"loopsleep": 5, "capturesleep": 0, "timeout": 50, "scale": 2, "frames": 500}]}
+'''
+import itertools
+import json
+import random
+
+from resources.lib.utils.kodilogging import KodiLogger
+
+log = KodiLogger.log
+
+PARAMETERS = [u'loopsleep', u'capturesleep', u'timeout', u'scale']
+DEFAULTS = {u'loopsleep': [5], u'capturesleep': [0], u'timeout': [80, 70, 60, 50, 40, 30, 20, 10],
+            u'scale': [2], u'frames': 250, u'warmup': 0, u'randomize': False, u'seed': 0, u'ci_target': 0.0,
+            u'min_frames': 30, u'repeat': True}
+
+
+class SweepCell(object):
+    '''
+    One combination of capture parameters.
+    scale divides the video width and height to give the capture size.
+    '''
+
+    def __init__(self, loopsleep, capturesleep, timeout, scale=2, frames=250, warmup=0):
+        self.loopsleep = int(loopsleep)
+        self.capturesleep = int(capturesleep)
+        self.timeout = int(timeout)
+        self.scale = float(scale)
+        self.frames = int(frames)
+        self.warmup = int(warmup)
+
+    def size(self, videowidth, videoheight):
+        return int(videowidth / self.scale), int(videoheight / self.scale)
+
+    def as_dict(self):
+        return {u'loopsleep': self.loopsleep, u'capturesleep': self.capturesleep, u'timeout': self.timeout,
+                u'scale': self.scale, u'frames': self.frames, u'warmup': self.warmup}
+
+    def __repr__(self):
+        return u'SweepCell(loopsleep=%i, capturesleep=%i, timeout=%i, scale=%s, frames=%i)' % (
+            self.loopsleep, self.capturesleep, self.timeout, self.scale, self.frames)
+
+
+class SweepPlan(object):
+    def __init__(self, cells, randomize=False, seed=0, ci_target=0.0, min_frames=30, repeat=True):
+        if len(cells) == 0:
+            raise ValueError(u'Sweep plan has no cells')
+        self.cells = cells
+        self.randomize = randomize
+        self.rng = random.Random(seed)
+        self.ci_target = float(ci_target)
+        self.min_frames = int(min_frames)
+        self.repeat = repeat
+
+    def passes(self):
+        '''
+        Yields the cells of each pass through the sweep, shuffled per pass when randomize is set.
+        Stops after one pass unless repeat is set.
+        '''
+        while True:
+            order = list(self.cells)
+            if self.randomize:
+                self.rng.shuffle(order)
+            yield order
+            if not self.repeat:
+                break
+
+    def as_dict(self):
+        return {u'cells': [cell.as_dict() for cell in self.cells], u'randomize': self.randomize,
+                u'ci_target': self.ci_target, u'min_frames': self.min_frames, u'repeat': self.repeat}
+
+    @classmethod
+    def from_dict(cls, plan):
+        p = dict(DEFAULTS)
+        p.update(plan)
+        if u'cells' in p:
+            cells = []
+            for c in p[u'cells']:
+                c = dict(c)
+                c.setdefault(u'frames', p[u'frames'])
+                c.setdefault(u'warmup', p[u'warmup'])
+                c.setdefault(u'scale', p[u'scale'][0] if isinstance(p[u'scale'], list) else p[u'scale'])
+                cells.append(SweepCell(**c))
+        else:
+            values = [p[name] if isinstance(p[name], list) else [p[name]] for name in PARAMETERS]
+            cells = [SweepCell(loopsleep, capturesleep, timeout, scale, p[u'frames'], p[u'warmup'])
+                     for loopsleep, capturesleep, timeout, scale in itertools.product(*values)]
+        return cls(cells, randomize=bool(p[u'randomize']), seed=p[u'seed'], ci_target=p[u'ci_target'],
+                   min_frames=p[u'min_frames'], repeat=bool(p[u'repeat']))
+
+
+def load_plan(fn):
+    with open(fn, 'r') as f:
+        return SweepPlan.from_dict(json.load(f))
+
+
+def _numbers(text, cast=int):
+    return [cast(v) for v in text.replace(u';', u',').split(u',') if v.strip() != u'']
+
+
+def _setting(getSetting, name, parse):
+    '''
+    A parsed setting, or its default with a warning when it is blank or invalid
+    '''
+    text = getSetting(name)
+    try:
+        value = parse(text)
+        if value != []:
+            return value
+    except ValueError:
+        pass
+    log(KodiLogger.LOGWARNING, u'Invalid %s setting "%s", using %s', name, text, DEFAULTS[name])
+    return DEFAULTS[name]
+
+
+def plan_from_settings(getSetting):
+    '''
+    Builds the plan from the add-on settings. getSetting is xbmcaddon.Addon().getSetting.
+    A JSON plan file named by the sweep_plan setting takes precedence; when it cannot be read or is not
+    a valid plan, the settings are used.
+    '''
+    planfile = getSetting(u'sweep_plan')
+    if planfile:
+        try:
+            return load_plan(planfile)
+        except (IOError, OSError, ValueError, TypeError) as e:
+            log(KodiLogger.LOGWARNING, u'Sweep plan %s not used: %s', planfile, unicode(e))
+    plan = {}
+    for name in [u'loopsleep', u'capturesleep', u'timeout']:
+        plan[name] = _setting(getSetting, name, _numbers)
+    plan[u'scale'] = _setting(getSetting, u'scale', lambda text: _numbers(text, float))
+    for name in [u'frames', u'warmup', u'seed', u'min_frames']:
+        plan[name] = _setting(getSetting, name, int)
+    plan[u'ci_target'] = _setting(getSetting, u'ci_target', lambda text: float(text) / 100.0)
+    plan[u'randomize'] = getSetting(u'randomize') == u'true'
+    plan[u'repeat'] = getSetting(u'repeat') == u'true'
+    return SweepPlan.from_dict(plan)
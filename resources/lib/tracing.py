@@ -0,0 +1,149 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2016 KenV99
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+'''
+Hot path tracing into a preallocated ring buffer, exported as Chrome trace event JSON
+(load it in chrome://tracing or https://ui.perfetto.dev).
+Tracing is off unless a Tracer is created; call sites check for None so the untraced cost is one test.
+'''
+import array
+import copy
+import itertools
+import json
+import os
+import thread
+import threading
+from timeit import default_timer as timer
+
+
+class Tracer(object):
+    '''
+    Complete events (name, thread, start, end) in a ring of capacity slots; the oldest are overwritten.
+    Slots are claimed with itertools.count, whose next() is atomic under the GIL, so any thread may add.
+    '''
+
+    def __init__(self, capacity=65536):
+        self.capacity = capacity
+        self.start = array.array('d', [0.0]) * capacity
+        self.end = array.array('d', [0.0]) * capacity
+        self.name = array.array('H', [0]) * capacity
+        self.tid = array.array('H', [0]) * capacity
+        self.counter = itertools.count()
+        self.names = {}
+        self.threads = {}
+        self.threadnames = {}
+        self.lock = threading.Lock()
+        self.origin = timer()
+
+    def intern(self, table, key):
+        try:
+            return table[key]
+        except KeyError:
+            with self.lock:
+                return table.setdefault(key, len(table))
+
+    def thread_index(self):
+        ident = thread.get_ident()
+        try:
+            return self.threads[ident]
+        except KeyError:
+            self.threadnames[ident] = threading.current_thread().name  # the thread may be gone by export
+            return self.intern(self.threads, ident)
+
+    def add(self, name, start, end):
+        i = next(self.counter) % self.capacity
+        self.name[i] = self.intern(self.names, name)
+        self.tid[i] = self.thread_index()
+        self.start[i] = start
+        self.end[i] = end
+
+    def count(self):
+        '''
+        Number of events added so far, including overwritten ones
+        '''
+        return next(copy.copy(self.counter))  # a copy, so the count is read without claiming a slot
+
+    def reset(self):
+        '''
+        Forgets every event added so far
+        '''
+        self.counter = itertools.count()
+
+    def events(self):
+        '''
+        Chrome trace events, oldest first, times in microseconds from the tracer's creation
+        '''
+        added = self.count()
+        first = max(0, added - self.capacity)
+        names = dict((v, k) for k, v in self.names.items())
+        pid = os.getpid()
+        events = [{u'ph': u'M', u'name': u'thread_name', u'pid': pid, u'tid': tid,
+                   u'args': {u'name': self.threadnames.get(ident, unicode(ident))}}
+                  for ident, tid in self.threads.items()]
+        for n in xrange(first, added):
+            i = n % self.capacity
+            events.append({u'ph': u'X', u'name': names[self.name[i]], u'pid': pid, u'tid': self.tid[i],
+                           u'ts': round((self.start[i] - self.origin) * 1e6, 3),
+                           u'dur': round((self.end[i] - self.start[i]) * 1e6, 3)})
+        return events
+
+    def export(self, fn, meta=None):
+        with open(fn, 'w') as f:
+            json.dump({u'traceEvents': self.events(), u'displayTimeUnit': u'ms', u'otherData': meta or {}}, f)
+
+
+class TracedRenderCapture(object):
+    '''
+    Wraps RenderCapture so each call is traced without touching the capture functions
+    '''
+
+    def __init__(self, rc, tracer):
+        self.rc = rc
+        self.tracer = tracer
+        if hasattr(rc, 'waitForCaptureStateChangeEvent'):
+            self.waitForCaptureStateChangeEvent = self.traced(u'waitForCaptureStateChangeEvent')
+            self.getCaptureState = self.traced(u'getCaptureState')
+
+    def traced(self, name):
+        fn = getattr(self.rc, name)
+        add = self.tracer.add
+
+        def call(*args):
+            t0 = timer()
+            try:
+                return fn(*args)
+            finally:
+                add(name, t0, timer())
+        return call
+
+    def capture(self, *args):
+        t0 = timer()
+        try:
+            return self.rc.capture(*args)
+        finally:
+            self.tracer.add(u'capture', t0, timer())
+
+    def getImage(self, *args):
+        t0 = timer()
+        try:
+            return self.rc.getImage(*args)
+        finally:
+            self.tracer.add(u'getImage', t0, timer())
+
+    def __getattr__(self, name):
+        return getattr(self.rc, name)
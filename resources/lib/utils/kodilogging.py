@@ -18,8 +18,12 @@
 #
 from __future__ import unicode_literals
 
-import xbmc
+import sys
 import threading
+import Queue
+from timeit import default_timer as timer
+
+import xbmc
 
 def log(loglevel=xbmc.LOGNOTICE, msg=''):
     if isinstance(msg, str):
@@ -36,17 +40,21 @@ class KodiLogger(object):
     LOGNOTICE = 2
     LOGSEVERE = 5
     LOGWARNING = 3
+    LEVELS = {'debug': LOGDEBUG, 'info': LOGINFO, 'notice': LOGNOTICE, 'warning': LOGWARNING, 'error': LOGERROR}
     _instance = None
     _lock = threading.Lock()
-    selfloglevel = xbmc.LOGDEBUG
+    selfloglevel = xbmc.LOGDEBUG  # level of messages logged without one
+    threshold = xbmc.LOGDEBUG  # messages below this level are dropped before any formatting
+    handler = None  # AsyncHandler while asynchronous logging is on
+    sites = {}  # rate limit state per call site
     kodirunning = True
 
     def __new__(cls):
-        if xbmc.getFreeMem() == long():
-            KodiLogger.kodirunning = False
         if KodiLogger._instance is None:
             with KodiLogger._lock:
                 if KodiLogger._instance is None:
+                    if xbmc.getFreeMem() == long():  # checked once, not on every instantiation
+                        KodiLogger.kodirunning = False
                     KodiLogger._instance = super(KodiLogger, cls).__new__(cls)
         return KodiLogger._instance
 
@@ -58,13 +66,122 @@ class KodiLogger(object):
         KodiLogger.selfloglevel = arg
 
     @staticmethod
-    def log(loglevel=None, msg=''):
+    def setThreshold(arg):
+        KodiLogger.threshold = arg
+
+    @staticmethod
+    def isEnabledFor(loglevel):
+        return loglevel >= KodiLogger.threshold
+
+    @staticmethod
+    def setAsync(enabled, maxsize=1024):
+        '''
+        Hands messages to a background thread for formatting and xbmc.log. Messages are dropped
+        (and counted) when maxsize are waiting.
+        '''
+        handler = KodiLogger.handler
+        if enabled and handler is None:
+            handler = AsyncHandler(maxsize)
+            handler.start()
+            KodiLogger.handler = handler
+        elif not enabled and handler is not None:
+            KodiLogger.handler = None
+            handler.stop()
+
+    @staticmethod
+    def log(loglevel=None, msg='', *args, **kwargs):
+        '''
+        msg is %-formatted with args only once the message has passed the level filter, so a filtered
+        call costs one comparison; with async logging the formatting happens on the handler thread, so
+        args should not be changed afterwards. Keyword every=seconds logs a call site at most once per
+        interval and sample=n every nth call; the next message logged reports how many were suppressed.
+        '''
         if loglevel is None:
             loglevel = KodiLogger.selfloglevel
+        if loglevel < KodiLogger.threshold:
+            return
+        suppressed = 0
+        if kwargs:
+            suppressed = KodiLogger.limit(sys._getframe(1), kwargs.get('every', 0.0), kwargs.get('sample', 1))
+            if suppressed < 0:
+                return
+        handler = KodiLogger.handler
+        if handler is not None:
+            handler.put((loglevel, msg, args, suppressed))
+        else:
+            KodiLogger.emit(loglevel, msg, args, suppressed)
+
+    @staticmethod
+    def limit(frame, every, sample):
+        '''
+        Returns -1 when the call site is rate limited, else the number of messages it suppressed
+        since it last logged. Counts may be off by one under concurrent calls from one site.
+        '''
+        key = (frame.f_code, frame.f_lineno)
+        state = KodiLogger.sites.get(key)
+        if state is None:
+            state = KodiLogger.sites.setdefault(key, [float('-inf'), 0, 0])  # last logged, calls, suppressed
+        state[1] += 1
+        now = timer() if every > 0 else 0.0
+        if (every > 0 and now - state[0] < every) or (sample > 1 and (state[1] - 1) % sample != 0):
+            state[2] += 1
+            return -1
+        state[0] = now
+        suppressed, state[2] = state[2], 0
+        return suppressed
+
+    @staticmethod
+    def emit(loglevel, msg, args=(), suppressed=0):
+        if args:
+            try:
+                msg = msg % args
+            except (TypeError, ValueError):
+                msg = '%s %r' % (msg, args)
         if isinstance(msg, str):
-            msg = msg.decode("utf-8")
+            msg = msg.decode("utf-8", 'replace')
+        if suppressed:
+            msg = '%s (%i similar suppressed)' % (msg, suppressed)
         if KodiLogger.kodirunning:
             message = u"$$$ [%s] - %s" % (u'testRenderCapture', msg)
             xbmc.log(msg=message.encode("utf-8", 'replace'), level=loglevel)
         else:
-            print msg
\ No newline at end of file
+            print msg
+
+
+class AsyncHandler(threading.Thread):
+    '''
+    Formats and writes queued messages off the calling thread
+    '''
+
+    def __init__(self, maxsize=1024):
+        super(AsyncHandler, self).__init__(name='KodiLogger')
+        self.daemon = True
+        self.queue = Queue.Queue(maxsize)
+        self.dropped = 0
+
+    def put(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except Queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            KodiLogger.emit(*record)
+        if self.dropped:
+            KodiLogger.emit(KodiLogger.LOGWARNING, '%i log messages dropped, the log queue was full', (self.dropped,))
+
+    def stop(self, timeout=5):
+        self.queue.put(None)
+        self.join(timeout)
+
+
+def logging_from_settings(getSetting):
+    '''
+    Applies the add-on's loglevel (threshold) and log_async settings
+    '''
+    KodiLogger.setThreshold(KodiLogger.LEVELS.get(getSetting('loglevel'), KodiLogger.LOGDEBUG))
+    KodiLogger.setAsync(getSetting('log_async') == 'true')
@@ -0,0 +1,90 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2016 KenV99
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+'''
+Streaming quantile estimation with the P-square algorithm (Jain & Chlamtac, 1985).
+Constant memory and time per value, no samples are stored.
+'''
+
+
+class P2Quantile(object):
+    def __init__(self, p):
+        self.p = float(p)
+        self.count = 0
+        self.q = []  # marker heights
+        self.n = [0.0, 1.0, 2.0, 3.0, 4.0]  # marker positions
+        self.np = [0.0, 2.0 * self.p, 4.0 * self.p, 2.0 + 2.0 * self.p, 4.0]  # desired positions
+        self.dn = [0.0, self.p / 2.0, self.p, (1.0 + self.p) / 2.0, 1.0]
+
+    def add_value(self, x):
+        self.count += 1
+        q = self.q
+        if self.count <= 5:
+            q.append(x)
+            q.sort()
+            return
+        n = self.n
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        for i in xrange(k + 1, 5):
+            n[i] += 1.0
+        for i in xrange(0, 5):
+            self.np[i] += self.dn[i]
+        for i in (1, 2, 3):
+            d = self.np[i] - n[i]
+            if (d >= 1.0 and n[i + 1] - n[i] > 1.0) or (d <= -1.0 and n[i - 1] - n[i] < -1.0):
+                d = 1.0 if d > 0 else -1.0
+                qp = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+                    (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                if not q[i - 1] < qp < q[i + 1]:
+                    j = i + int(d)
+                    qp = q[i] + d * (q[j] - q[i]) / (n[j] - n[i])
+                q[i] = qp
+                n[i] += d
+
+    def value(self):
+        if self.count == 0:
+            return float('nan')
+        if self.count <= 5:
+            return self.q[int(round(self.p * (self.count - 1)))]
+        return self.q[2]
+
+
+class QuantileSketch(object):
+    '''
+    A set of P2Quantile estimators fed from the same stream
+    '''
+
+    def __init__(self, quantiles=(0.5, 0.95, 0.99)):
+        self.estimators = [P2Quantile(p) for p in quantiles]
+
+    def add_value(self, x):
+        for estimator in self.estimators:
+            estimator.add_value(x)
+
+    def values(self):
+        return dict((e.p, e.value()) for e in self.estimators)
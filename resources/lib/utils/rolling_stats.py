@@ -17,40 +17,131 @@
 #    along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
 from collections import deque
-
-import queue
+import threading
 
 try:
-    import xbmc
+    import queue
 except ImportError:
-    from time import sleep
-    import multiprocessing as foo
+    import Queue as queue
 
-    bar = foo.Process
-    foobar = foo.ProcessError
-else:
-    import threading as foo
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
-    bar = foo.Thread
-    foobar = foo.ThreadError
 
+class RollingStats(object):
+    '''
+    Running mean and variance (Welford), optionally over a sliding window of the last windowsize values.
+    Updates happen inline in add_value, there is no worker and no lock: an instance should be fed
+    from one thread, accumulators from several threads can be combined with merge().
+    '''
 
-class RollingStats(bar):
-    def __init__(self, expected_mean=0.0, windowsize=0, sleepinsecs=0.0001):
-        super(RollingStats, self).__init__(name='RollingStats')
-        self.lock = foo.Lock()
-        self.abort_evt = foo.Event()
-        self.valueQ = queue.Queue()
+    def __init__(self, expected_mean=0.0, windowsize=0):
         self.mean = float(expected_mean)
-        self.sleepinsec = sleepinsecs
         self.n = 0
         self.M2 = 0.0
+        self.window = 0
         if windowsize > 0:
             self.window = windowsize
             self.values = deque()
             self.calc = self.calc_window
         else:
             self.calc = self.calc_nowindow
+
+    def stop(self, timeout=5):
+        pass
+
+    def add_value(self, value):
+        self.calc(value)
+
+    def add_values(self, values):
+        '''
+        Adds a batch of values. Without a window the batch statistics are computed in one pass
+        (vectorized when NumPy is available) and merged in with Chan's parallel update.
+        '''
+        if self.window:
+            for value in values:
+                self.calc_window(value)
+            return
+        if numpy is not None:
+            arr = numpy.asarray(values, dtype=numpy.float64).ravel()
+            n = arr.size
+            if n == 0:
+                return
+            mean = float(arr.mean())
+            M2 = float(numpy.dot(arr - mean, arr - mean))
+        else:
+            values = [float(v) for v in values]
+            n = len(values)
+            if n == 0:
+                return
+            mean = sum(values) / n
+            M2 = sum([(v - mean) * (v - mean) for v in values])
+        self.combine(n, mean, M2)
+
+    def combine(self, n, mean, M2):
+        if n == 0:
+            return
+        if self.n == 0:
+            self.n, self.mean, self.M2 = n, mean, M2
+            return
+        total = self.n + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.M2 += M2 + delta * delta * self.n * n / total
+        self.n = total
+
+    def merge(self, other):
+        '''
+        Folds another unwindowed accumulator into this one
+        '''
+        if self.window or other.window:
+            raise ValueError(u'Windowed RollingStats cannot be merged')
+        self.combine(other.n, other.mean, other.M2)
+        return self
+
+    def get_mean(self):
+        return self.mean
+
+    def get_variance(self, population=False):
+        if population:
+            return self.M2 / self.n
+        else:
+            return self.M2 / (self.n - 1)
+
+    def calc_window(self, value):
+        self.values.append(value)
+        if self.n < self.window:
+            self.n += 1
+            d = value - self.mean
+            self.mean += d / self.n
+            self.M2 += d * (value - self.mean)
+        else:
+            valueo = self.values.popleft()
+            meano = self.mean
+            self.mean += (value - valueo) / self.window
+            self.M2 += (value - meano) * (value - self.mean) - (valueo - meano) * (valueo - self.mean)
+
+    def calc_nowindow(self, value):
+        self.n += 1
+        d = value - self.mean
+        self.mean += d / self.n
+        self.M2 += d * (value - self.mean)
+
+
+class ThreadedRollingStats(RollingStats):
+    '''
+    Optional mode: add_value only queues the value and a worker thread folds it in,
+    sleeping sleepinsecs whenever the queue is empty. Readers take a lock.
+    '''
+
+    def __init__(self, expected_mean=0.0, windowsize=0, sleepinsecs=0.0001):
+        super(ThreadedRollingStats, self).__init__(expected_mean, windowsize)
+        self.lock = threading.Lock()
+        self.abort_evt = threading.Event()
+        self.valueQ = queue.Queue()
+        self.sleepinsec = sleepinsecs
         try:
             from xbmc import sleep
             self.using_xbmc = True
@@ -59,7 +150,9 @@ class RollingStats(bar):
             from time import sleep
             self.using_xbmc = False
             self.sleepfn = sleep
-        self.start()
+        self.thread = threading.Thread(target=self.run, name='RollingStats')
+        self.thread.daemon = True
+        self.thread.start()
 
     def sleep(self):
         if self.using_xbmc:
@@ -69,14 +162,15 @@ class RollingStats(bar):
 
     def stop(self, timeout=5):
         self.abort_evt.set()
-        if self.is_alive():
-            try:
-                self.join(timeout)
-            except foobar:
-                pass
+        if self.thread.is_alive():
+            self.thread.join(timeout)
+        self.drain()
 
     def add_value(self, value):
-        with self.lock:
+        self.valueQ.put_nowait(value)
+
+    def add_values(self, values):
+        for value in values:
             self.valueQ.put_nowait(value)
 
     def get_mean(self):
@@ -85,42 +179,23 @@ class RollingStats(bar):
 
     def get_variance(self, population=False):
         with self.lock:
-            if self.window:
-                denominator = self.window
-            else:
-                denominator = self.n
-            if population:
-                return self.M2 / denominator
-            else:
-                return self.M2 / (denominator - 1)
-
-    def calc_window(self, value):
-        self.values.append(value)
-        if self.n < self.window:
-            self.n += 1
-            d = value - self.mean
-            self.mean += d / self.n
-            self.M2 += d * (value - self.mean)
-        else:
-            valueo = self.values.popleft()
-            meano = self.mean
-            self.mean += (value - valueo) / self.window
-            self.M2 += (value - meano) * (value - self.mean) - (valueo - meano) * (valueo - self.mean)
+            return super(ThreadedRollingStats, self).get_variance(population)
 
-    def calc_nowindow(self, value):
-        self.n += 1
-        d = value - self.mean
-        self.mean += d / self.n
-        self.M2 += d * (value - self.mean)
+    def drain(self):
+        while True:
+            try:
+                value = self.valueQ.get_nowait()
+            except queue.Empty:
+                return
+            with self.lock:
+                self.calc(value)
 
     def run(self):
         while not self.abort_evt.is_set():
-            while not self.valueQ.empty():
-                with self.lock:
-                    value = self.valueQ.get_nowait()
-                    self.calc(value)
-            else:
+            if self.valueQ.empty():
                 self.sleep()
+            else:
+                self.drain()
 
 
 if __name__ == '__main__':
@@ -137,5 +212,12 @@ if __name__ == '__main__':
     rs.stop()
     for i, v in enumerate(lst):
         if i >= windowsize:
-            window = lst[i - windowsize:i]
+            window = lst[i - windowsize + 1:i + 1]
             print i, record[i][2], record[i][0], numpy.mean(window), record[i][1], numpy.var(window)
+    a = RollingStats()
+    a.add_values(lst[:50])
+    b = RollingStats()
+    for v in lst[50:]:
+        b.add_value(v)
+    a.merge(b)
+    print 'merged', a.get_mean(), numpy.mean(lst), a.get_variance(), numpy.var(lst, ddof=1)